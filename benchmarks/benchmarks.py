@@ -0,0 +1,172 @@
+"""
+Benchmarks for the core functions of removestar
+
+The benchmarks are written in the asv (airspeed velocity) style: each class
+has a setup() method and time_* methods, which are run for every combination
+of the values in `params`. They can be run with asv, or offline with
+run.py in this directory, which needs nothing but the standard library.
+
+All the inputs are generated, so nothing is downloaded or dynamically
+imported.
+"""
+
+import os
+import shutil
+import tempfile
+
+from removestar.helper import get_diff_text
+from removestar.output import get_colored_diff
+from removestar.removestar import (
+    fix_code,
+    get_mod_filename,
+    get_module_names,
+    get_names,
+    get_names_from_dir,
+    replace_imports,
+)
+
+
+def _names(prefix, n):
+    return [f"{prefix}{i}" for i in range(n)]
+
+
+def _write(path, code):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(code)
+
+
+class _TempDirectory:
+    def setup(self, *params):
+        self.directory = tempfile.mkdtemp(prefix="removestar-bench-")
+        self.make(*params)
+
+    def teardown(self, *params):
+        shutil.rmtree(self.directory)
+
+
+class FixCode(_TempDirectory):
+    """
+    Fix a file that star imports many modules of a package
+    """
+
+    params = [[1, 10, 100], [10, 1000]]
+    param_names = ["modules", "lines"]
+
+    def make(self, modules, lines):
+        package = os.path.join(self.directory, "package")
+        _write(os.path.join(package, "__init__.py"), "")
+        for m in range(modules):
+            code = "".join(f"{name} = {i}\n" for i, name in enumerate(_names(f"m{m}_", 20)))
+            _write(os.path.join(package, f"mod{m}.py"), code)
+        imports = "".join(f"from .mod{m} import *\n" for m in range(modules))
+        body = "".join(f"x{i} = m{i % modules}_{i % 20}\n" for i in range(lines))
+        self.code = imports + body
+        self.file = os.path.join(package, "main.py")
+
+    def time_fix_code(self, modules, lines):
+        # Resolve the modules every time, like a new run would
+        get_module_names.cache_clear()
+        fix_code(self.code, file=self.file, allow_dynamic=False, quiet=True)
+
+
+class ReplaceImports:
+    """
+    Replace star imports with long lists of names, with and without line
+    wrapping
+    """
+
+    params = [[10, 1000, 10000], [100, float("inf")]]
+    param_names = ["names", "max_line_length"]
+
+    def setup(self, names, max_line_length):
+        self.repls = {f"mod{m}": _names(f"m{m}_", names // 10) for m in range(10)}
+        self.code = "".join(f"from mod{m} import *\n" for m in range(10)) + "x = 1\n" * 1000
+
+    def time_replace_imports(self, names, max_line_length):
+        replace_imports(self.code, self.repls, max_line_length=max_line_length, quiet=True)
+
+
+class GetNames:
+    """
+    Get the names defined by a module with a large __all__ or a long body
+    """
+
+    params = [["all", "body"], [100, 10000]]
+    param_names = ["kind", "size"]
+
+    def setup(self, kind, size):
+        if kind == "all":
+            names = _names("name", size)
+            self.code = "".join(f"{name} = 0\n" for name in names) + f"__all__ = {names!r}\n"
+        else:
+            self.code = "".join(
+                f"def f{i}(x):\n    y = x + {i}\n    return y\n\nv{i} = f{i}(1)\n"
+                for i in range(size)
+            )
+
+    def time_get_names(self, kind, size):
+        get_names(self.code)
+
+
+class GetNamesFromDir(_TempDirectory):
+    """
+    Resolve a chain of modules that each star import the next one
+    """
+
+    params = [1, 10, 50]
+    param_names = ["depth"]
+
+    def make(self, depth):
+        package = os.path.join(self.directory, "package")
+        _write(os.path.join(package, "__init__.py"), "")
+        for d in range(depth):
+            star = f"from .mod{d + 1} import *\n" if d + 1 < depth else ""
+            names = "".join(f"{name} = 0\n" for name in _names(f"d{d}_", 50))
+            _write(os.path.join(package, f"mod{d}.py"), star + names)
+        self.package = package
+
+    def time_get_names_from_dir(self, depth):
+        get_module_names.cache_clear()
+        get_names_from_dir(".mod0", self.package, allow_dynamic=False)
+
+
+class GetModFilename(_TempDirectory):
+    """
+    Find the file of a module in a deep package tree
+    """
+
+    params = [1, 10, 50]
+    param_names = ["depth"]
+
+    def make(self, depth):
+        parts = [f"pkg{d}" for d in range(depth)]
+        for d in range(depth):
+            _write(os.path.join(self.directory, *parts[: d + 1], "__init__.py"), "")
+        _write(os.path.join(self.directory, *parts, "mod.py"), "x = 1\n")
+        self.deepest = os.path.join(self.directory, *parts)
+        self.mod = ".".join([*parts, "mod"])
+        self.relative_mod = "." * depth + ".".join([*parts[1:], "mod"])
+
+    def time_absolute(self, depth):
+        get_mod_filename(self.mod, self.deepest)
+
+    def time_relative(self, depth):
+        get_mod_filename(self.relative_mod, self.deepest)
+
+
+class GetColoredDiff:
+    """
+    Color the diff of a long file where every tenth line changed
+    """
+
+    params = [100, 10000]
+    param_names = ["lines"]
+
+    def setup(self, lines):
+        old = [f"x{i} = {i}\n" for i in range(lines)]
+        new = [line if i % 10 else f"y{i} = {i}\n" for i, line in enumerate(old)]
+        self.diff = get_diff_text(old, new, "file.py")
+
+    def time_get_colored_diff(self, lines):
+        get_colored_diff(self.diff)
@@ -0,0 +1,147 @@
+"""
+Run the benchmarks in benchmarks.py without asv, and compare results
+
+Usage:
+
+$ python benchmarks/run.py -o before.json  # Run all the benchmarks
+$ python benchmarks/run.py -o after.json -k FixCode  # Only some of them
+$ python benchmarks/run.py --compare before.json after.json
+
+Each benchmark is timed with timeit. The number of calls per measurement is
+chosen so that a measurement takes at least 0.2 seconds, and the results are
+the minimum and median time per call over --repeat measurements.
+"""
+
+import argparse
+import datetime
+import inspect
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import benchmarks
+from removestar import __version__
+
+
+def iter_benchmarks(pattern=None):
+    """
+    Yield (name, cls, method, params) for each benchmark and combination of
+    parameters, where name is like 'FixCode.time_fix_code(10, 1000)'
+    """
+    for cls_name, cls in inspect.getmembers(benchmarks, inspect.isclass):
+        if cls_name.startswith("_") or cls.__module__ != benchmarks.__name__:
+            continue
+        params = getattr(cls, "params", [])
+        # asv allows a single list for a single parameter
+        if params and not isinstance(params[0], (list, tuple)):
+            params = [params]
+        for method in sorted(name for name in dir(cls) if name.startswith("time_")):
+            for combination in itertools.product(*params):
+                name = f"{cls_name}.{method}({', '.join(map(repr, combination))})"
+                if pattern is None or pattern in name:
+                    yield name, cls, method, combination
+
+
+def run_benchmark(cls, method, params, repeat):
+    benchmark = cls()
+    if hasattr(benchmark, "setup"):
+        benchmark.setup(*params)
+    try:
+        timer = timeit.Timer(lambda: getattr(benchmark, method)(*params))
+        number, _ = timer.autorange()
+        number = max(1, number)
+        times = sorted(t / number for t in timer.repeat(repeat=repeat, number=number))
+    finally:
+        if hasattr(benchmark, "teardown"):
+            benchmark.teardown(*params)
+    return {"min": times[0], "median": times[len(times) // 2], "number": number}
+
+
+def metadata():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            encoding="utf-8",
+            check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "removestar": __version__,
+        "commit": commit,
+        "python": sys.version,
+        "platform": platform.platform(),
+        "date": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+    }
+
+
+def compare(old_file, new_file, threshold):
+    """
+    Print the ratio of the median times in new_file to old_file
+
+    Returns True if any benchmark is slower by more than the factor
+    threshold.
+    """
+    with open(old_file) as f:
+        old = json.load(f)["results"]
+    with open(new_file) as f:
+        new = json.load(f)["results"]
+    slower = False
+    for name in sorted(old.keys() & new.keys()):
+        ratio = new[name]["median"] / old[name]["median"]
+        mark = ""
+        if ratio > threshold:
+            mark = "  slower"
+            slower = True
+        elif ratio < 1 / threshold:
+            mark = "  faster"
+        print(
+            f"{name:60} {old[name]['median']:10.3g}s {new[name]['median']:10.3g}s "
+            f"{ratio:6.2f}x{mark}"
+        )
+    return slower
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("-o", "--output", metavar="FILE", help="Write the results as JSON to FILE.")
+    parser.add_argument(
+        "-k", metavar="PATTERN", help="Only run the benchmarks whose name contains PATTERN."
+    )
+    parser.add_argument("--repeat", type=int, default=5, help="The number of measurements.")
+    parser.add_argument(
+        "--compare", nargs=2, metavar=("OLD", "NEW"), help="Compare two JSON result files."
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=1.1,
+        help="With --compare, exit with status 1 if a benchmark is slower by this factor.",
+    )
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(compare(*args.compare, args.threshold))
+
+    results = {}
+    for name, cls, method, params in iter_benchmarks(args.k):
+        results[name] = run_benchmark(cls, method, params, args.repeat)
+        print(f"{name:60} {results[name]['median']:10.3g}s", flush=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"metadata": metadata(), "results": results}, f, indent=2)
+            f.write("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -1 +1,13 @@
 from ._version import __version__  # noqa: F401
+
+__all__ = ["FixResult", "fix_paths"]
+
+
+def __getattr__(name):
+    # Imported when first used, so that importing removestar (as
+    # removestar-client does) doesn't import pyflakes
+    if name in __all__:
+        from . import batch
+
+        return getattr(batch, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
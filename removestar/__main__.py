@@ -15,17 +15,25 @@ $ removestar -i module/ # Modifies every Python file in module/ recursively
 """
 
 import argparse
-import glob
-import importlib.util
+import contextlib
+import functools
 import io
+import json
 import os
 import sys
-import tempfile
+from pathlib import Path
 
-from . import __version__
+from . import __version__, timings
+from .batch import fix_path
+from .cache import CACHE_DIR, ExportCache
 from .helper import get_diff_text
-from .output import get_colored_diff, red
-from .removestar import fix_code
+from .importer import ImportPool
+from .index import ProjectIndex
+from .output import get_colored_diff, green, red
+from .removestar import fix_code, may_contain_star_import, print_messages
+from .timings import Timings
+from .walk import iter_paths
+from .writer import Writer, write_atomic
 
 
 class RawDescriptionHelpArgumentDefaultsHelpFormatter(
@@ -34,7 +42,17 @@ class RawDescriptionHelpArgumentDefaultsHelpFormatter(
     pass
 
 
-def main():  # noqa: PLR0912, C901
+def main(argv=None, *, session=None):
+    """
+    Run removestar with the command line arguments argv (sys.argv[1:] by
+    default)
+
+    If session is a daemon Session (see daemon.py), its caches and import
+    processes are used instead of new ones.
+    """
+    if argv is None:
+        argv = sys.argv[1:]
+
     parser = argparse.ArgumentParser(
         description=__doc__,
         prog="removestar",
@@ -58,7 +76,7 @@ def main():  # noqa: PLR0912, C901
         "--no-dynamic-importing",
         action="store_false",
         dest="allow_dynamic",
-        help="""Don't dynamically import modules to determine the list of names. This is required for star imports from external modules and modules in the standard library.""",  # noqa: E501
+        help="""Don't dynamically import modules to determine the list of names. Star imports from external modules and modules in the standard library are then only supported if the names can be found by parsing the module.""",  # noqa: E501
     )
     parser.add_argument(
         "-v",
@@ -78,10 +96,109 @@ def main():  # noqa: PLR0912, C901
         default=100,
         help="""The maximum line length for replaced imports before they are wrapped. Set to 0 to disable line wrapping.""",  # noqa: E501
     )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=_jobs,
+        default=1,
+        metavar="N",
+        help="""Process files in N parallel worker processes. Use 'auto' for one per CPU.""",
+    )
+    parser.add_argument(
+        "--cache",
+        action="store_true",
+        help="""Cache the names exported by star imported modules on disk so that later runs can reuse them.""",  # noqa: E501
+    )
+    parser.add_argument(
+        "--cache-dir",
+        default=CACHE_DIR,
+        metavar="DIR",
+        help="""The directory used by --cache.""",
+    )
+    parser.add_argument(
+        "--import-timeout",
+        type=float,
+        default=60,
+        metavar="SECONDS",
+        help="""The maximum time for dynamically importing a module.""",
+    )
+    parser.add_argument(
+        "--import-memory-limit",
+        type=int,
+        metavar="MB",
+        help="""Limit the memory of the processes that dynamically import modules (only on Unix).""",  # noqa: E501
+    )
+    parser.add_argument(
+        "--changed",
+        action="append",
+        metavar="PATH",
+        help="""Only check the files affected by a change to PATH: PATH itself and the files that star import it, directly or transitively. Can be given multiple times.""",  # noqa: E501
+    )
+    parser.add_argument(
+        "--changed-since",
+        metavar="REV",
+        help="""Only check the files affected by the changes since the git revision REV, including uncommitted changes (see --changed).""",  # noqa: E501
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="""After fixing the files, keep watching them and fix the files affected by each change, until interrupted.""",  # noqa: E501
+    )
+    parser.add_argument(
+        "--timings",
+        action="store_true",
+        help="""Print the time spent in each phase of the run, and the slowest files and star imported modules.""",  # noqa: E501
+    )
+    parser.add_argument(
+        "--timings-top",
+        type=int,
+        default=10,
+        metavar="N",
+        help="""The number of files and modules listed by --timings.""",
+    )
+    parser.add_argument(
+        "--stdin-filename",
+        metavar="PATH",
+        help="""With the path '-', read the code from standard input and write only the fixed code to standard output. Star imports are resolved as if the code was in the file PATH.""",  # noqa: E501
+    )
+    parser.add_argument(
+        "--fsync",
+        action="store_true",
+        help="""With -i, flush every written file to disk before it replaces the original. Files are always written to a temporary file first, so that they are never left half written.""",  # noqa: E501
+    )
+    parser.add_argument(
+        "--exclude",
+        action="append",
+        metavar="PATTERN",
+        help="""Skip the files and directories matching the glob PATTERN (by name or by path relative to the given directory) when searching directories. Replaces the default list of excluded directories (build, dist, node_modules, venv, ...). Can be given multiple times.""",  # noqa: E501
+    )
+    parser.add_argument(
+        "--extend-exclude",
+        action="append",
+        metavar="PATTERN",
+        help="""Like --exclude, but adds to the excluded patterns instead of replacing them.""",
+    )
+    parser.add_argument(
+        "--no-gitignore",
+        action="store_false",
+        dest="gitignore",
+        help="""Don't skip the files ignored by .gitignore files when searching directories.""",
+    )
+    parser.add_argument(
+        "--format",
+        choices=["diff", "ndjson"],
+        default="diff",
+        help="""The output format. 'ndjson' prints a JSON object for each file as soon as it is done, with the replacements, warnings, errors, whether it changed and timings, instead of a colored diff.""",  # noqa: E501
+    )
+    parser.add_argument(
+        "--ndjson-diff",
+        action="store_true",
+        help="""With --format ndjson, also include the diff of each changed file.""",
+    )
     # For testing
     parser.add_argument("--_this-file", action="store_true", help=argparse.SUPPRESS)
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     if args._this_file:
         print(__file__, end="")
@@ -90,156 +207,401 @@ def main():  # noqa: PLR0912, C901
     if args.max_line_length == 0:
         args.max_line_length = float("inf")
 
-    try:
-        import nbformat
-        from nbconvert import PythonExporter
+    if _check_stdin_args(parser, args):
+        sys.exit(_fix_stdin(args, session))
+
+    files = [
+        file
+        for file in iter_paths(
+            args.paths,
+            exclude=args.exclude,
+            extend_exclude=args.extend_exclude or (),
+            gitignore=args.gitignore,
+        )
+        if not (args.skip_init and os.path.basename(file) == "__init__.py")
+    ]
+
+    changed, unchanged_exports = _get_changed(parser, args)
+
+    # Started first so that no changes are missed
+    watcher = _make_watcher(args) if args.watch else None
+
+    recorded = Timings() if args.timings else None
+    importer, cache, context = _resources(args, session)
+    with context, recorded.activate() if recorded is not None else contextlib.nullcontext():
+        # Resolve everything that is star imported once, before fixing
+        # anything
+        index = ProjectIndex(
+            [file for file in files if file.endswith(".py")],
+            allow_dynamic=args.allow_dynamic,
+            cache=cache,
+            importer=importer,
+        )
+
+        if changed is not None:
+            affected = index.affected(changed, unchanged_exports or ())
+            files = [file for file in files if Path(file).resolve() in affected]
+            if args.verbose:
+                print(
+                    green(f"Checking {len(files)} files affected by the changes"),
+                    file=sys.stderr,
+                )
 
-        from .removestar import replace_in_nb
-    except ImportError:
-        pass
+        statuses = _fix_files(files, args, index)
+        if watcher is not None:
+            _watch(watcher, files, args, index)
+
+    if args.verbose:
+        print(
+            green(f"Skipped {statuses.count('skipped')} files without star imports"),
+            file=sys.stderr,
+        )
+    if recorded is not None:
+        print(recorded.summary(args.timings_top), file=sys.stderr)
+    if "changed" in statuses:
+        sys.exit(1)
 
-    exit_1 = False
-    for file in _iter_paths(args.paths):
-        _, filename = os.path.split(file)
-        if args.skip_init and filename == "__init__.py":
-            continue
-
-        if not os.path.isfile(file):
-            print(red(f"Error: {file}: no such file or directory"), file=sys.stderr)
-            continue
-        if file.endswith(".py"):
-            with open(file, encoding="utf-8") as f:
-                code = f.read()
-
-            try:
-                new_code = fix_code(
-                    code,
-                    file=file,
-                    max_line_length=args.max_line_length,
-                    verbose=args.verbose,
-                    quiet=args.quiet,
-                    allow_dynamic=args.allow_dynamic,
-                )
-            except (RuntimeError, NotImplementedError) as e:
-                if not args.quiet:
-                    print(red(f"Error with {file}: {e}"), file=sys.stderr)
-                continue
-
-            if new_code != code:
-                exit_1 = True
-                if args.in_place:
-                    with open(file, "w", encoding="utf-8") as f:
-                        f.write(new_code)
-                    if not args.quiet:
-                        print(
-                            get_colored_diff(
-                                get_diff_text(
-                                    io.StringIO(code).readlines(),
-                                    io.StringIO(new_code).readlines(),
-                                    file,
-                                )
-                            )
-                        )
-                else:
-                    print(
-                        get_colored_diff(
-                            get_diff_text(
-                                io.StringIO(code).readlines(),
-                                io.StringIO(new_code).readlines(),
-                                file,
-                            )
-                        )
-                    )
-        elif (
-            file.endswith(".ipynb")
-            and importlib.util.find_spec("nbconvert") is not None
-            and importlib.util.find_spec("nbformat") is not None
-        ):
-            tmp_file = tempfile.NamedTemporaryFile()  # noqa: SIM115
-            tmp_path = tmp_file.name
-
-            with open(file) as f:
-                nb = nbformat.reads(f.read(), nbformat.NO_CONVERT)
-
-            ## save as py
-            exporter = PythonExporter()
-            code, _ = exporter.from_notebook_node(nb)
-            tmp_file.write(code.encode("utf-8"))
-
-            try:
-                new_code = fix_code(
-                    code=code,
-                    file=tmp_path,
-                    max_line_length=args.max_line_length,
-                    verbose=args.verbose,
-                    quiet=args.quiet,
-                    allow_dynamic=args.allow_dynamic,
-                    return_replacements=True,
-                )
-                new_code_not_dict = fix_code(
-                    code=code,
-                    file=tmp_path,
-                    max_line_length=args.max_line_length,
-                    verbose=False,
-                    quiet=True,
-                    allow_dynamic=args.allow_dynamic,
-                    return_replacements=False,
-                )
-            except (RuntimeError, NotImplementedError) as e:
-                if not args.quiet:
-                    print(red(f"Error with {file}: {e}"), file=sys.stderr)
-                continue
-
-            tmp_file.close()
-
-            if new_code_not_dict != code:
-                exit_1 = True
-                if args.in_place:
-                    with open(file) as f:
-                        nb = nbformat.reads(f.read(), nbformat.NO_CONVERT)
-                        fixed_code = replace_in_nb(
-                            nb,
-                            new_code,
-                            cell_type="code",
-                        )
-
-                    with open(file, "w+") as f:
-                        f.writelines(fixed_code)
-
-                    if not args.quiet:
-                        print(
-                            get_colored_diff(
-                                get_diff_text(
-                                    io.StringIO(code).readlines(),
-                                    io.StringIO(new_code_not_dict).readlines(),
-                                    file,
-                                )
-                            )
-                        )
+
+def _resources(args, session):
+    """
+    Get the ImportPool and ExportCache to use for the command line arguments
+    args, and a context manager that closes them
+
+    Modules are dynamically imported in separate processes, which are only
+    started if needed. A daemon session keeps them between runs.
+    """
+    import_options = {
+        "timeout": args.import_timeout,
+        "memory_limit": (
+            args.import_memory_limit * 2**20 if args.import_memory_limit is not None else None
+        ),
+    }
+    cache_dir = args.cache_dir if args.cache else None
+    if session is not None:
+        return (
+            session.get_importer(**import_options),
+            session.get_cache(cache_dir),
+            contextlib.nullcontext(),
+        )
+    importer = ImportPool(**import_options)
+    return importer, ExportCache(cache_dir), importer
+
+
+def _get_changed(parser, args):
+    """
+    Get the changed files and the files with unchanged exports (see
+    ProjectIndex.affected()) for --changed and --changed-since
+
+    Returns (None, None) if neither was given.
+    """
+    changed = unchanged_exports = None
+    if args.changed_since is not None:
+        from .incremental import changed_since
+
+        try:
+            changed, unchanged_exports = changed_since(args.changed_since)
+        except RuntimeError as e:
+            parser.error(str(e))
+    if args.changed is not None:
+        changed = [*(changed or []), *args.changed]
+    return changed, unchanged_exports
+
+
+def _make_watcher(args):
+    from .watch import make_watcher
+
+    return make_watcher(
+        args.paths,
+        exclude=args.exclude,
+        extend_exclude=args.extend_exclude or (),
+        gitignore=args.gitignore,
+    )
+
+
+def _check_stdin_args(parser, args):
+    """
+    Return True if the code should be read from standard input (the path
+    '-'), and exit with an error if the arguments can't be used with it
+    """
+    if args.ndjson_diff and args.format != "ndjson":
+        parser.error("--ndjson-diff requires --format ndjson")
+    if "-" not in args.paths:
+        if args.stdin_filename is not None:
+            parser.error("--stdin-filename requires the path '-'")
+        return False
+    if args.paths != ["-"]:
+        parser.error("'-' cannot be used with other paths")
+    if args.in_place or args.watch or args.changed or args.changed_since:
+        parser.error("-i, --watch, --changed and --changed-since cannot be used with '-'")
+    if args.format != "diff":
+        parser.error("--format ndjson cannot be used with '-'")
+    return True
+
+
+def _fix_stdin(args, session):
+    """
+    Fix the code from standard input and write it to standard output, for
+    the path '-'
+
+    Only the fixed code is written, not a diff. Warnings and errors are
+    printed to standard error as usual. Returns the exit status, which is 1
+    if the code could not be decoded or fixed (nothing is written then).
+    """
+    file = args.stdin_filename or "-"
+    data = sys.stdin.buffer.read()
+    try:
+        # Decode the same way as open(file, encoding="utf-8") would
+        code = data.decode("utf-8").replace("\r\n", "\n").replace("\r", "\n")
+    except UnicodeDecodeError as e:
+        # Like a file that can't be read, this is reported even with -q
+        print(red(f"Error with {file}: {e}"), file=sys.stderr)
+        return 1
+    if not may_contain_star_import(data) or (
+        args.skip_init and os.path.basename(file) == "__init__.py"
+    ):
+        sys.stdout.write(code)
+        return 0
+
+    importer, cache, context = _resources(args, session)
+    with context:
+        index = ProjectIndex(allow_dynamic=args.allow_dynamic, cache=cache, importer=importer)
+        try:
+            # The code is not the contents of file, so its analysis must not
+            # be cached for it (cache=None). The star imported modules are
+            # still looked up in the cache through the index.
+            new_code = fix_code(
+                code,
+                file=file,
+                max_line_length=args.max_line_length,
+                verbose=args.verbose,
+                quiet=args.quiet,
+                allow_dynamic=args.allow_dynamic,
+                cache=None,
+                index=index,
+            )
+        except (RuntimeError, NotImplementedError) as e:
+            if not args.quiet:
+                print(red(f"Error with {file}: {e}"), file=sys.stderr)
+            return 1
+    sys.stdout.write(new_code)
+    return 0
+
+
+def _watch(watcher, files, args, index):
+    """
+    Fix the files affected by each change found by watcher, until interrupted
+    """
+    files = {Path(file).resolve(): file for file in files}
+    print(green("Watching for changes (press Ctrl-C to stop)"), file=sys.stderr)
+    try:
+        while True:
+            changed = watcher.wait()
+            for file in changed:
+                if os.path.isfile(file) and not (
+                    args.skip_init and os.path.basename(file) == "__init__.py"
+                ):
+                    files.setdefault(Path(file).resolve(), file)
                 else:
-                    print(
-                        get_colored_diff(
-                            get_diff_text(
-                                io.StringIO(code).readlines(),
-                                io.StringIO(new_code_not_dict).readlines(),
-                                file,
-                            )
-                        )
-                    )
-
-    if exit_1:
-        sys.exit(1)
+                    files.pop(Path(file).resolve(), None)
+            # The caches of the changed modules, and of the modules that star
+            # import them, are invalidated, and everything else is kept.
+            affected = index.invalidate(changed)
+            with _background_writer(args) as writer:
+                for file in sorted(files[file] for file in affected if file in files):
+                    with timings.file(file):
+                        _fix_file(file, args, index, writer)
+    except KeyboardInterrupt:
+        pass
 
 
-def _iter_paths(paths):
-    for path in paths:
-        if os.path.isdir(path):
-            for file in glob.iglob(path + "/**", recursive=True):
-                if not file.endswith(".py") and not file.endswith(".ipynb"):
-                    continue
-                yield file
-        else:
-            yield path
+def _fix_files(files, args, index):
+    """
+    Fix the files according to the command line arguments args, resolving
+    star imports with the ProjectIndex index
+
+    Returns the status of each file (see _fix_file()).
+    """
+    statuses = []
+    if args.jobs == 1:
+        # The files are written in the background while the next ones are
+        # fixed
+        with _background_writer(args) as writer:
+            for file in files:
+                with timings.file(file):
+                    statuses.append(_fix_file(file, args, index, writer))
+    else:
+        # Each worker is sent a copy of the index and chunks of paths, and
+        # does all the reading, fixing and writing itself. The output of each
+        # file is captured and printed here in the original order so that it
+        # is deterministic.
+        from concurrent.futures import ProcessPoolExecutor
+
+        chunksize = max(1, len(files) // (args.jobs * 4))
+        with ProcessPoolExecutor(
+            max_workers=args.jobs, initializer=_init_worker, initargs=(args, index)
+        ) as executor:
+            for status, out, err, recorded in executor.map(
+                _fix_file_captured, files, chunksize=chunksize
+            ):
+                sys.stdout.write(out)
+                sys.stderr.write(err)
+                statuses.append(status)
+                if recorded is not None:
+                    timings.current().merge(recorded)
+    return statuses
+
+
+def _fix_file(file, args, index, writer=None):
+    """
+    Fix a single file according to the command line arguments args, resolving
+    star imports with the ProjectIndex index
+
+    With --in-place, the file is written by the Writer writer if it is given,
+    or else right away.
+
+    Returns "changed" if the file was (or would be) changed, or could not be
+    written, "unchanged" if it was not, "skipped" if it was skipped without
+    being parsed because it cannot contain a star import, or "error".
+    """
+    result = fix_path(
+        file,
+        index=index,
+        in_place=args.in_place,
+        max_line_length=args.max_line_length,
+        verbose=args.verbose,
+        fsync=args.fsync,
+        write=_write_function(args, writer),
+    )
+    if args.format == "ndjson":
+        _print_ndjson(result, args)
+    elif result.error is not None and result.original is None:
+        # The file could not be read
+        print(red(f"Error: {result.error}"), file=sys.stderr)
+    else:
+        print_messages(result.messages, quiet=args.quiet)
+        if result.error is not None and result.changed:
+            # The file could not be written
+            print(red(f"Error with {file}: {result.error}"), file=sys.stderr)
+        elif result.error is not None:
+            if not args.quiet:
+                print(red(f"Error with {file}: {result.error}"), file=sys.stderr)
+        elif result.changed and not (args.in_place and args.quiet):
+            _print_diff(result.original, result.fixed, file)
+    return result.status
+
+
+def _print_ndjson(result, args):
+    """
+    Print the FixResult result as a line of JSON for --format ndjson
+
+    The object has the keys "path", "status" (see _fix_file()), "changed",
+    "replacements" (mapping each replaced import statement to its
+    replacement, as from replace_imports(return_replacements=True)),
+    "names" (mapping each star imported module to the names imported from
+    it instead), "warnings", "error" and "timings" (the seconds spent
+    reading, fixing and writing the file). With --ndjson-diff, changed files
+    also have a "diff" (without colors). The line is flushed immediately so
+    that it can be read while the other files are fixed.
+    """
+    record = {
+        "path": result.path,
+        "status": result.status,
+        "changed": result.changed,
+        "replacements": result.statements if result.changed else {},
+        "names": result.replacements,
+        "warnings": result.warnings,
+        "error": result.error,
+        "timings": result.timings,
+    }
+    if args.ndjson_diff and result.changed:
+        with timings.phase("diff"):
+            record["diff"] = get_diff_text(
+                io.StringIO(result.original).readlines(),
+                io.StringIO(result.fixed).readlines(),
+                result.path,
+            )
+    print(json.dumps(record), flush=True)
+
+
+@contextlib.contextmanager
+def _background_writer(args):
+    """
+    Get a Writer for the files written with --in-place, or None without it
+
+    The errors from writing the files are printed when it is closed, and the
+    time spent writing them is added to the active Timings. With --format
+    ndjson, the files are written right away instead, so that the errors are
+    in the record of each file.
+    """
+    if not args.in_place or args.format == "ndjson":
+        yield None
+        return
+    writer = Writer(fsync=args.fsync)
+    try:
+        yield writer
+    finally:
+        for file, e in writer.close():
+            reason = getattr(e, "strerror", None) or e
+            print(red(f"Error with {file}: Could not write the file: {reason}"), file=sys.stderr)
+        if timings.current() is not None:
+            timings.current().merge(writer.timings)
+
+
+def _write_function(args, writer):
+    """
+    Get the function write(file, data) that writes files, with the Writer
+    writer if there is one
+    """
+    if writer is not None:
+        return writer.write
+    return functools.partial(write_atomic, fsync=args.fsync)
+
+
+def _print_diff(code, new_code, file):
+    with timings.phase("diff"):
+        diff = get_diff_text(io.StringIO(code).readlines(), io.StringIO(new_code).readlines(), file)
+    with timings.phase("color"):
+        diff = get_colored_diff(diff)
+    print(diff)
+
+
+_worker_args = None
+_worker_index = None
+
+
+def _init_worker(args, index):
+    global _worker_args, _worker_index  # noqa: PLW0603
+    _worker_args = args
+    _worker_index = index
+
+
+def _fix_file_captured(file):
+    """
+    Run _fix_file() in a worker process, capturing its output
+
+    Returns a tuple (status, stdout, stderr, timings), where timings is the
+    Timings of the file with --timings, or None.
+    """
+    out, err = io.StringIO(), io.StringIO()
+    stdout, stderr = contextlib.redirect_stdout(out), contextlib.redirect_stderr(err)
+    recorded = Timings() if _worker_args.timings else None
+    activate = recorded.activate() if recorded is not None else contextlib.nullcontext()
+    # timings.file() uses the Timings activated before it
+    with stdout, stderr, activate, timings.file(file):
+        status = _fix_file(file, _worker_args, _worker_index)
+    return status, out.getvalue(), err.getvalue(), recorded
+
+
+def _jobs(value):
+    if value == "auto":
+        return os.cpu_count() or 1
+    try:
+        jobs = int(value)
+    except ValueError:
+        jobs = 0
+    if jobs < 1:
+        raise argparse.ArgumentTypeError(f"invalid number of jobs: {value!r}")
+    return jobs
 
 
 if __name__ == "__main__":
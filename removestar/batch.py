@@ -0,0 +1,235 @@
+"""
+Python API for fixing many files
+
+fix_paths() does what the removestar command does for each file (reading,
+skipping files without star imports, fixing, and writing), but yields the
+results instead of printing them.
+"""
+
+import functools
+import os
+import time
+
+from . import timings
+from .cache import ExportCache
+from .index import ProjectIndex
+from .notebook import fix_notebook_code, read_notebook, write_notebook
+from .removestar import (
+    get_replacements,
+    may_contain_star_import,
+    replace_imports_and_statements,
+)
+from .walk import iter_paths
+from .writer import text_bytes, write_atomic
+
+
+class FixResult:
+    """
+    The result of fixing a single file with fix_paths()
+
+    Attributes:
+
+    - path: the path of the file, as given or as found in a directory.
+    - status: "changed" if the file was (or would be, without in_place)
+      changed, or needs to be changed but could not be written, "unchanged",
+      "skipped" if it was skipped without being parsed because it cannot
+      contain a star import, or "error".
+    - original, fixed: the code before and after fixing it. For notebooks,
+      this is the code of all the code cells. fixed is None if the file was
+      skipped or could not be fixed.
+    - replacements: a dictionary mapping each star imported module to the
+      names that are imported from it instead.
+    - statements: a dictionary mapping each replaced star import statement
+      to its replacement, as from replace_imports(return_replacements=True).
+    - messages: a list of tuples (kind, message) with the warnings and, with
+      verbose=True, the other messages (see
+      removestar.removestar.print_messages()).
+    - warnings: a list of the warning messages.
+    - error: the error message if the file could not be read, fixed or
+      written, else None. original is None if it could not be read.
+    - timings: a dictionary with the time in seconds spent reading ("read"),
+      fixing ("fix") and writing ("write") the file. If the write function
+      given to fix_path() only queues the file, like Writer.write() (from
+      removestar.writer), "write" is the time spent queueing it.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.status = "unchanged"
+        self.original = None
+        self.fixed = None
+        self.replacements = {}
+        self.statements = {}
+        self.messages = []
+        self.error = None
+        self.timings = {"read": 0.0, "fix": 0.0, "write": 0.0}
+
+    @property
+    def changed(self):
+        return self.status == "changed"
+
+    @property
+    def warnings(self):
+        return [message for kind, message in self.messages if kind == "warning"]
+
+    def __repr__(self):
+        return f"<FixResult {self.path!r}: {self.status}>"
+
+
+def fix_paths(  # noqa: PLR0913
+    paths,
+    *,
+    in_place=False,
+    skip_init=True,
+    max_line_length=100,
+    allow_dynamic=True,
+    cache=None,
+    index=None,
+    exclude=None,
+    extend_exclude=(),
+    gitignore=True,
+    fsync=False,
+):
+    """
+    Fix the Python files and notebooks in `paths`, and yield a FixResult for
+    each of them
+
+    Directories in paths are searched recursively, skipping what is excluded
+    by exclude, extend_exclude and gitignore (see
+    removestar.walk.iter_paths()). The files are only written if
+    in_place=True. They are written atomically, and flushed to disk before
+    replacing the original if fsync=True (see removestar.writer).
+    __init__.py files are skipped (without a result) if skip_init=True.
+    max_line_length and allow_dynamic are the same as for fix_code().
+
+    If a Timings (from removestar.timings) is active, the time of each phase,
+    file and module is recorded in it too.
+
+    The star imported modules are resolved through a single ProjectIndex
+    (from removestar.index), so every module is only resolved once for all
+    the files. A configured index can be given as index, or else one is made
+    with the ExportCache cache. The files are only read as they are fixed,
+    and once a file has been yielded, its analysis is removed from the cache,
+    and so are its names unless it is star imported (see
+    ProjectIndex.forget_fixed()). What is kept in memory grows with the
+    number of star imported modules and the directories they are imported
+    from, not with the number of files.
+    """
+    if index is None:
+        index = ProjectIndex(
+            allow_dynamic=allow_dynamic, cache=cache if cache is not None else ExportCache()
+        )
+    for file in iter_paths(
+        paths, exclude=exclude, extend_exclude=extend_exclude, gitignore=gitignore
+    ):
+        if skip_init and os.path.basename(file) == "__init__.py":
+            continue
+        with timings.file(file):
+            result = fix_path(
+                file,
+                index=index,
+                in_place=in_place,
+                max_line_length=max_line_length,
+                fsync=fsync,
+            )
+        yield result
+        index.forget_fixed(file)
+
+
+def fix_path(  # noqa: PLR0913
+    file, *, index, in_place=False, max_line_length=100, verbose=False, fsync=False, write=None
+):
+    """
+    Fix the Python file or notebook `file`, resolving star imports with the
+    ProjectIndex index, and return a FixResult
+
+    With in_place=True, the file is written with write(file, data), which is
+    removestar.writer.write_atomic() by default. verbose is the same as for
+    fix_code(). See fix_paths() for the other arguments.
+    """
+    result = FixResult(file)
+    start = time.perf_counter()
+    read = _read(result)
+    if read is None:
+        return result
+    notebook, code = read
+    result.original = code
+    result.timings["read"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    try:
+        if notebook is not None:
+            result.fixed, repls, result.statements, result.messages = fix_notebook_code(
+                code, file=file, max_line_length=max_line_length, verbose=verbose, index=index
+            )
+        else:
+            repls, result.messages = get_replacements(
+                code, file=file, cache=index.cache, index=index
+            )
+            with timings.phase("replace"):
+                result.fixed, result.statements, messages = replace_imports_and_statements(
+                    code, repls, file=file, verbose=verbose, max_line_length=max_line_length
+                )
+            result.messages += messages
+    except (RuntimeError, NotImplementedError) as e:
+        result.status = "error"
+        result.error = str(e)
+    else:
+        result.replacements = {mod: sorted(names) for mod, names in repls.items()}
+        if result.fixed != code:
+            result.status = "changed"
+    result.timings["fix"] = time.perf_counter() - start
+
+    if in_place and result.changed:
+        if write is None:
+            write = functools.partial(write_atomic, fsync=fsync)
+        start = time.perf_counter()
+        try:
+            with timings.phase("write"):
+                if notebook is None:
+                    write(file, text_bytes(result.fixed))
+                else:
+                    write_notebook(file, notebook, code, result.statements, write=write)
+        except OSError as e:
+            # The status stays "changed", since the file still needs fixing
+            result.error = f"Could not write the file: {e.strerror}"
+        result.timings["write"] = time.perf_counter() - start
+    return result
+
+
+def _read(result):
+    """
+    Read the file of the FixResult result
+
+    Returns a tuple (notebook, code), where notebook is None for Python
+    files, or None if the file is not fixed, with the status of result set.
+    """
+    file = result.path
+    if not os.path.isfile(file):
+        result.status = "error"
+        result.error = f"{file}: no such file or directory"
+        return None
+    try:
+        with timings.phase("read"), open(file, "rb") as f:
+            data = f.read()
+    except OSError as e:
+        result.status = "error"
+        result.error = f"{file}: {e.strerror}"
+        return None
+    if not may_contain_star_import(data):
+        result.status = "skipped"
+        return None
+
+    try:
+        if file.endswith(".ipynb"):
+            return read_notebook(data)
+        if file.endswith(".py"):
+            # Decode the same way as open(file, encoding="utf-8") would
+            return None, data.decode("utf-8").replace("\r\n", "\n").replace("\r", "\n")
+    except ImportError as e:
+        # Old notebooks can only be read with nbformat and nbconvert
+        result.messages.append(("warning", f"Warning: {file}: {e}"))
+    except ValueError as e:
+        result.status = "error"
+        result.error = f"{file}: {e}"
+    return None
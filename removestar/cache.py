@@ -0,0 +1,319 @@
+"""
+Cache of the names exported by modules
+
+The cache lets removestar avoid analyzing a file more than once in a run,
+and, if it is stored on disk, lets repeated runs skip reading, parsing and
+dynamically importing the modules that are star imported.
+"""
+
+import hashlib
+import importlib.machinery
+import json
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import pyflakes
+
+from . import __version__
+
+CACHE_DIR = ".removestar_cache"
+
+
+class ExportCache:
+    """
+    Cache of the names exported by modules
+
+    Everything is kept in memory for the lifetime of the cache, which should
+    be a single run, unless it is removed with forget() or forget_analysis().
+    This includes the analysis of every file that is fixed (see
+    analyze_code()), keyed on the resolved filename, so that the names it
+    defines are not computed again if it is also star imported.
+
+    If `directory` is given, the names are also stored on disk there.
+    Modules found statically are keyed on their resolved filename and are
+    invalidated when the file's modification time or size changes. The names
+    stored for these are the raw names from get_names(), so star imports in
+    the module are kept as 'mod.*' markers and are resolved (and validated)
+    separately each run. This means that a change to a module invalidates
+    everything that star imports it, directly or transitively. The modules
+    that a file star imports are stored separately too (see
+    set_file_stars()), because the names of a module with '__all__' don't
+    have markers.
+
+    External modules are keyed on the module name and are invalidated when
+    the file of the module changes. Names found statically keep the 'mod.*'
+    markers of the modules it star imports too, so that each of those is
+    validated separately. Names found by importing the module can't be split
+    up like this, so these entries are also invalidated when any of the
+    modules it star imports, directly or transitively, changes.
+
+    Every entry is also invalidated by a change in the Python, pyflakes or
+    removestar version.
+
+    If the cache lives longer than a single run, as in the daemon, use
+    check_stamps=True to validate the entries kept in memory in the same way
+    as the entries on disk.
+    """
+
+    def __init__(self, directory=None, *, check_stamps=False):
+        self.directory = Path(directory) if directory is not None else None
+        self.check_stamps = check_stamps
+        self.version = f"{sys.version} pyflakes {pyflakes.__version__} removestar {__version__}"
+        self._analyses = {}
+        # These map keys to tuples (stamp, names), and for _dynamic_names,
+        # (stamp, names, imports, approximate), see set_dynamic_names(). The
+        # stamp is None if check_stamps is False.
+        self._file_names = {}
+        self._file_stars = {}
+        self._dynamic_names = {}
+
+    def get_analysis(self, filename, code):
+        """
+        Get the analysis of the code `code` of the file `filename`
+
+        Returns None if the file has not been analyzed with exactly this code.
+        """
+        filename = Path(filename).resolve()
+        entry = self._analyses.get(filename)
+        if entry is None or entry[0] != _code_hash(code):
+            return None
+        stars, names, exports = entry[1]
+        return list(stars), set(names), set(exports)
+
+    def set_analysis(self, filename, code, analysis):
+        filename = Path(filename).resolve()
+        stars, names, exports = analysis
+        self._analyses[filename] = (_code_hash(code), (list(stars), set(names), set(exports)))
+        self._remember(self._file_names, filename, _file_stamp, exports)
+
+    def get_file_names(self, filename):
+        """
+        Get the cached names for the module in the file `filename`
+
+        Returns None if there is no valid entry.
+        """
+        return self._get_file_entry(self._file_names, "file", filename)
+
+    def set_file_names(self, filename, names):
+        self._set_file_entry(self._file_names, "file", filename, names)
+
+    def get_file_stars(self, filename):
+        """
+        Get the cached star imported modules of the file `filename` (see
+        set_file_stars())
+
+        Returns None if there is no valid entry.
+        """
+        return self._get_file_entry(self._file_stars, "stars", filename)
+
+    def set_file_stars(self, filename, stars):
+        """
+        Store the modules that the file `filename` star imports at the top
+        level
+
+        Unlike the 'mod.*' markers in the names of the file, these don't
+        depend on whether the file has '__all__', so they give the star
+        import graph of the files (see ProjectIndex.importers).
+        """
+        self._set_file_entry(self._file_stars, "stars", filename, stars)
+
+    def _get_file_entry(self, entries, prefix, filename):
+        filename = Path(filename).resolve()
+        names = self._recall(entries, filename, _file_stamp)
+        if names is not None or self.directory is None:
+            return names
+        entry = self._get(f"{prefix}:{filename}")
+        if entry is None or entry["stamp"] != _file_stamp(filename):
+            return None
+        names = set(entry["names"])
+        self._remember(entries, filename, _file_stamp, names)
+        return names
+
+    def _set_file_entry(self, entries, prefix, filename, names):
+        filename = Path(filename).resolve()
+        self._remember(entries, filename, _file_stamp, names)
+        if self.directory is not None:
+            self._set(f"{prefix}:{filename}", _file_stamp(filename), names)
+
+    def forget(self, filename):
+        """
+        Remove everything kept in memory for the file `filename`
+
+        This should be used when the file changes during the lifetime of the
+        cache. Entries on disk are invalidated automatically.
+        """
+        filename = Path(filename).resolve()
+        self._analyses.pop(filename, None)
+        self._file_names.pop(filename, None)
+        self._file_stars.pop(filename, None)
+
+    def forget_analysis(self, filename):
+        """
+        Remove the analysis of the file `filename` from memory, but keep its
+        names
+        """
+        self._analyses.pop(Path(filename).resolve(), None)
+
+    def get_dynamic_names(self, mod, *, approximate=False):
+        """
+        Get the cached names for the external module `mod`
+
+        Like the names of files, these may contain 'mod.*' markers (see
+        get_names_statically() in removestar.py). Returns None if there is no
+        valid entry. Entries stored with approximate=True are only returned
+        if approximate=True.
+        """
+        entry = self._dynamic_names.get(mod)
+        if entry is not None and self.check_stamps and entry[0] != _module_stamp(mod, entry[2]):
+            del self._dynamic_names[mod]
+            entry = None
+        if entry is None and self.directory is not None:
+            entry = self._load_dynamic_names(mod)
+        if entry is None or (entry[3] and not approximate):
+            return None
+        return set(entry[1])
+
+    def _load_dynamic_names(self, mod):
+        entry = self._get(f"module:{mod}")
+        if entry is None:
+            return None
+        imports = entry.get("imports", [])
+        stamp = _module_stamp(mod, imports)
+        if entry["stamp"] != stamp:
+            return None
+        self._dynamic_names[mod] = (
+            stamp if self.check_stamps else None,
+            set(entry["names"]),
+            imports,
+            entry.get("approximate", False),
+        )
+        return self._dynamic_names[mod]
+
+    def set_dynamic_names(self, mod, names, *, imports=(), approximate=False):
+        """
+        Store the names of the external module `mod`
+
+        imports are the modules that mod star imports, directly or
+        transitively, when the names were found by importing it (see
+        get_star_imported_modules() in removestar.py). approximate=True means
+        that the names were found by parsing a module without '__all__', so
+        they are only used when modules are not imported.
+        """
+        imports = sorted(imports)
+        stamp = None
+        if self.check_stamps or self.directory is not None:
+            stamp = _module_stamp(mod, imports)
+        self._dynamic_names[mod] = (
+            stamp if self.check_stamps else None,
+            set(names),
+            imports,
+            approximate,
+        )
+        if self.directory is not None:
+            self._set(f"module:{mod}", stamp, names, imports=imports, approximate=approximate)
+
+    def _recall(self, entries, key, get_stamp):
+        entry = entries.get(key)
+        if entry is None:
+            return None
+        if self.check_stamps and entry[0] != get_stamp(key):
+            entries.pop(key, None)
+            return None
+        return set(entry[1])
+
+    def _remember(self, entries, key, get_stamp, names):
+        entries[key] = (get_stamp(key) if self.check_stamps else None, set(names))
+
+    def _path(self, key):
+        return self.directory / (hashlib.sha256(key.encode("utf-8")).hexdigest() + ".json")
+
+    def _get(self, key):
+        """
+        Get the entry stored on disk for key, as a dictionary
+
+        Returns None if there is no entry for the current version. The stamp
+        of the entry is checked by the caller.
+        """
+        try:
+            with open(self._path(key), encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entry.get("key") != key or entry.get("version") != self.version:
+            return None
+        return entry
+
+    def _set(self, key, stamp, names, **extra):
+        entry = {
+            "key": key,
+            "version": self.version,
+            "stamp": stamp,
+            "names": sorted(names),
+            **extra,
+        }
+        try:
+            if not self.directory.is_dir():
+                self.directory.mkdir(parents=True, exist_ok=True)
+                with open(self.directory / ".gitignore", "w") as f:
+                    f.write("# Created by removestar\n*\n")
+            # Write to a temporary file and rename it so that concurrent
+            # runs (or --jobs workers) never see a partially written entry.
+            fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(entry, f)
+            os.replace(tmp, self._path(key))
+        except OSError:
+            # The cache is only an optimization
+            pass
+
+
+def _code_hash(code):
+    return hashlib.sha256(code.encode("utf-8", "surrogatepass")).digest()
+
+
+def _file_stamp(filename):
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return None
+    return [st.st_mtime_ns, st.st_size]
+
+
+def _module_stamp(mod, imports=()):
+    # The files of mod and of the modules in imports, found without
+    # importing anything. Installing or upgrading a package rewrites its
+    # files, which changes the stamp.
+    stamp = []
+    for name in [mod, *imports]:
+        origin = _module_origin(name)
+        stamp.append([origin, _file_stamp(origin)] if origin is not None else None)
+    return stamp
+
+
+def _module_origin(mod):
+    """
+    Find the file of the module `mod` without importing it
+
+    If mod itself can't be found, for instance os.path, which is only created
+    when os is imported, the file of the nearest package or module it is in
+    is used. Returns None for builtin and frozen modules, which only change
+    with the Python version, and for modules that are not found.
+    """
+    origin = path = None
+    parts = mod.split(".")
+    for i in range(len(parts)):
+        try:
+            spec = importlib.machinery.PathFinder.find_spec(".".join(parts[: i + 1]), path)
+        except (ImportError, ValueError):
+            break
+        if spec is None:
+            break
+        if spec.has_location and spec.origin is not None:
+            origin = spec.origin
+        path = spec.submodule_search_locations
+        if path is None:
+            # Not a package, so it has no submodules to find
+            break
+    return origin
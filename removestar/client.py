@@ -0,0 +1,166 @@
+"""
+Client for the removestar daemon
+
+removestar-client takes the same arguments as removestar, and runs them in
+the daemon (see daemon.py), starting it if it is not running. If the daemon
+cannot be used, removestar is run in this process instead.
+
+This module only imports the standard library so that the client starts
+quickly.
+"""
+
+import hashlib
+import io
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from . import __version__
+
+
+def socket_path():
+    """
+    Get the path of the daemon's socket
+
+    This is in a directory that is only accessible by the current user. The
+    name depends on the Python executable and the removestar version, so that
+    a daemon is never used by a different installation. The
+    REMOVESTAR_DAEMON_SOCKET environment variable can be used to override it.
+    """
+    path = os.environ.get("REMOVESTAR_DAEMON_SOCKET")
+    if path:
+        return path
+    key = hashlib.sha256(f"{sys.executable} {__version__}".encode()).hexdigest()[:16]
+    directory = os.path.join(tempfile.gettempdir(), f"removestar-{os.getuid()}")
+    return os.path.join(directory, f"{key}.sock")
+
+
+def check_directory(path):
+    """
+    Raise OSError if the directory of the socket `path` could be used by
+    another user
+    """
+    st = os.stat(os.path.dirname(os.path.abspath(path)))
+    if st.st_uid != os.getuid() or st.st_mode & 0o022:
+        raise PermissionError(f"The directory of {path} is writable by other users")
+
+
+def request(message, path, timeout=None):
+    """
+    Send the request `message` to the daemon listening on `path`, and return
+    its response
+
+    Raises OSError if the daemon cannot be reached.
+    """
+    check_directory(path)
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(path)
+        sock.sendall(json.dumps(message).encode("utf-8") + b"\n")
+        with sock.makefile("rb") as f:
+            line = f.readline()
+    if not line:
+        raise ConnectionError("The daemon closed the connection")
+    return json.loads(line)
+
+
+def is_running(path):
+    """
+    Check if a daemon is listening on `path`
+    """
+    try:
+        request({"command": "ping"}, path, timeout=10)
+    except OSError:
+        return False
+    return True
+
+
+def start_daemon(path, wait=10):
+    """
+    Start a daemon listening on `path` in the background, and wait until it
+    accepts connections
+
+    The daemon is started in the root directory, so that it doesn't depend on
+    the directory of the client that started it. Returns False if it could
+    not be started.
+    """
+    process = subprocess.Popen(
+        [sys.executable, "-m", "removestar.daemon", "--socket", path],
+        cwd="/",
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+    deadline = time.monotonic() + wait
+    while time.monotonic() < deadline:
+        if is_running(path):
+            return True
+        if process.poll() not in (None, 0):
+            return False
+        time.sleep(0.05)
+    return False
+
+
+def run(argv, path=None, stdin=None):
+    """
+    Run removestar with the command line arguments argv in the daemon,
+    starting it if needed
+
+    stdin is the standard input for the run, as bytes (for the path '-').
+    The modules are found on the sys.path of this process, like they would be
+    if removestar was run here.
+
+    Returns a tuple (stdout, stderr, returncode), or None if the daemon could
+    not be used.
+    """
+    if path is None:
+        path = socket_path()
+    # '' and the other relative entries are relative to the current directory
+    message = {
+        "command": "run",
+        "argv": argv,
+        "cwd": os.getcwd(),
+        "path": [os.path.abspath(entry) for entry in sys.path],
+    }
+    if stdin is not None:
+        message["stdin"] = stdin.decode("utf-8", "surrogateescape")
+    try:
+        response = request(message, path)
+    except (OSError, ValueError):
+        try:
+            if not start_daemon(path):
+                return None
+            response = request(message, path)
+        except (OSError, ValueError):
+            return None
+    return response["stdout"], response["stderr"], response["returncode"]
+
+
+def main():
+    argv = sys.argv[1:]
+    # --watch runs until it is interrupted, so it is always run here
+    result = None
+    stdin = sys.stdin.buffer.read() if "-" in argv else None
+    if hasattr(socket, "AF_UNIX") and "--watch" not in argv:
+        result = run(argv, stdin=stdin)
+    if result is None:
+        from .__main__ import main as removestar_main
+
+        if stdin is not None:
+            sys.stdin = io.TextIOWrapper(io.BytesIO(stdin), encoding="utf-8")
+        removestar_main(argv)
+        return
+
+    stdout, stderr, returncode = result
+    sys.stdout.write(stdout)
+    sys.stderr.write(stderr)
+    sys.exit(returncode)
+
+
+if __name__ == "__main__":
+    main()
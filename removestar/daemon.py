@@ -0,0 +1,257 @@
+"""
+Resident removestar process, for removestar-client
+
+Every run of removestar pays for starting Python, importing pyflakes, and
+finding the names exported by every star imported module again. This adds up
+when removestar is run many times on a few files each, as pre-commit and
+editors do. The daemon keeps a Session with the caches and import processes
+between runs, and runs the command line for each request from the client
+(see client.py) over a Unix socket.
+
+Requests are read from the socket concurrently, but the runs themselves are
+serialized, because they change the working directory, sys.path and standard
+output of the whole process. Each run uses the sys.path of its client, so that
+modules are found like they would be without the daemon.
+"""
+
+import argparse
+import contextlib
+import fcntl
+import io
+import json
+import os
+import socketserver
+import sys
+import threading
+import time
+import traceback
+
+from .__main__ import main as removestar_main
+from .cache import ExportCache
+from .client import check_directory, request, socket_path
+from .importer import ImportPool
+
+
+class Session:
+    """
+    Caches and import processes kept between runs in the daemon
+
+    The caches check the modification time and size of the files for every
+    entry kept in memory (check_stamps=True), so that runs see changes made
+    since the previous runs.
+    """
+
+    def __init__(self):
+        self._caches = {}
+        self._importers = {}
+        self._lock = threading.Lock()
+
+    def get_cache(self, directory):
+        """
+        Get the ExportCache for the cache directory `directory` (relative to
+        the current directory), or the in-memory cache if it is None
+        """
+        if directory is not None:
+            directory = os.path.abspath(directory)
+        with self._lock:
+            if directory not in self._caches:
+                self._caches[directory] = ExportCache(directory, check_stamps=True)
+            return self._caches[directory]
+
+    def get_importer(self, **options):
+        """
+        Get the ImportPool with the options `options`, which imports modules
+        from the current sys.path
+        """
+        key = (tuple(sys.path), *sorted(options.items()))
+        with self._lock:
+            if key not in self._importers:
+                self._importers[key] = ImportPool(path=list(sys.path), **options)
+            return self._importers[key]
+
+    def close(self):
+        with self._lock:
+            for importer in self._importers.values():
+                importer.close()
+            self._importers.clear()
+            self._caches.clear()
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        try:
+            message = json.loads(self.rfile.readline())
+        except ValueError:
+            return
+        response = self.server.respond(message)
+        self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+
+
+class Daemon(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Server for the requests from removestar-client on the Unix socket `path`
+
+    The daemon stops after `idle_timeout` seconds without requests, or when
+    it gets a stop request.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, path, *, idle_timeout=None):
+        self.session = Session()
+        self.idle_timeout = idle_timeout
+        self.last_request = time.monotonic()
+        self._run_lock = threading.Lock()
+        self._stopping = False
+        super().__init__(path, _Handler)
+
+    def respond(self, message):
+        self.last_request = time.monotonic()
+        command = message.get("command")
+        if command == "ping":
+            return {"pid": os.getpid()}
+        if command == "stop":
+            self.stop()
+            return {}
+        if command == "run":
+            with self._run_lock:
+                response = self._run(
+                    message["argv"], message["cwd"], message.get("stdin", ""), message.get("path")
+                )
+            self.last_request = time.monotonic()
+            return response
+        return {"error": f"Unknown command {command!r}"}
+
+    def _run(self, argv, cwd, stdin, path):
+        stdout = io.StringIO()
+        stderr = io.StringIO()
+        returncode = 0
+        previous = os.getcwd()
+        previous_stdin = sys.stdin
+        previous_path = sys.path[:]
+        try:
+            os.chdir(cwd)
+            if path is not None:
+                sys.path[:] = path
+            sys.stdin = io.TextIOWrapper(
+                io.BytesIO(stdin.encode("utf-8", "surrogateescape")), encoding="utf-8"
+            )
+            with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+                try:
+                    removestar_main(argv, session=self.session)
+                except SystemExit as e:
+                    returncode = _exit_code(e.code)
+                except Exception:
+                    traceback.print_exc()
+                    returncode = 1
+        except OSError as e:
+            stderr.write(f"removestar-daemon: {e}\n")
+            returncode = 1
+        finally:
+            os.chdir(previous)
+            sys.stdin = previous_stdin
+            sys.path[:] = previous_path
+        return {"stdout": stdout.getvalue(), "stderr": stderr.getvalue(), "returncode": returncode}
+
+    def service_actions(self):
+        if (
+            self.idle_timeout is not None
+            and time.monotonic() - self.last_request > self.idle_timeout
+            and not self._run_lock.locked()
+        ):
+            self.stop()
+
+    def stop(self):
+        """
+        Stop serving requests
+
+        This may be called from any thread.
+        """
+        if not self._stopping:
+            self._stopping = True
+            # shutdown() waits for serve_forever() to return, so it can't be
+            # called from the thread running it
+            threading.Thread(target=self.shutdown, daemon=True).start()
+
+    def server_close(self):
+        super().server_close()
+        self.session.close()
+
+
+def _exit_code(code):
+    if code is None:
+        return 0
+    if isinstance(code, int):
+        return code
+    print(code, file=sys.stderr)
+    return 1
+
+
+def serve(path, *, idle_timeout=None):
+    """
+    Run a daemon listening on the Unix socket `path` until it is stopped
+
+    Returns False without doing anything if another daemon is already
+    listening on `path`.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    check_directory(path)
+    # Only one daemon can hold the lock, so a daemon never removes the
+    # socket of another one that is still starting
+    with open(path + ".lock", "w") as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return False
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(path)
+        server = Daemon(path, idle_timeout=idle_timeout)
+        try:
+            server.serve_forever(poll_interval=0.5)
+        finally:
+            server.server_close()
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(path)
+    return True
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="removestar-daemon",
+        description="Run removestar as a daemon, for removestar-client.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "--socket",
+        metavar="PATH",
+        default=socket_path(),
+        help="The Unix socket to listen on.",
+    )
+    parser.add_argument(
+        "--idle-timeout",
+        metavar="SECONDS",
+        type=float,
+        default=3600,
+        help="Stop after this long without requests.",
+    )
+    parser.add_argument("--stop", action="store_true", help="Stop the running daemon.")
+    args = parser.parse_args(argv)
+
+    # python -m puts the current directory on sys.path. Modules are found on
+    # the sys.path of each client instead.
+    sys.path[:] = [entry for entry in sys.path if entry not in ("", os.getcwd())]
+
+    if args.stop:
+        try:
+            request({"command": "stop"}, args.socket, timeout=10)
+        except OSError:
+            sys.exit("removestar-daemon: no daemon is running")
+        return
+    if not serve(args.socket, idle_timeout=args.idle_timeout):
+        # Not an error, as clients may start daemons concurrently
+        print("removestar-daemon: a daemon is already running", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
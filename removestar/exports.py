@@ -0,0 +1,371 @@
+"""
+Collect the top-level names defined by a module without running pyflakes
+
+This gives the same names as the module scope of a pyflakes Checker (see
+get_names() in removestar.py), but only visits the module-level statements
+instead of checking the whole module.
+"""
+
+import ast
+import sys
+
+# Marker for a name that only has an annotation, like 'a: int'
+_ANNOTATION = object()
+_MISSING = object()
+
+
+def collect_names(tree, code=None, *, pyflakes_nonlocal=True):
+    """
+    Get the names bound in the module scope of the module `tree`
+
+    This follows the rules that pyflakes uses for its module scope:
+
+    - star imports are returned as 'mod.*',
+    - names bound by 'global' in functions and classes are included. So are
+      names bound by 'nonlocal', unless pyflakes_nonlocal=False, since
+      pyflakes treats it like 'global',
+    - an unconditional 'del' removes a name,
+    - the name of an 'except ... as name' block is unbound afterwards.
+
+    Returns a dictionary mapping names to None, or for '__all__', the list of
+    names in it if they can be determined statically (see export_names()).
+
+    If the source `code` is given, it is used to skip looking for 'global'
+    statements and assignment expressions when the code cannot have any.
+    """
+    global_types = (ast.Global, ast.Nonlocal) if pyflakes_nonlocal else ast.Global
+    collector = _NameCollector(
+        global_types,
+        find_globals=code is None or "global" in code or "nonlocal" in code,
+        find_named_exprs=code is None or ":=" in code,
+    )
+    collector.statements(tree.body)
+    scope = collector.scope
+    # Functions are only checked after the module, so names declared global
+    # in them can't be deleted at the module level.
+    for name in collector.deferred_globals:
+        scope.setdefault(name, None)
+    return {name: (None if value is _ANNOTATION else value) for name, value in scope.items()}
+
+
+def export_names(value, names=()):
+    """
+    Get the names in the value of an '__all__' assignment
+
+    Like pyflakes, this understands lists and tuples of strings and
+    concatenations of them. `names` are the names from a previous assignment,
+    for '__all__ += ...'.
+
+    >>> export_names(ast.parse("['a'] + ['b'] + ('c',)", mode="eval").body)
+    ['c', 'b', 'a']
+    """
+    names = list(names)
+
+    def add(container):
+        for node in container.elts:
+            name = _string_value(node)
+            if name is not None:
+                names.append(name)
+
+    if isinstance(value, (ast.List, ast.Tuple)):
+        add(value)
+    elif isinstance(value, ast.BinOp):
+        current = value
+        while isinstance(current.right, (ast.List, ast.Tuple)):
+            add(current.right)
+            left = current.left
+            if isinstance(left, ast.BinOp):
+                current = left
+            elif isinstance(left, (ast.List, ast.Tuple)):
+                add(left)
+                break
+            else:
+                break
+    return names
+
+
+def has_static_exports(tree):
+    """
+    Check if the names imported by 'from module import *' can be determined
+    statically for the module `tree`
+
+    This is the case if '__all__' is only assigned at the top level of the
+    module, to lists or tuples of strings or concatenations of them, and is
+    not otherwise used in the module. If the module has no '__all__', it
+    must not change its namespace with globals(), vars() or exec().
+
+    >>> has_static_exports(ast.parse("__all__ = ['a'] + ['b']"))
+    True
+    >>> has_static_exports(ast.parse("__all__ = ['a']\\n__all__.extend(b.__all__)"))
+    False
+    """
+    static_targets = set()
+    for stmt in tree.body:
+        if isinstance(stmt, ast.Assign):
+            targets, value = stmt.targets, stmt.value
+        elif (isinstance(stmt, ast.AugAssign) and isinstance(stmt.op, ast.Add)) or (
+            isinstance(stmt, ast.AnnAssign) and stmt.value is not None
+        ):
+            targets, value = [stmt.target], stmt.value
+        else:
+            continue
+        if len(targets) == 1 and _is_string_list(value):
+            static_targets.add(targets[0])
+
+    has_all = dynamic = False
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and node.id == "__all__":
+            if node not in static_targets:
+                return False
+            has_all = True
+        elif (
+            isinstance(node, ast.Call)
+            and isinstance(node.func, ast.Name)
+            and node.func.id in ("globals", "vars", "exec")
+        ):
+            dynamic = True
+    return has_all or not dynamic
+
+
+def _is_string_list(node):
+    if isinstance(node, ast.BinOp) and isinstance(node.op, ast.Add):
+        return _is_string_list(node.left) and _is_string_list(node.right)
+    return isinstance(node, (ast.List, ast.Tuple)) and all(
+        _string_value(elt) is not None for elt in node.elts
+    )
+
+
+def _string_value(node):
+    if isinstance(node, ast.Constant) and isinstance(node.value, str):
+        return node.value
+    if type(node).__name__ == "Str":  # Python 3.7
+        return node.s
+    return None
+
+
+class _NameCollector:
+    def __init__(self, global_types, *, find_globals, find_named_exprs):
+        self.global_types = global_types
+        self.find_globals = find_globals
+        self.find_named_exprs = find_named_exprs
+        self.scope = {}
+        self.deferred_globals = []
+
+    def statements(self, body, conditional=False):
+        for stmt in body:
+            if self.find_named_exprs:
+                for name in _named_expr_targets(stmt):
+                    self.bind_named_expr(name)
+            method = getattr(self, "visit_" + type(stmt).__name__, None)
+            if method is not None:
+                method(stmt, conditional)
+
+    def bind(self, name, value=None):
+        self.scope[name] = value
+
+    def bind_named_expr(self, name):
+        if self.scope.get(name) is _ANNOTATION:
+            self.scope[name] = None
+        else:
+            self.scope.setdefault(name, None)
+
+    def bind_target(self, target):
+        if isinstance(target, ast.Name):
+            self.bind(target.id)
+        elif isinstance(target, (ast.Tuple, ast.List)):
+            for elt in target.elts:
+                self.bind_target(elt)
+        elif isinstance(target, ast.Starred):
+            self.bind_target(target.value)
+
+    def delete_target(self, target):
+        if isinstance(target, ast.Name):
+            self.scope.pop(target.id, None)
+        elif isinstance(target, (ast.Tuple, ast.List)):
+            for elt in target.elts:
+                self.delete_target(elt)
+
+    def previous_export_names(self):
+        value = self.scope.get("__all__")
+        return value if isinstance(value, list) else []
+
+    def visit_Import(self, node, conditional):
+        for alias in node.names:
+            if "." in alias.name and not alias.asname:
+                self.bind(alias.name.split(".")[0])
+            else:
+                self.bind(alias.asname or alias.name)
+
+    def visit_ImportFrom(self, node, conditional):
+        module = "." * node.level + (node.module or "")
+        for alias in node.names:
+            if alias.name == "*" and node.module != "__future__":
+                self.bind(module + ".*")
+            else:
+                self.bind(alias.asname or alias.name)
+
+    def visit_FunctionDef(self, node, conditional):
+        if self.find_globals:
+            self.deferred_globals.extend(_global_names(node, self.global_types))
+        self.bind(node.name)
+
+    visit_AsyncFunctionDef = visit_FunctionDef
+
+    def visit_ClassDef(self, node, conditional):
+        if self.find_globals:
+            # Class bodies are checked straight away, but functions in them
+            # are deferred.
+            for stmt in node.body:
+                self._class_globals(stmt)
+        self.bind(node.name)
+
+    def _class_globals(self, node):
+        if isinstance(node, self.global_types):
+            for name in node.names:
+                self.scope.setdefault(name, None)
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.Lambda)):
+            self.deferred_globals.extend(_global_names(node, self.global_types))
+        else:
+            for child in ast.iter_child_nodes(node):
+                self._class_globals(child)
+
+    def visit_Assign(self, node, conditional):
+        for target in node.targets:
+            if isinstance(target, ast.Name) and target.id == "__all__":
+                self.bind("__all__", export_names(node.value))
+            else:
+                self.bind_target(target)
+
+    def visit_AugAssign(self, node, conditional):
+        if isinstance(node.target, ast.Name) and node.target.id == "__all__":
+            self.bind("__all__", export_names(node.value, self.previous_export_names()))
+        else:
+            self.bind_target(node.target)
+
+    def visit_AnnAssign(self, node, conditional):
+        if not isinstance(node.target, ast.Name):
+            return
+        name = node.target.id
+        if node.value is None:
+            if name not in self.scope:
+                self.bind(name, _ANNOTATION)
+        elif name == "__all__":
+            self.bind("__all__", export_names(node.value))
+        else:
+            self.bind(name)
+
+    def visit_TypeAlias(self, node, conditional):
+        self.bind_target(node.name)
+
+    def visit_Delete(self, node, conditional):
+        # pyflakes can't tell if a conditional del is executed, so it keeps
+        # the name.
+        if not conditional:
+            for target in node.targets:
+                self.delete_target(target)
+
+    def visit_For(self, node, conditional):
+        self.bind_target(node.target)
+        self.statements(node.body, conditional)
+        self.statements(node.orelse, conditional)
+
+    visit_AsyncFor = visit_For
+
+    def visit_While(self, node, conditional):
+        self.statements(node.body, True)
+        self.statements(node.orelse, True)
+
+    visit_If = visit_While
+
+    def visit_With(self, node, conditional):
+        for item in node.items:
+            if item.optional_vars is not None:
+                self.bind_target(item.optional_vars)
+        self.statements(node.body, conditional)
+
+    visit_AsyncWith = visit_With
+
+    def visit_Try(self, node, conditional):
+        self.statements(node.body, conditional)
+        for handler in node.handlers:
+            if self.find_named_exprs and handler.type is not None:
+                for name in _named_expr_targets(handler.type):
+                    self.bind_named_expr(name)
+            if handler.name is None:
+                self.statements(handler.body, conditional)
+                continue
+            # The name is only bound inside the except block
+            previous = self.scope.pop(handler.name, _MISSING)
+            self.bind(handler.name)
+            self.statements(handler.body, conditional)
+            self.scope.pop(handler.name, None)
+            if previous is not _MISSING:
+                self.bind(handler.name)
+        self.statements(node.orelse, conditional)
+        self.statements(node.finalbody, conditional)
+
+    visit_TryStar = visit_Try
+
+    def visit_Match(self, node, conditional):
+        for case in node.cases:
+            for pattern in ast.walk(case.pattern):
+                name = getattr(pattern, "name", None) or getattr(pattern, "rest", None)
+                if name is not None:
+                    self.bind(name)
+            if self.find_named_exprs and case.guard is not None:
+                for name in _named_expr_targets(case.guard):
+                    self.bind_named_expr(name)
+            self.statements(case.body, conditional)
+
+
+def _global_names(node, global_types):
+    return [
+        name for child in ast.walk(node) if isinstance(child, global_types) for name in child.names
+    ]
+
+
+def _named_expr_targets(node):
+    """
+    Yield the names bound in the module scope by assignment expressions in the
+    statement or expression `node`, not including its nested statements
+    """
+    if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)) and (
+        sys.version_info >= (3, 12)
+    ):
+        # pyflakes checks everything but the decorators in the scope of the
+        # type parameters
+        children = node.decorator_list
+    elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+        args = node.args
+        children = [
+            *node.decorator_list,
+            *args.defaults,
+            *[d for d in args.kw_defaults if d is not None],
+            *[
+                arg.annotation
+                for arg in [
+                    *getattr(args, "posonlyargs", []),
+                    *args.args,
+                    *args.kwonlyargs,
+                    args.vararg,
+                    args.kwarg,
+                ]
+                if arg is not None and arg.annotation is not None
+            ],
+            *([node.returns] if node.returns is not None else []),
+        ]
+    elif isinstance(node, ast.ClassDef):
+        children = [*node.decorator_list, *node.bases, *node.keywords]
+    elif isinstance(node, ast.Lambda):
+        children = [*node.args.defaults, *[d for d in node.args.kw_defaults if d is not None]]
+    else:
+        if type(node).__name__ == "NamedExpr":
+            yield node.target.id
+        children = [
+            child
+            for child in ast.iter_child_nodes(node)
+            if not isinstance(child, (ast.stmt, ast.excepthandler))
+            and type(child).__name__ != "match_case"
+        ]
+    for child in children:
+        yield from _named_expr_targets(child)
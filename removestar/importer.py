@@ -0,0 +1,241 @@
+"""
+Pool of subprocesses for importing modules dynamically
+
+get_names_dynamically() imports a module in the current process, so the
+module stays in memory for the rest of the run and any side effects of
+importing it affect removestar. ImportPool does the imports in separate,
+long-lived worker processes instead.
+"""
+
+import os
+import queue
+import sys
+import threading
+
+from .removestar import get_names_dynamically
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+class ImportPool:
+    """
+    Pool of worker processes that import modules to get their names
+
+    Up to `processes` modules are imported in parallel, each in its own
+    worker process. Workers are started when they are first needed and are
+    reused, but a worker is replaced with a new one after it has imported
+    `max_imports` modules, so that memory used by imported modules is given
+    back.
+
+    Nothing is cached: every get_names() imports the module again, in a
+    worker process that has not imported it before or in which none of the
+    modules it has imported have changed since, so that changes to modules
+    are seen. Caching the names is left to the ExportCache.
+
+    An import that takes longer than `timeout` seconds is stopped by killing
+    its worker. If `memory_limit` is given, the address space of each worker
+    is limited to that many bytes (on Unix only), so that an import that
+    uses too much memory fails instead of affecting the rest of the system.
+
+    The modules are imported from `path` if it is given, or else from the
+    sys.path of this process when the workers are started. The standard
+    output and error of the workers are discarded.
+
+    Pickling an ImportPool gives a new pool with the same settings and no
+    workers, so it can be sent to other processes.
+    """
+
+    def __init__(self, processes=None, *, timeout=60, memory_limit=None, max_imports=50, path=None):
+        self.processes = processes or os.cpu_count() or 1
+        self.timeout = timeout
+        self.memory_limit = memory_limit
+        self.max_imports = max_imports
+        self.path = path
+        self._start()
+
+    def _start(self):
+        self._executor = None
+        self._futures = {}
+        self._idle = queue.SimpleQueue()
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        return {
+            "processes": self.processes,
+            "timeout": self.timeout,
+            "memory_limit": self.memory_limit,
+            "max_imports": self.max_imports,
+            "path": self.path,
+        }
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def prefetch(self, mods):
+        """
+        Start importing the modules `mods` in the background
+        """
+        with self._lock:
+            if self._executor is None:
+                from concurrent.futures import ThreadPoolExecutor
+
+                self._executor = ThreadPoolExecutor(self.processes)
+            for mod in mods:
+                if mod not in self._futures:
+                    self._futures[mod] = self._executor.submit(self._import, mod)
+
+    def get_names(self, mod):
+        """
+        Get the names defined by 'from mod import *'
+
+        Raises RuntimeError if the module cannot be imported, like
+        get_names_dynamically().
+        """
+        self.prefetch([mod])
+        with self._lock:
+            future = self._futures.pop(mod)
+        return set(future.result())
+
+    def close(self):
+        """
+        Stop all the workers
+        """
+        if self._executor is not None:
+            self._executor.shutdown()
+        while True:
+            try:
+                worker = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            worker.close()
+        self._start()
+
+    def _import(self, mod):
+        try:
+            worker = self._idle.get_nowait()
+        except queue.Empty:
+            worker = _Worker(self.memory_limit, self.path)
+        try:
+            return worker.get_names(mod, self.timeout)
+        except _StaleWorker:
+            # A new worker has no modules imported, so it can't be stale
+            worker = _Worker(self.memory_limit, self.path)
+            return worker.get_names(mod, self.timeout)
+        finally:
+            if worker.process.is_alive() and worker.imports < self.max_imports:
+                self._idle.put(worker)
+            else:
+                worker.close()
+
+
+class _StaleWorker(Exception):
+    pass
+
+
+class _Worker:
+    def __init__(self, memory_limit, path):
+        import multiprocessing
+
+        # A fresh interpreter, rather than a fork of this one
+        context = multiprocessing.get_context("spawn")
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=_worker_main, args=(child_conn, memory_limit, path), daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+        self.imports = 0
+        # Wait until the worker has started, so that starting it doesn't count
+        # towards the timeout of its first import
+        try:
+            self.conn.recv()
+        except EOFError as e:
+            self.kill()
+            raise RuntimeError("Could not start a process for importing modules") from e
+
+    def get_names(self, mod, timeout):
+        self.imports += 1
+        try:
+            self.conn.send(mod)
+            if not self.conn.poll(timeout):
+                self.kill()
+                raise RuntimeError(f"Timed out importing {mod} after {timeout} seconds")
+            status, value = self.conn.recv()
+        except (EOFError, OSError) as e:
+            self.kill()
+            raise RuntimeError(f"Error importing {mod}: the import process exited") from e
+        if status == "stale":
+            self.close()
+            raise _StaleWorker
+        if status == "error":
+            raise RuntimeError(value)
+        return value
+
+    def close(self):
+        self.conn.close()
+        self.process.join(1)
+        if self.process.is_alive():
+            self.kill()
+
+    def kill(self):
+        self.conn.close()
+        self.process.kill()
+        self.process.join()
+
+
+def _worker_main(conn, memory_limit, path):
+    if path is not None:
+        sys.path[:] = path
+    devnull = os.open(os.devnull, os.O_RDWR)
+    for fd in range(3):
+        os.dup2(devnull, fd)
+    if memory_limit is not None and resource is not None:
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+    conn.send(("ready", None))
+
+    # The files of the modules imported so far -> their stamps
+    stamps = {}
+    _add_stamps(stamps)
+    while True:
+        try:
+            mod = conn.recv()
+        except EOFError:
+            break
+        if any(_stamp(file) != stamp for file, stamp in stamps.items()):
+            # Importing mod could use the old version of a changed module,
+            # which stays in sys.modules
+            conn.send(("stale", None))
+            break
+        try:
+            result = ("names", sorted(get_names_dynamically(mod)))
+        except RuntimeError as e:
+            result = ("error", str(e))
+        except MemoryError:
+            result = ("error", f"Error importing {mod}: out of memory")
+        _add_stamps(stamps)
+        conn.send(result)
+
+
+def _add_stamps(stamps):
+    for module in list(sys.modules.values()):
+        file = getattr(module, "__file__", None)
+        if isinstance(file, str) and file not in stamps:
+            stamps[file] = _stamp(file)
+
+
+def _stamp(file):
+    try:
+        st = os.stat(file)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
@@ -0,0 +1,65 @@
+"""
+Find the files that changed since a git revision, for --changed-since
+"""
+
+import os
+import subprocess
+
+from .removestar import get_names
+
+
+def changed_since(rev):
+    """
+    Get the files that changed since the git revision `rev`
+
+    This includes uncommitted changes and untracked files in the repository
+    of the current directory.
+
+    Returns a tuple (changed, unchanged_exports) of lists of absolute paths.
+    unchanged_exports are the Python files in `changed` that define the same
+    top-level names (see get_names()) as at `rev`, so the files that star
+    import them are not affected by the change.
+
+    Raises RuntimeError if git fails, for instance if `rev` does not exist.
+    """
+    root = _git("rev-parse", "--show-toplevel").strip()
+    names = [
+        *_git("diff", "--name-only", "-z", rev, "--", cwd=root).split("\0"),
+        *_git("ls-files", "--others", "--exclude-standard", "-z", cwd=root).split("\0"),
+    ]
+
+    changed = []
+    unchanged_exports = []
+    for name in filter(None, names):
+        path = os.path.join(root, name)
+        changed.append(path)
+        if name.endswith(".py") and _same_names(rev, name, path, root):
+            unchanged_exports.append(path)
+    return changed, unchanged_exports
+
+
+def _same_names(rev, name, path, root):
+    try:
+        old_code = _git("show", f"{rev}:{name}", cwd=root)
+        with open(path, encoding="utf-8") as f:
+            code = f.read()
+        return get_names(old_code, path) == get_names(code, path)
+    except (RuntimeError, OSError, SyntaxError, UnicodeDecodeError):
+        # Deleted, added, or not valid Python at one of the two revisions
+        return False
+
+
+def _git(*args, cwd=None):
+    try:
+        p = subprocess.run(
+            ["git", *args],
+            cwd=cwd,
+            capture_output=True,
+            encoding="utf-8",
+            check=False,
+        )
+    except OSError as e:
+        raise RuntimeError(f"Could not run git: {e}") from e
+    if p.returncode != 0:
+        raise RuntimeError(f"git {args[0]} failed: {p.stderr.strip()}")
+    return p.stdout
@@ -0,0 +1,337 @@
+"""
+Index of the names exported by the modules that are star imported in a project
+"""
+
+from pathlib import Path
+
+from . import timings
+from .cache import ExportCache
+from .removestar import (
+    ExternalModuleError,
+    get_mod_filename,
+    get_names_and_stars,
+    get_names_dynamically,
+    get_names_statically,
+    get_star_imported_modules,
+    may_contain_star_import,
+)
+
+# Marker for a module that is not in the project, in ProjectIndex._filenames
+_EXTERNAL = object()
+
+
+class ProjectIndex:
+    """
+    Index of the names exported by the modules that are star imported in a
+    project
+
+    get_module_names() in removestar.py caches the names of a module on the
+    module name and the directory it is imported from, so a module that is
+    star imported from many directories is resolved again for each of them.
+    The index keys the names on the resolved filename of the module instead,
+    so every module, including the modules it star imports in turn, is
+    resolved once. Dynamically imported modules are keyed on the module name.
+
+    `files` are the files that will be fixed. Everything they star import,
+    directly or transitively, is resolved when the index is created, so
+    fixing a file only needs dictionary lookups. This also means the index
+    can be built once and sent to --jobs worker processes. Other modules are
+    resolved the first time they are needed.
+
+    allow_dynamic has the same meaning as for get_module_names(). cache is an
+    ExportCache used for the names of the individual modules. If importer is
+    an ImportPool (from removestar.importer), external modules are imported
+    in its worker processes, in parallel, instead of in this process.
+
+    Errors found while resolving a module are raised when the names of the
+    module are requested with get_module_names(), not when the index is
+    created.
+
+    The index also records which files star import which, so that affected()
+    can find the files that need to be checked again after some files have
+    changed. The star imports of the files are stored in the cache (see
+    ExportCache.set_file_stars()), so with a cache stored on disk, this graph
+    is kept between runs and only the files that changed are parsed again.
+    """
+
+    def __init__(self, files=(), *, allow_dynamic=True, cache=None, importer=None):
+        self.allow_dynamic = allow_dynamic
+        self.cache = cache if cache is not None else ExportCache()
+        self.importer = importer
+        # (mod, directory) -> (resolved filename, filename), _EXTERNAL, or an
+        # exception
+        self._filenames = {}
+        # resolved filename or external module name -> set of names, or an
+        # exception
+        self._names = {}
+        # Keys being resolved -> their depth in the chain of star imports
+        self._in_progress = {}
+        # The smallest depth of a key in progress that the current key star
+        # imports, directly or transitively
+        self._low = 0
+        # Keys in a star import cycle that is still being resolved -> (names,
+        # low)
+        self._pending = {}
+        # External module name -> result of get_names_statically()
+        self._static = {}
+        # resolved filename -> resolved filenames of the files in the project
+        # that star import it
+        self.importers = {}
+        # resolved filenames of the files with star imports that could not be
+        # resolved
+        self.unresolved = set()
+        self.add(*files)
+
+    def add(self, *files):
+        """
+        Resolve all the star imports in the Python files `files`
+        """
+        imports = [(Path(file), mod) for file in files for mod in self._star_imported_modules(file)]
+        if self.importer is not None and self.allow_dynamic:
+            # Start all the imports that are needed, so they run in parallel
+            self.importer.prefetch(
+                mod
+                for file, mod in imports
+                if self._locate(mod, file.parent) is _EXTERNAL
+                and mod not in self._names
+                and self.cache.get_dynamic_names(mod) is None
+                and self._static_names(mod) is None
+            )
+        for file, mod in imports:
+            self._add_importer(file.resolve(), mod, file.parent)
+            try:
+                self.get_module_names(mod, file.parent)
+            except (RuntimeError, NotImplementedError):
+                self.unresolved.add(file.resolve())
+
+    def affected(self, changed, unchanged_exports=()):
+        """
+        Get the files that have to be checked again when the files `changed`
+        have changed
+
+        These are the files in `changed` and the files that star import them,
+        directly or transitively. Files in `unchanged_exports` are known to
+        define the same names as before, so the files that star import them
+        are only included if they are affected in some other way. Files with
+        star imports that could not be resolved are always included.
+
+        Only the files that have been added to the index are considered. The
+        result is a set of resolved Paths.
+        """
+        changed = {Path(file).resolve() for file in changed}
+        unchanged_exports = {Path(file).resolve() for file in unchanged_exports}
+        affected = changed | self.unresolved
+        queue = [file for file in changed if file not in unchanged_exports]
+        seen = set(queue)
+        while queue:
+            for importer in self.importers.get(queue.pop(), ()):
+                affected.add(importer)
+                if importer not in seen:
+                    seen.add(importer)
+                    queue.append(importer)
+        return affected
+
+    def invalidate(self, changed):
+        """
+        Forget the names of the files `changed`, which have changed, and of
+        the files that are affected by the change (see affected())
+
+        The star imports of the affected files are resolved again. Returns the
+        affected files, as a set of resolved Paths.
+        """
+        affected = self.affected(changed)
+        for file in affected:
+            self._names.pop(file, None)
+            self.cache.forget(file)
+        for importers in self.importers.values():
+            importers.difference_update(affected)
+        self.unresolved -= affected
+        # Files may have been created or deleted
+        self._filenames.clear()
+        self.add(*[file for file in affected if file.suffix == ".py" and file.is_file()])
+        return affected
+
+    def forget_fixed(self, file):
+        """
+        Remove what the cache keeps in memory for the file `file`, which has
+        been fixed
+
+        The names of the file are kept if it is star imported, since they may
+        be needed again. Everything kept in memory for the files on disk is
+        still in the cache's directory.
+        """
+        resolved = Path(file).resolve()
+        if resolved in self._names or resolved in self.importers:
+            self.cache.forget_analysis(resolved)
+        else:
+            self.cache.forget(resolved)
+
+    def _add_importer(self, importer, mod, directory):
+        location = self._locate(mod, directory)
+        if isinstance(location, tuple):
+            self.importers.setdefault(location[0], set()).add(importer)
+
+    def get_module_names(self, mod, directory):
+        """
+        Get the names defined in the module 'mod' star imported from a file in
+        'directory'
+
+        This gives the same names as get_module_names() in removestar.py. The
+        returned set should not be modified.
+        """
+        location = self._locate(mod, directory)
+        if isinstance(location, Exception):
+            raise location
+
+        if location is _EXTERNAL:
+            return self._get(mod, lambda: self._external_names(mod), mod)
+        resolved, filename = location
+        return self._get(resolved, lambda: self._file_names(resolved, filename), str(filename))
+
+    def _locate(self, mod, directory):
+        key = (mod, str(directory))
+        if key not in self._filenames:
+            try:
+                with timings.phase("resolve"):
+                    filename = Path(get_mod_filename(mod, directory))
+                self._filenames[key] = (filename.resolve(), filename)
+            except ExternalModuleError:
+                self._filenames[key] = _EXTERNAL
+            except RuntimeError as e:
+                self._filenames[key] = e
+        return self._filenames[key]
+
+    def _get(self, key, compute, name):
+        if key in self._names:
+            names = self._names[key]
+        elif key in self._in_progress or key in self._pending:
+            # A star import cycle. Like get_names_from_dir(), stop here, with
+            # the names found so far. Nothing is stored until the module that
+            # started the cycle is resolved.
+            if key in self._in_progress:
+                names, low = set(), self._in_progress[key]
+            else:
+                names, low = self._pending[key]
+            self._low = min(self._low, low)
+        else:
+            names = self._resolve(key, compute, name)
+        if isinstance(names, Exception):
+            raise names
+        return names
+
+    def _resolve(self, key, compute, name):
+        """
+        Compute the names of key, and store them, unless key is in a star
+        import cycle with a module that is still being resolved
+
+        The modules in a star import cycle all export the same names, so these
+        are stored for all of them at once, when the first module of the cycle
+        is resolved.
+        """
+        depth = len(self._in_progress)
+        self._in_progress[key] = depth
+        outer_low, self._low = self._low, depth
+        pending = len(self._pending)
+        try:
+            with timings.module(name):
+                names = compute()
+        except (RuntimeError, NotImplementedError) as e:
+            names = e
+        finally:
+            del self._in_progress[key]
+            low, self._low = self._low, min(outer_low, self._low)
+
+        if low < depth:
+            self._pending[key] = (names, low)
+            return names
+        members = list(self._pending)[pending:]
+        cycle = [names] + [self._pending.pop(member)[0] for member in members]
+        errors = [names for names in cycle if isinstance(names, Exception)]
+        names = errors[0] if errors else set().union(*cycle)
+        for member in [key, *members]:
+            self._names[member] = names
+        return names
+
+    def _static_names(self, mod):
+        if mod not in self._static:
+            self._static[mod] = get_names_statically(mod, require_all=self.allow_dynamic)
+        return self._static[mod]
+
+    def _external_names(self, mod):
+        approximate = not self.allow_dynamic
+        names = self.cache.get_dynamic_names(mod, approximate=approximate)
+        if names is None:
+            imports = ()
+            names = self._static_names(mod)
+            if names is None:
+                if not self.allow_dynamic:
+                    raise NotImplementedError(
+                        "Static determination of external module imports is not supported."
+                    )
+                if self.importer is not None:
+                    with timings.phase("import"):
+                        names = self.importer.get_names(mod)
+                else:
+                    names = get_names_dynamically(mod)
+                imports = get_star_imported_modules(mod)
+            self.cache.set_dynamic_names(mod, names, imports=imports, approximate=approximate)
+
+        exports = set()
+        for name in names:
+            if name.endswith(".*"):
+                exports |= self.get_module_names(name[:-2], ".")
+            else:
+                exports.add(name)
+        return exports
+
+    def _file_names(self, resolved, filename):
+        names = self.cache.get_file_names(resolved)
+        stars = self.cache.get_file_stars(resolved)
+        if names is None or stars is None:
+            with timings.phase("read"), open(filename) as f:
+                code = f.read()
+            try:
+                names, stars = get_names_and_stars(code, filename)
+            except SyntaxError as e:
+                raise RuntimeError(f"Could not parse {filename}: {e}") from e
+            self.cache.set_file_names(resolved, names)
+            self.cache.set_file_stars(resolved, stars)
+
+        # The names of a module with __all__ have no markers, but the module
+        # still star imports the others
+        for mod in stars:
+            self._add_importer(resolved, mod, filename.parent)
+        exports = set()
+        for name in names:
+            if name.endswith(".*"):
+                exports |= self.get_module_names(name[:-2], filename.parent)
+            else:
+                exports.add(name)
+        return exports
+
+    def _star_imported_modules(self, file):
+        """
+        Get the modules star imported at the top level of the Python file
+        `file`
+
+        This only parses the file (see get_names_and_stars()). Running
+        pyflakes on it is left to fixing it, which can be done in --jobs
+        worker processes.
+        """
+        stars = self.cache.get_file_stars(file)
+        if stars is not None:
+            return sorted(stars)
+        try:
+            with timings.phase("read"), open(file, "rb") as f:
+                data = f.read()
+            if not may_contain_star_import(data):
+                return []
+            # Decode the same way as the file is decoded when it is fixed
+            code = data.decode("utf-8").replace("\r\n", "\n").replace("\r", "\n")
+            names, stars = get_names_and_stars(code, file)
+        except (OSError, UnicodeDecodeError, SyntaxError):
+            # These are reported when the file is fixed
+            return []
+        self.cache.set_file_names(file, names)
+        self.cache.set_file_stars(file, stars)
+        return stars
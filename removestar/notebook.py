@@ -0,0 +1,372 @@
+"""
+Fixing star imports in Jupyter notebooks
+
+The code of a notebook is the code of all its code cells, laid out like
+nbconvert's PythonExporter does. It is analyzed and fixed in a single pass,
+which gives both the fixed code (for diffs) and the replacements of the star
+import statements, which are then applied to the cells of the notebook.
+
+Notebooks in the current format (nbformat 4) are read with the json module,
+so nbformat and nbconvert are only needed for older notebooks.
+"""
+
+import importlib.util
+import json
+import re
+
+from . import timings
+from .removestar import (
+    STAR_IMPORT_STATEMENT,
+    get_replacements,
+    replace_imports_and_statements,
+    replace_in_nb,
+)
+from .writer import text_bytes, write_atomic
+
+
+class Notebook:
+    """
+    A notebook in the nbformat 4 format, read with the json module
+
+    nb is the parsed JSON, and text the JSON text it was parsed from. lines
+    maps each line of the code of the notebook (see read_notebook()) to a
+    tuple (cell index, line index) of the line of the code cell it comes
+    from, or to None.
+    """
+
+    def __init__(self, nb, text, lines):
+        self.nb = nb
+        self.text = text
+        self.lines = lines
+
+    def replace(self, code, replacements):
+        """
+        Replace the star import statements in the cells, for the code of
+        the notebook code and the replacements from fix_notebook_code()
+
+        Returns the indices of the cells that were changed.
+        """
+        cells = self.nb["cells"]
+        sources = {}
+        for n, line in enumerate(code.split("\n")):
+            if "*" not in line or self.lines[n] is None:
+                continue
+            for statement in STAR_IMPORT_STATEMENT.findall(line):
+                if statement not in replacements:
+                    continue
+                i, j = self.lines[n]
+                if i not in sources:
+                    sources[i] = _source(cells[i]).split("\n")
+                new_line = sources[i][j].replace(statement, replacements[statement])
+                if new_line == sources[i][j]:
+                    continue
+                sources[i][j] = new_line
+        for i, lines in sources.items():
+            source = "\n".join(lines)
+            if isinstance(cells[i]["source"], list):
+                source = source.splitlines(keepends=True)
+            cells[i]["source"] = source
+        return sorted(sources)
+
+    def patch(self, changed):
+        """
+        Get the JSON text of the notebook with the sources of the cells with
+        the indices in changed updated
+
+        Everything else is kept exactly as it is in text, including the
+        outputs and the formatting of the JSON.
+        """
+        spans = _source_spans(self.text)
+        chunks = []
+        end = 0
+        for i in changed:
+            start = spans[i][0]
+            chunks.append(self.text[end:start])
+            end = spans[i][1]
+            chunks.append(_dump_source(self.nb["cells"][i]["source"], self.text[start:end]))
+        chunks.append(self.text[end:])
+        return "".join(chunks)
+
+
+def read_notebook(data):
+    """
+    Parse the notebook from the bytes data
+
+    Returns a tuple (nb, code), where nb is a Notebook, or an nbformat
+    notebook for notebooks older than nbformat 4, and code is the code of
+    its code cells. Raises ValueError if data is not a notebook, and
+    ImportError if nbformat or nbconvert is needed but not installed.
+    """
+    text = data.decode("utf-8")
+    with timings.phase("parse"):
+        nb = json.loads(text)
+    if not isinstance(nb, dict) or "nbformat" not in nb:
+        raise ValueError("not a Jupyter notebook")
+    if nb["nbformat"] == 4:  # noqa: PLR2004
+        with timings.phase("parse"):
+            lines, code = _read_notebook_v4(nb)
+        return Notebook(nb, text, lines), code
+
+    if (
+        importlib.util.find_spec("nbconvert") is None
+        or importlib.util.find_spec("nbformat") is None
+    ):
+        raise ImportError("nbformat and nbconvert are required for notebooks")
+    import nbformat
+    from nbconvert import PythonExporter
+
+    with timings.phase("parse"):
+        nb = nbformat.reads(data.decode("utf-8"), nbformat.NO_CONVERT)
+        code, _ = PythonExporter().from_notebook_node(nb)
+    return nb, code
+
+
+def _read_notebook_v4(nb):
+    # The same layout as the PythonExporter, except for the raw cells, which
+    # are left out
+    code = ["#!/usr/bin/env python", "# coding: utf-8"]
+    lines = [None, None]
+    for i, cell in enumerate(nb["cells"]):
+        source = _source(cell)
+        if cell["cell_type"] == "markdown":
+            code.append("")
+            code.extend("# " + line for line in source.split("\n"))
+        elif cell["cell_type"] == "code":
+            execution_count = cell.get("execution_count") or " "
+            code.extend(["", f"# In[{execution_count}]:", "", ""])
+            lines.extend([None] * (len(code) - len(lines)))
+            source = source.split("\n")
+            if len(source) > 1 and not source[-1]:
+                source.pop()
+            for j, line in _python_lines(source):
+                code.append(line)
+                lines.append((i, j) if j is not None else None)
+            code.append("")
+        lines.extend([None] * (len(code) - len(lines)))
+    return lines, "\n".join(code) + "\n"
+
+
+def _source(cell):
+    source = cell["source"]
+    return "".join(source) if isinstance(source, list) else source
+
+
+def _python_lines(source):
+    """
+    Yield (line index, line) for the lines of the cell source, with IPython
+    magics and shell commands translated and the cell dedented like IPython
+    does
+
+    The line index is the index in source, or None for a line that doesn't
+    correspond to one. Only the lines that start a logical line can be
+    magics or shell commands, not the ones that continue a statement in
+    brackets, after a backslash or in a triple-quoted string.
+    """
+    if source[0].startswith("%%"):
+        magic, _, args = source[0][2:].partition(" ")
+        body = "\n".join(source[1:]) + "\n"
+        yield None, f"get_ipython().run_cell_magic({magic!r}, {args!r}, {body!r})"
+        return
+    first = source[0].lstrip()
+    leading_indent = source[0][: len(source[0]) - len(first)]
+    depth, quote, continued = 0, None, False
+    for j, line in enumerate(source):
+        if leading_indent and line.startswith(leading_indent):
+            line = line[len(leading_indent) :]  # noqa: PLW2901
+        stripped = line.lstrip()
+        indent = line[: len(line) - len(stripped)]
+        logical = not depth and quote is None and not continued
+        if logical and stripped.startswith("%"):
+            magic, _, args = stripped[1:].partition(" ")
+            yield j, f"{indent}get_ipython().run_line_magic({magic!r}, {args!r})"
+        elif logical and stripped.startswith("!"):
+            yield j, f"{indent}get_ipython().system({stripped[1:]!r})"
+        else:
+            depth, quote, continued = _scan_line(line, depth, quote)
+            yield j, line
+
+
+def _scan_line(line, depth, quote):
+    """
+    Scan a line of Python code for brackets, strings and comments
+
+    depth is the number of brackets that are open and quote the quote of the
+    string that is open, or None, at the start of the line. Returns the new
+    (depth, quote) at the end of the line, and whether the line ends with a
+    backslash continuation.
+    """
+    i = 0
+    while i < len(line):
+        c = line[i]
+        if quote is not None:
+            if c == "\\" and i == len(line) - 1:
+                # The string continues on the next line
+                return depth, quote, False
+            if c == "\\":
+                i += 2
+                continue
+            if line.startswith(quote, i):
+                i += len(quote)
+                quote = None
+                continue
+        elif c == "#":
+            break
+        elif c in "'\"":
+            quote = c * 3 if line.startswith(c * 3, i) else c
+            i += len(quote)
+            continue
+        elif c in "([{":
+            depth += 1
+        elif c in ")]}":
+            depth = max(depth - 1, 0)
+        elif c == "\\" and i == len(line) - 1:
+            return depth, quote, True
+        i += 1
+    if quote is not None and len(quote) == 1:
+        # Single-quoted strings end with the line
+        quote = None
+    return depth, quote, False
+
+
+def fix_notebook_code(  # noqa: PLR0913
+    code,
+    *,
+    file,
+    max_line_length=100,
+    verbose=False,
+    quiet=False,
+    allow_dynamic=True,
+    index=None,
+):
+    """
+    Fix the code of the notebook `file`, as returned by read_notebook()
+
+    Returns a tuple (new_code, repls, replacements, messages), where repls
+    maps the star imported modules to the names imported from them instead
+    (see get_replacements()), replacements maps the replaced star import
+    statements to their replacements, for write_notebook(), and messages are
+    the warnings and verbose messages (see print_messages()). The other
+    arguments are the same as for fix_code().
+
+    The analysis of the code is not cached, because the code is not the
+    contents of `file`.
+    """
+    repls, messages = get_replacements(
+        code, file=file, quiet=quiet, allow_dynamic=allow_dynamic, cache=None, index=index
+    )
+    with timings.phase("replace"):
+        new_code, replacements, replace_messages = replace_imports_and_statements(
+            code,
+            repls,
+            file=file,
+            verbose=verbose,
+            quiet=quiet,
+            max_line_length=max_line_length,
+        )
+    return new_code, repls, replacements, messages + replace_messages
+
+
+def write_notebook(file, nb, code, replacements, *, write=write_atomic):
+    """
+    Apply the replacements from fix_notebook_code() to the code cells of the
+    notebook nb with the code `code`, both from read_notebook(), and write
+    it to `file`
+
+    The file is written with write(file, data), where data is bytes, like
+    write_atomic() or Writer.write() (from removestar.writer).
+    """
+    if isinstance(nb, Notebook):
+        # Only the sources of the changed cells are rewritten in the file
+        changed = nb.replace(code, replacements)
+        if changed:
+            write(file, nb.patch(changed).encode("utf-8"))
+        return
+    source = replace_in_nb(nb, replacements, cell_type="code")
+    write(file, text_bytes(source))
+
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+_decoder = json.JSONDecoder()
+
+
+def _source_spans(text):
+    """
+    Find the (start, end) offsets of the source of each cell in the JSON
+    text of a notebook
+    """
+    spans = []
+
+    def cell_member(key, start):
+        end = _value(text, start)
+        if key == "source":
+            spans[-1] = (start, end)
+        return end
+
+    def cell(start):
+        spans.append(None)
+        return _object(text, start, cell_member)
+
+    def member(key, start):
+        if key == "cells":
+            return _array(text, start, cell)
+        return _value(text, start)
+
+    _object(text, _WHITESPACE.match(text).end(), member)
+    return spans
+
+
+def _value(text, start):
+    return _decoder.raw_decode(text, start)[1]
+
+
+def _object(text, start, member):
+    """
+    Parse the JSON object at text[start], calling member(key, start) for
+    each member, which must return the end of the value starting at start
+
+    Returns the end of the object.
+    """
+    return _container(text, start, "{}", member)
+
+
+def _array(text, start, item):
+    """
+    Parse the JSON array at text[start], calling item(start) for each item,
+    which must return the end of the item starting at start
+
+    Returns the end of the array.
+    """
+    return _container(text, start, "[]", lambda key, start: item(start))
+
+
+def _container(text, start, brackets, visit):
+    if text[start] != brackets[0]:
+        raise ValueError(f"expected {brackets[0]!r} at {start}")
+    i = _WHITESPACE.match(text, start + 1).end()
+    if text[i] == brackets[1]:
+        return i + 1
+    while True:
+        key = None
+        if brackets == "{}":
+            key, i = _decoder.raw_decode(text, i)
+            i = _WHITESPACE.match(text, i).end() + 1  # The ':'
+            i = _WHITESPACE.match(text, i).end()
+        i = _WHITESPACE.match(text, visit(key, i)).end()
+        if text[i] == brackets[1]:
+            return i + 1
+        i = _WHITESPACE.match(text, i + 1).end()  # After the ','
+
+
+def _dump_source(source, old):
+    """
+    Get the JSON for the cell source, formatted like the JSON old it
+    replaces
+    """
+    if isinstance(source, str) or not source or old == "[]":
+        return json.dumps(source, ensure_ascii=False)
+    # The whitespace after the '[' and before the ']' in old, for instance
+    # '\n    ' and '\n   ' for nbformat
+    first = _WHITESPACE.match(old, 1).group()
+    last = old[len(old[:-1].rstrip()) : -1]
+    items = [json.dumps(line, ensure_ascii=False) for line in source]
+    return "[" + first + ("," + first).join(items) + last + "]"
@@ -1,25 +1,38 @@
 import ast
 import builtins
-import contextlib
+import importlib.machinery
 import os
 import re
 import sys
+import tokenize
 from functools import lru_cache
 from pathlib import Path
 
-from pyflakes.checker import _MAGIC_GLOBALS, Checker, ModuleScope
-from pyflakes.messages import ImportStarUsage, ImportStarUsed
+from . import timings
+from .exports import collect_names, has_static_exports
+from .output import green, yellow
 
-with contextlib.suppress(ImportError):
-    from nbconvert import NotebookExporter
+# pyflakes is only imported when it is first needed, so that runs that don't
+# find any star import don't pay for importing it
 
-from .output import green, yellow
 
-# quit and exit are not included in old versions of pyflakes
-MAGIC_GLOBALS = set(_MAGIC_GLOBALS).union({"quit", "exit"})
+@lru_cache(maxsize=None)
+def _magic_globals():
+    from pyflakes.checker import _MAGIC_GLOBALS
+
+    # quit and exit are not included in old versions of pyflakes
+    return frozenset(_MAGIC_GLOBALS).union({"quit", "exit"})
+
+
+def __getattr__(name):
+    if name == "MAGIC_GLOBALS":
+        return set(_magic_globals())
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def names_to_replace(checker):
+    from pyflakes.messages import ImportStarUsage
+
     names = set()
     for message in checker.messages:
         if isinstance(message, ImportStarUsage):
@@ -29,6 +42,8 @@ def names_to_replace(checker):
 
 
 def star_imports(checker):
+    from pyflakes.messages import ImportStarUsed
+
     return [
         message.message_args[0]
         for message in checker.messages
@@ -36,7 +51,33 @@ def star_imports(checker):
     ]
 
 
-def fix_code(
+# Anything that could separate "import" from "*" in a star import, either in a
+# Python file (whitespace and backslash continuations) or in the JSON of a
+# notebook (escape sequences, and the quotes and commas between the lines of
+# a cell source).
+STAR_IMPORT_BYTES = re.compile(rb'import[\s\\",ntrf]*\*')
+
+
+def may_contain_star_import(data):
+    r"""
+    Check if the raw bytes data of a file may contain a star import
+
+    This is a fast check that is done before the file is decoded or parsed.
+    It may give false positives but never gives false negatives.
+
+    Example:
+
+    >>> may_contain_star_import(b'from os.path import *\n')
+    True
+    >>> may_contain_star_import(b'from os.path import \\\n    *\n')
+    True
+    >>> may_contain_star_import(b'import os\nfrom os.path import join\n')
+    False
+    """
+    return STAR_IMPORT_BYTES.search(data) is not None
+
+
+def fix_code(  # noqa: PLR0913
     code,
     *,
     file,
@@ -44,6 +85,8 @@ def fix_code(
     verbose=False,
     quiet=False,
     allow_dynamic=True,
+    cache=None,
+    index=None,
     **kws_replace_imports,
 ):
     """
@@ -55,57 +98,109 @@ def fix_code(
     arguments to this function.
 
     If allow_dynamic=True, then external modules will be dynamically imported.
+
+    If cache is an ExportCache (from removestar.cache), the names of the star
+    imported modules are looked up in it and stored in it. The names defined
+    by code are also stored in it, so that code is not analyzed again if
+    another file star imports `file`. code should be the contents of `file`
+    in this case.
+
+    If index is a ProjectIndex (from removestar.index), the star imported
+    modules are resolved through it instead, and allow_dynamic is ignored.
+    """
+    repls, messages = get_replacements(
+        code, file=file, quiet=quiet, allow_dynamic=allow_dynamic, cache=cache, index=index
+    )
+    print_messages(messages)
+
+    with timings.phase("replace"):
+        new_code = replace_imports(
+            code,
+            repls,
+            file=file,
+            verbose=verbose,
+            quiet=quiet,
+            max_line_length=max_line_length,
+            **kws_replace_imports,
+        )
+
+    return new_code
+
+
+def get_replacements(code, *, file, quiet=False, allow_dynamic=True, cache=None, index=None):
+    """
+    Get the names to import from each star imported module in the code
+    `code` from the file `file`
+
+    Returns a tuple (repls, messages), where repls is a dictionary mapping
+    the modules to lists of names, which can be passed to replace_imports(),
+    and messages are the warnings (see print_messages()), which are left out
+    if quiet=True. The other arguments are the same as for fix_code().
     """
     directory, filename = os.path.split(file)
 
     try:
-        tree = ast.parse(code, filename=file)
+        stars, names, _ = analyze_cached(code, file, cache)
     except SyntaxError as e:
         raise RuntimeError(f"SyntaxError: {e}") from e
 
-    checker = Checker(tree)
-
-    stars = star_imports(checker)
-    names = names_to_replace(checker)
-
     mod_names = {}
     for mod in stars:
-        mod_names[mod] = get_module_names(mod, directory, allow_dynamic=allow_dynamic)
+        if index is not None:
+            mod_names[mod] = index.get_module_names(mod, directory)
+        else:
+            mod_names[mod] = get_module_names(
+                mod, directory, allow_dynamic=allow_dynamic, cache=cache
+            )
+
+    # Map each name to the modules it can come from, in the order of the star
+    # imports. Intersecting with each module's names only costs as much as the
+    # smaller of the two sets, which matters for modules like numpy.
+    providers = {}
+    for mod, names_in_mod in mod_names.items():
+        for name in names.intersection(names_in_mod):
+            providers.setdefault(name, []).append(mod)
 
     repls = {i: [] for i in stars}
-    for name in names:
-        mods = [mod for mod in mod_names if name in mod_names[mod]]
+    messages = []
+    # Sorted so that the warnings are in a deterministic order
+    for name in sorted(names):
+        mods = providers.get(name)
         if not mods:
             if not quiet:
-                print(
-                    yellow(f"Warning: {file}: could not find import for '{name}'"),
-                    file=sys.stderr,
-                )
+                messages.append(("warning", f"Warning: {file}: could not find import for '{name}'"))
             continue
         if len(mods) > 1 and not quiet:
-            print(
-                yellow(
-                    f"Warning: {file}: '{name}' comes from multiple modules: {', '.join(map(repr, mods))}. Using '{mods[-1]}'."  # noqa: E501
-                ),
-                file=sys.stderr,
+            messages.append(
+                (
+                    "warning",
+                    f"Warning: {file}: '{name}' comes from multiple modules: {', '.join(map(repr, mods))}. Using '{mods[-1]}'.",  # noqa: E501
+                )
             )
 
         repls[mods[-1]].append(name)
 
-    new_code = replace_imports(
-        code,
-        repls,
-        file=file,
-        verbose=verbose,
-        quiet=quiet,
-        max_line_length=max_line_length,
-        **kws_replace_imports,
-    )
+    return repls, messages
 
-    return new_code
+
+def print_messages(messages, *, quiet=False):
+    """
+    Print the messages from get_replacements() or
+    replace_imports_and_statements() to standard error
+
+    messages is a list of tuples (kind, message), where kind is "warning" or
+    "info" (the messages of verbose=True). Warnings are printed in yellow,
+    unless quiet=True, and the other messages in green.
+    """
+    for kind, message in messages:
+        if kind == "warning":
+            if not quiet:
+                print(yellow(message), file=sys.stderr)
+        else:
+            print(green(message), file=sys.stderr)
 
 
-def replace_imports(  # noqa: C901,PLR0913
+def replace_imports(  # noqa: PLR0913
     code,
     repls,
     *,
@@ -152,12 +247,31 @@ def replace_imports(  # noqa: C901,PLR0913
     from .module.submodule import (name1, name2,
                                   name3)
 
+    """
+    new_code, replacements, messages = replace_imports_and_statements(
+        code, repls, max_line_length=max_line_length, file=file, verbose=verbose, quiet=quiet
+    )
+    print_messages(messages)
+    return replacements if return_replacements else new_code
+
+
+def replace_imports_and_statements(  # noqa: C901
+    code, repls, *, max_line_length=100, file=None, verbose=False, quiet=False
+):
+    """
+    Replace the star imports in code, and return the new code, the
+    replacements and the messages
+
+    Returns a tuple (new_code, replacements, messages), where replacements
+    maps each replaced star import statement to its replacement, as returned
+    by replace_imports(return_replacements=True), and messages are the
+    messages that replace_imports() prints (see print_messages()). The
+    arguments are the same as for replace_imports().
     """
     warning_prefix = f"Warning: {file}: " if file else "Warning: "
     verbose_prefix = f"{file}: " if file else ""
 
-    if return_replacements:
-        repls_strings = {}
+    new_imports = {}
     for mod in repls:
         names = sorted(repls[mod])
 
@@ -176,61 +290,78 @@ def replace_imports(  # noqa: C901,PLR0913
                     line += name + ", "
                 lines.append(line[:-2] + ")")  # Remove last trailing comma
                 new_import = "\n".join(lines)
+        new_imports[mod] = new_import
 
-        def star_import_replacement(match, verbose=verbose, quiet=quiet):
-            original_import, after_import, comment = match.group(0, 1, 2)
-            if comment and is_noqa_comment_allowing_star_import(comment):
-                if verbose:
-                    print(
-                        green(
-                            f"{verbose_prefix}Retaining 'from {mod} import *' due to noqa comment"
-                        ),
-                        file=sys.stderr,
-                    )
-                return original_import
+    # All the star imports are replaced in a single pass over the code. The
+    # messages are collected per module and put together afterwards so that
+    # they come out in the order of repls.
+    messages = {mod: [] for mod in repls}
+    first_replacements = {}
+
+    def star_import_replacement(match):
+        original_import, mod, after_import, comment = match.group(
+            0, "mod", "after_import", "comment"
+        )
+        if mod not in new_imports:
+            return original_import
+        new_import = new_imports[mod]
 
+        if comment and is_noqa_comment_allowing_star_import(comment):
+            if verbose:
+                messages[mod].append(
+                    ("info", f"{verbose_prefix}Retaining 'from {mod} import *' due to noqa comment")
+                )
+            replacement = original_import
+        else:
             if verbose:
-                print(
-                    green(
-                        f"{verbose_prefix}Replacing 'from {mod} import *' with '{new_import.strip()}'"  # noqa: E501
-                    ),
-                    file=sys.stderr,
+                messages[mod].append(
+                    (
+                        "info",
+                        f"{verbose_prefix}Replacing 'from {mod} import *' with '{new_import.strip()}'",  # noqa: E501
+                    )
                 )
 
             if not new_import and comment:
                 if not quiet:
-                    print(
-                        yellow(
+                    messages[mod].append(
+                        (
+                            "warning",
                             f"{warning_prefix}The removed star import statement for '{mod}' "
-                            f"had an inline comment which may not make sense without the import"
-                        ),
-                        file=sys.stderr,
+                            f"had an inline comment which may not make sense without the import",
+                        )
                     )
-                return f"{comment}\n"
-            if not (new_import or after_import):
-                return ""
-            return f'{new_import}{after_import or ""}\n'
-
-        star_import = re.compile(rf"from +{re.escape(mod)} +import +\*( *(#.*))?\n")
-        new_code, subs_made = star_import.subn(star_import_replacement, code)
-        if subs_made == 0 and not quiet:
-            print(
-                yellow(f"{warning_prefix}Could not find the star imports for '{mod}'"),
-                file=sys.stderr,
+                replacement = f"{comment}\n"
+            elif not (new_import or after_import):
+                replacement = ""
+            else:
+                replacement = f"{new_import}{after_import or ''}\n"
+
+        first_replacements.setdefault(mod, replacement)
+        return replacement
+
+    new_code = STAR_IMPORT.sub(star_import_replacement, code)
+
+    all_messages = []
+    for mod in repls:
+        all_messages.extend(messages[mod])
+        if mod not in first_replacements and not quiet:
+            all_messages.append(
+                ("warning", f"{warning_prefix}Could not find the star imports for '{mod}'")
             )
 
-        if return_replacements:
-            for match in star_import.finditer(code):
-                repls_strings[f"from {mod} import *"] = star_import_replacement(
-                    match,
-                    verbose=False,
-                    quiet=True,
-                ).strip()
-                break
+    replacements = {
+        f"from {mod} import *": first_replacements[mod].strip()
+        for mod in repls
+        if mod in first_replacements
+    }
+    return new_code, replacements, all_messages
 
-        code = new_code
 
-    return repls_strings if return_replacements else code
+# A star import that can be replaced. The module name is looked up in repls
+# by replace_imports().
+STAR_IMPORT = re.compile(
+    r"from +(?P<mod>[\w.]+) +import +\*(?P<after_import> *(?P<comment>#.*))?\n"
+)
 
 
 # This regex is based on Flake8's noqa regex:
@@ -340,52 +471,226 @@ def get_mod_filename(mod, directory):
 
 
 @lru_cache()
-def get_module_names(mod, directory, *, allow_dynamic=True, _found=()):
+def get_module_names(mod, directory, *, allow_dynamic=True, cache=None, _found=()):
     """
     Get the names defined in the module 'mod'
 
     'directory' should be the directory where the file with the import is.
     This is only used for static import determination.
 
-    If allow_dynamic=True, then external module names are found by importing
-    the module directly.
+    External modules are found on sys.path and parsed if they are pure
+    Python modules whose names can be determined statically (see
+    get_names_statically()). If allow_dynamic=True, this is only done for
+    modules with '__all__', and the other modules are imported directly to
+    find their names.
+
+    If cache is an ExportCache, it is used to avoid parsing or importing
+    modules whose names were found by a previous run.
     """
     try:
-        names = get_names_from_dir(mod, directory, allow_dynamic=allow_dynamic, _found=_found)
+        names = get_names_from_dir(
+            mod, directory, allow_dynamic=allow_dynamic, cache=cache, _found=_found
+        )
     except ExternalModuleError as e:
-        if allow_dynamic:
-            names = get_names_dynamically(mod)
-        else:
-            raise NotImplementedError(
-                "Static determination of external module imports is not supported."
-            ) from e
+        # Without dynamic importing, approximate names are better than none
+        approximate = not allow_dynamic
+        names = cache.get_dynamic_names(mod, approximate=approximate) if cache is not None else None
+        if names is None:
+            imports = ()
+            names = get_names_statically(mod, require_all=allow_dynamic)
+            if names is None:
+                if not allow_dynamic:
+                    raise NotImplementedError(
+                        "Static determination of external module imports is not supported."
+                    ) from e
+                names = get_names_dynamically(mod)
+                imports = get_star_imported_modules(mod)
+            if cache is not None:
+                # The markers are kept, so that the entry stays valid as long
+                # as mod itself doesn't change
+                cache.set_dynamic_names(mod, names, imports=imports, approximate=approximate)
+        names = set(names)
+        for name in names.copy():
+            if name.endswith(".*"):
+                names.remove(name)
+                rec_mod = name[:-2]
+                if rec_mod not in _found:
+                    _found += (rec_mod,)
+                    names |= get_module_names(
+                        rec_mod,
+                        ".",
+                        allow_dynamic=allow_dynamic,
+                        cache=cache,
+                        _found=_found,
+                    )
     return names
 
 
 def get_names_dynamically(mod):
     d = {}
     try:
-        exec(f"from {mod} import *", d)
+        with timings.phase("import"):
+            exec(f"from {mod} import *", d)
     except ImportError as import_e:
         raise RuntimeError(f"Could not import {mod}") from import_e
     except Exception as e:
         raise RuntimeError(f"Error importing {mod}: {e}") from e
-    return d.keys() - set(MAGIC_GLOBALS)
+    return d.keys() - _magic_globals()
+
+
+def find_module_file(mod):
+    """
+    Find the source file of the external module `mod` without importing it
+
+    Returns None if `mod` is not a pure Python module on sys.path, for
+    instance if it is an extension module or a builtin module, or if it is
+    only created when its package is imported (like os.path).
+    """
+    parts = mod.split(".")
+    spec = path = None
+    for i in range(len(parts)):
+        if i and path is None:
+            # The parent is not a package
+            return None
+        try:
+            spec = importlib.machinery.PathFinder.find_spec(".".join(parts[: i + 1]), path)
+        except (ImportError, ValueError):
+            return None
+        if spec is None:
+            return None
+        path = spec.submodule_search_locations
+    if not isinstance(spec.loader, importlib.machinery.SourceFileLoader):
+        return None
+    return spec.origin
+
+
+def get_names_statically(mod, *, require_all=False):
+    """
+    Get the names defined by 'from mod import *' for the external module
+    'mod', by parsing its source instead of importing it
+
+    Star imports in the module are returned as 'mod.*' markers, with relative
+    imports made absolute, and should be resolved by the caller.
+
+    Returns None if the module has no source (see find_module_file()) or if
+    its names cannot be determined statically (see has_static_exports()).
+
+    Without '__all__', the names are only approximate: names that are only
+    defined conditionally, for instance on some platforms, are included, and
+    names that the module adds in other ways when it is imported are not. If
+    require_all=True, None is returned for these modules too.
+    """
+    parsed = _parse_module(mod)
+    if parsed is None:
+        return None
+    filename, code, tree = parsed
+    with timings.phase("resolve"):
+        if not has_static_exports(tree):
+            return None
+        scope = collect_names(tree, code, pyflakes_nonlocal=False)
+    if "__all__" in scope:
+        return set(scope["__all__"])
+    if require_all:
+        return None
+
+    names = set()
+    for name in scope.keys() - _magic_globals():
+        if name.endswith(".*"):
+            rec_mod = _absolute_module(name[:-2], mod, filename)
+            if rec_mod is None:
+                return None
+            names.add(rec_mod + ".*")
+        elif not name.startswith("_"):
+            names.add(name)
+    return names
 
 
-def get_names_from_dir(mod, directory, *, allow_dynamic=True, _found=()):
-    filename = Path(get_mod_filename(mod, directory))
+def get_star_imported_modules(mod):
+    """
+    Get the external modules that the external module 'mod' star imports,
+    directly or transitively, by parsing their sources
 
-    with open(filename) as f:
-        code = f.read()
+    Modules without source (see find_module_file()) are not searched
+    further. This is used to know when the names found by importing mod may
+    have changed.
+    """
+    found = set()
+    queue = [mod]
+    while queue:
+        current = queue.pop()
+        parsed = _parse_module(current)
+        if parsed is None:
+            continue
+        filename, code, tree = parsed
+        with timings.phase("resolve"):
+            scope = collect_names(tree, code, pyflakes_nonlocal=False)
+        for name in scope:
+            if name.endswith(".*"):
+                rec_mod = _absolute_module(name[:-2], current, filename)
+                if rec_mod is not None and rec_mod != mod and rec_mod not in found:
+                    found.add(rec_mod)
+                    queue.append(rec_mod)
+    return found
+
+
+def _parse_module(mod):
+    """
+    Find, read and parse the source of the external module 'mod'
 
+    Returns a tuple (filename, code, tree), or None if it has no source or
+    can't be parsed.
+    """
+    with timings.phase("resolve"):
+        filename = find_module_file(mod)
+    if filename is None:
+        return None
     try:
-        names = get_names(code, filename)
-    except SyntaxError as e:
-        raise RuntimeError(f"Could not parse {filename}: {e}") from e
-    except RuntimeError as runtime_e:
-        raise RuntimeError(f"Could not parse the names from {filename}") from runtime_e
+        with timings.phase("read"), tokenize.open(filename) as f:
+            code = f.read()
+        with timings.phase("parse"):
+            tree = ast.parse(code, filename)
+    except (OSError, SyntaxError, UnicodeDecodeError):
+        return None
+    return filename, code, tree
 
+
+def _absolute_module(rec_mod, mod, filename):
+    """
+    Make the module rec_mod, star imported in the module 'mod' in the file
+    `filename`, absolute
+
+    Returns None if it is a relative import beyond the top-level package.
+    """
+    level = len(rec_mod) - len(rec_mod.lstrip("."))
+    if not level:
+        return rec_mod
+    package = mod if os.path.basename(filename) == "__init__.py" else mod.rpartition(".")[0]
+    base = package.split(".")
+    if level - 1 >= len(base):
+        return None
+    return ".".join(base[: len(base) - (level - 1)] + [rec_mod[level:]]).rstrip(".")
+
+
+def get_names_from_dir(mod, directory, *, allow_dynamic=True, cache=None, _found=()):
+    with timings.phase("resolve"):
+        filename = Path(get_mod_filename(mod, directory))
+
+    names = cache.get_file_names(filename) if cache is not None else None
+    if names is None:
+        with timings.phase("read"), open(filename) as f:
+            code = f.read()
+
+        try:
+            names = get_names(code, filename)
+        except SyntaxError as e:
+            raise RuntimeError(f"Could not parse {filename}: {e}") from e
+        except RuntimeError as runtime_e:
+            raise RuntimeError(f"Could not parse the names from {filename}") from runtime_e
+
+        if cache is not None:
+            cache.set_file_names(filename, names)
+
+    names = set(names)
     for name in names.copy():
         if name.endswith(".*"):
             names.remove(name)
@@ -397,6 +702,7 @@ def get_names_from_dir(mod, directory, *, allow_dynamic=True, _found=()):
                         rec_mod,
                         filename.parent,
                         allow_dynamic=allow_dynamic,
+                        cache=cache,
                         _found=_found,
                     )
                 )
@@ -439,13 +745,75 @@ def get_names(code, filename="<unknown>"):
 
     Returns a set of names, or raises SyntaxError if the code is not valid
     syntax.
+
+    Only the module-level statements are visited (see
+    removestar.exports.collect_names()), so this is much faster than running
+    pyflakes, but gives the same names as the module scope of a pyflakes
+    Checker.
+    """
+    return get_names_and_stars(code, filename)[0]
+
+
+def get_names_and_stars(code, filename="<unknown>"):
+    """
+    Get the names defined by code, like get_names(), and the modules it star
+    imports at the top level
+
+    Returns a tuple (names, stars). Unlike the 'mod.*' markers in names, stars
+    doesn't depend on whether code has '__all__'.
+    """
+    with timings.phase("parse"):
+        tree = ast.parse(code, filename=filename)
+    with timings.phase("resolve"):
+        scope = collect_names(tree, code)
+    stars = [name[:-2] for name in scope if name.endswith(".*")]
+    names = scope.keys() - set(dir(builtins)) - _magic_globals()
+    if "__all__" in names:
+        return set(scope["__all__"] or ()), stars
+    return names, stars
+
+
+def analyze_code(code, filename="<unknown>"):
+    """
+    Parse code and run pyflakes on it
+
+    Returns a tuple (stars, names, exports), where stars is the list of star
+    imported modules (see star_imports()), names is the set of names that come
+    from star imports (see names_to_replace()), and exports is the set of
+    top-level names defined in code (see get_names()).
+
+    Raises SyntaxError if the code is not valid syntax.
+    """
+    with timings.phase("parse"):
+        tree = ast.parse(code, filename=filename)
+    with timings.phase("pyflakes"):
+        from pyflakes.checker import Checker
+
+        checker = Checker(tree)
+        return star_imports(checker), names_to_replace(checker), _module_names(checker)
+
+
+def analyze_cached(code, filename, cache):
+    """
+    Like analyze_code(), but look up the analysis in the ExportCache cache
+    first, and store it there
+
+    code should be the contents of the file `filename`. cache may be None.
     """
-    tree = ast.parse(code, filename=filename)
+    analysis = cache.get_analysis(filename, code) if cache is not None else None
+    if analysis is None:
+        analysis = analyze_code(code, filename)
+        if cache is not None:
+            cache.set_analysis(filename, code, analysis)
+    return analysis
+
+
+def _module_names(checker):
+    from pyflakes.checker import ModuleScope
 
-    checker = Checker(tree)
     for scope in checker.deadScopes:
         if isinstance(scope, ModuleScope):
-            names = scope.keys() - set(dir(builtins)) - set(MAGIC_GLOBALS)
+            names = scope.keys() - set(dir(builtins)) - _magic_globals()
             break
     else:
         raise RuntimeError("Could not parse the names")
@@ -466,24 +834,54 @@ def replace_in_nb(
 
     Parameters
         nb: notebook object obtained from `nbformat.reads`.
-        replaces (dict): mapping of text to 'replace from' to the one to 'replace with'.
+        replaces (dict): mapping of the star import statements to replace to
+            their replacements, as from `replace_imports(return_replacements=True)`.
         cell_type (str): the type of the cell.
 
     Returns:
         source_nb: Fixed code.
     """
+    from nbconvert import NotebookExporter
+
     new_nb = nb.copy()
+    cells = new_nb["cells"]
+    # Only the lines with star imports are looked at, so the cost doesn't
+    # depend on the outputs of the cells
+    index = star_import_lines(cells, cell_type)
+    sources = {}
     for replace_from, replace_to in replaces.items():
-        break_early = str(nb).count(replace_from) == 1
-        for i, d in enumerate(new_nb["cells"]):
-            if d["cell_type"] == cell_type and replace_from in d["source"]:
-                d["source"] = d["source"].replace(replace_from, replace_to)
-                new_nb["cells"][i] = d
-                if break_early:
-                    break
+        for i, j in index.get(replace_from, ()):
+            if i not in sources:
+                sources[i] = cells[i]["source"].splitlines(keepends=True)
+            sources[i][j] = sources[i][j].replace(replace_from, replace_to)
+    for i, lines in sources.items():
+        cells[i]["source"] = "".join(lines)
 
     ## save new nb
     to_nb = NotebookExporter()
     source_nb, _ = to_nb.from_notebook_node(new_nb)
 
     return source_nb
+
+
+def star_import_lines(cells, cell_type="code"):
+    """
+    Find the star import statements in the notebook cells `cells`
+
+    Returns a dictionary mapping each star import statement, as in the keys
+    of replace_imports(return_replacements=True), to a list of (cell index,
+    line index) pairs of the lines that contain it in the cells of type
+    cell_type.
+    """
+    index = {}
+    for i, cell in enumerate(cells):
+        if cell["cell_type"] != cell_type or "*" not in cell["source"]:
+            continue
+        for j, line in enumerate(cell["source"].splitlines(keepends=True)):
+            for statement in STAR_IMPORT_STATEMENT.findall(line):
+                index.setdefault(statement, []).append((i, j))
+    return index
+
+
+# A star import statement in a line of a notebook cell
+STAR_IMPORT_STATEMENT = re.compile(r"from +[\w.]+ +import +\*")
@@ -0,0 +1,198 @@
+"""
+Timing of the phases of a run, for --timings
+
+The functions in removestar wrap each phase of their work (reading files,
+parsing, running pyflakes, ...) in phase(), and the resolution of each star
+imported module in module(). These do nothing unless a Timings is active in
+the current thread:
+
+    >>> from removestar.removestar import fix_code
+    >>> timings = Timings()
+    >>> with timings.activate():
+    ...     new_code = fix_code("from os.path import *\\njoin\\n", file="example.py")
+    >>> 'pyflakes' in timings.phases
+    True
+    >>> print(timings.summary())  # doctest: +SKIP
+"""
+
+import contextlib
+import threading
+import time
+
+# The phases, in the order they are shown in the summary
+PHASES = {
+    "read": "Reading files",
+    "parse": "Parsing (ast.parse)",
+    "pyflakes": "Running pyflakes",
+    "resolve": "Resolving star imports statically",
+    "import": "Importing modules dynamically",
+    "replace": "Replacing imports",
+    "diff": "Making diffs",
+    "color": "Coloring diffs",
+    "write": "Writing files",
+    "queue": "Queueing files to write",
+}
+
+_NULL = contextlib.nullcontext()
+_local = threading.local()
+
+
+class Timings:
+    """
+    Wall and CPU time spent in each phase, file and star imported module
+
+    The time of a phase does not include the time of the phases nested in it
+    (for instance, the time to parse a module while resolving a star import
+    of it is only counted as parsing), so the phases add up to the total. In
+    the same way, the time of a module does not include the time of the
+    modules it star imports. The time of a file includes everything done to
+    fix it.
+
+    phases, files and modules map names to lists [wall, cpu, calls]. CPU time
+    is the time of the current thread, so it does not include the time spent
+    in processes that import modules.
+    """
+
+    def __init__(self):
+        self.phases = {}
+        self.files = {}
+        self.modules = {}
+        # Frames [wall start, cpu start, wall of children, cpu of children]
+        self._phase_stack = []
+        self._module_stack = []
+
+    def __getstate__(self):
+        return {"phases": self.phases, "files": self.files, "modules": self.modules}
+
+    def __setstate__(self, state):
+        self.__init__()
+        self.__dict__.update(state)
+
+    @contextlib.contextmanager
+    def activate(self):
+        """
+        Record the timings of everything done in the current thread in the
+        with block
+        """
+        previous = getattr(_local, "timings", None)
+        _local.timings = self
+        try:
+            yield self
+        finally:
+            _local.timings = previous
+
+    def phase(self, name):
+        return self._timed(self.phases, name, self._phase_stack)
+
+    def module(self, name):
+        return self._timed(self.modules, name, self._module_stack)
+
+    def file(self, name):
+        return self._timed(self.files, name, None)
+
+    @contextlib.contextmanager
+    def _timed(self, totals, name, stack):
+        frame = [time.perf_counter(), time.thread_time(), 0.0, 0.0]
+        if stack is not None:
+            stack.append(frame)
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - frame[0]
+            cpu = time.thread_time() - frame[1]
+            if stack is not None:
+                stack.pop()
+                if stack:
+                    stack[-1][2] += wall
+                    stack[-1][3] += cpu
+                wall -= frame[2]
+                cpu -= frame[3]
+            total = totals.setdefault(name, [0.0, 0.0, 0])
+            total[0] += wall
+            total[1] += cpu
+            total[2] += 1
+
+    def merge(self, other):
+        """
+        Add the timings recorded in other, for instance in another process
+        """
+        for totals, other_totals in [
+            (self.phases, other.phases),
+            (self.files, other.files),
+            (self.modules, other.modules),
+        ]:
+            for name, (wall, cpu, calls) in other_totals.items():
+                total = totals.setdefault(name, [0.0, 0.0, 0])
+                total[0] += wall
+                total[1] += cpu
+                total[2] += calls
+
+    def summary(self, top=10):
+        """
+        Get a table of the time spent in each phase, and of the `top` slowest
+        files and modules
+        """
+        rows = [("Phase", "Wall (s)", "CPU (s)", "Calls")]
+        phases = [phase for phase in PHASES if phase in self.phases]
+        phases += sorted(self.phases.keys() - PHASES.keys())
+        rows.extend((PHASES.get(phase, phase), *self.phases[phase]) for phase in phases)
+        rows.append(
+            (
+                "Total",
+                sum(wall for wall, _, _ in self.phases.values()),
+                sum(cpu for _, cpu, _ in self.phases.values()),
+                "",
+            )
+        )
+        for title, totals in [("files", self.files), ("modules", self.modules)]:
+            if not totals:
+                continue
+            slowest = sorted(totals.items(), key=lambda item: item[1][0], reverse=True)[:top]
+            rows.append(None)
+            rows.append((f"Slowest {title}", "Wall (s)", "CPU (s)", ""))
+            rows.extend((name, wall, cpu, "") for name, (wall, cpu, _) in slowest)
+
+        width = max(len(row[0]) for row in rows if row is not None)
+        lines = []
+        for row in rows:
+            if row is None:
+                lines.append("")
+                continue
+            name, wall, cpu, calls = row
+            if isinstance(wall, float):
+                wall, cpu = f"{wall:.3f}", f"{cpu:.3f}"
+            lines.append(f"{name:<{width}} {wall:>9} {cpu:>9} {calls:>7}".rstrip())
+        return "\n".join(lines)
+
+
+def current():
+    """
+    Get the Timings that is active in the current thread, or None
+    """
+    return getattr(_local, "timings", None)
+
+
+def phase(name):
+    """
+    Time the phase `name` in the with block, if a Timings is active
+    """
+    timings = getattr(_local, "timings", None)
+    return timings.phase(name) if timings is not None else _NULL
+
+
+def module(name):
+    """
+    Time the resolution of the star imported module `name` in the with
+    block, if a Timings is active
+    """
+    timings = getattr(_local, "timings", None)
+    return timings.module(name) if timings is not None else _NULL
+
+
+def file(name):
+    """
+    Time the fixing of the file `name` in the with block, if a Timings is
+    active
+    """
+    timings = getattr(_local, "timings", None)
+    return timings.file(name) if timings is not None else _NULL
@@ -0,0 +1,299 @@
+"""
+Finding the Python files and notebooks to fix in directories
+
+Directories are walked with os.scandir(). Excluded directories are pruned
+before they are descended into, so nothing inside them is even listed.
+"""
+
+import fnmatch
+import os
+import re
+
+# Directories that don't normally contain code to fix (the same as black)
+DEFAULT_EXCLUDE = [
+    ".direnv",
+    ".eggs",
+    ".git",
+    ".hg",
+    ".ipynb_checkpoints",
+    ".mypy_cache",
+    ".nox",
+    ".pytest_cache",
+    ".ruff_cache",
+    ".svn",
+    ".tox",
+    ".venv",
+    ".vscode",
+    "__pypackages__",
+    "__pycache__",
+    "_build",
+    "buck-out",
+    "build",
+    "dist",
+    "node_modules",
+    "venv",
+]
+
+
+def iter_paths(paths, *, exclude=None, extend_exclude=(), gitignore=True):
+    """
+    Yield the files in `paths`, and the Python files and notebooks in the
+    directories in `paths`, recursively
+
+    Files and directories given in paths are always used. Inside the
+    directories, hidden files and directories (whose name starts with a
+    '.') are skipped, and so is everything that matches one of the glob
+    patterns in exclude (DEFAULT_EXCLUDE by default) or extend_exclude, or
+    that is ignored by a .gitignore file if gitignore=True. A pattern
+    matches if it matches the name of a file or directory, or its path
+    relative to the directory in paths.
+
+    The entries of each directory are yielded in sorted order, and every
+    file is only yielded once, even if it is found through different paths.
+    """
+    patterns = _patterns(exclude, extend_exclude)
+    seen = set()
+    for path in map(os.fspath, paths):
+        if os.path.isdir(path):
+            ignores = _parent_gitignores(path) if gitignore else []
+            for file, is_dir in _walk(path, "", patterns, ignores, gitignore, seen):
+                if not is_dir:
+                    yield file
+        elif _first(os.path.realpath(path), seen):
+            yield path
+
+
+def iter_tree(directory, *, root=None, exclude=None, extend_exclude=(), gitignore=True):
+    """
+    Yield the subdirectories of `directory` and the Python files and
+    notebooks in it, recursively, as tuples (path, is_dir)
+
+    Everything that iter_paths([root]) would skip is skipped, where root is
+    directory by default, or else a directory that contains it. directory
+    itself is not checked (see excluded()), and comes first.
+    """
+    directory = os.fspath(directory)
+    root = directory if root is None else os.fspath(root)
+    relative = _relative(directory, root)
+    ignores = _tree_gitignores(directory, root) if gitignore else []
+    yield from _walk(
+        directory,
+        relative + "/" if relative else "",
+        _patterns(exclude, extend_exclude),
+        ignores,
+        gitignore,
+        set(),
+    )
+
+
+def excluded(path, *, root, is_dir, exclude=None, extend_exclude=(), gitignore=True):
+    """
+    Return True if iter_paths([root]) would skip the file or directory path,
+    which is in the directory root
+
+    Only path itself is checked, not the directories between root and path.
+    is_dir tells whether path is a directory, which also works for paths that
+    don't exist anymore.
+    """
+    path, root = os.fspath(path), os.fspath(root)
+    parent, name = os.path.split(path)
+    ignores = []
+    if gitignore:
+        ignores = _tree_gitignores(parent, root)
+        ignore = GitIgnore.read(parent)
+        if ignore is not None:
+            ignores.append(ignore)
+    return _excluded(
+        name, path, _relative(path, root), is_dir, _patterns(exclude, extend_exclude), ignores
+    )
+
+
+def _patterns(exclude, extend_exclude):
+    return [*(DEFAULT_EXCLUDE if exclude is None else exclude), *extend_exclude]
+
+
+def _relative(path, root):
+    relative = os.path.relpath(path, root).replace(os.sep, "/")
+    return "" if relative == "." else relative
+
+
+def _tree_gitignores(directory, root):
+    """
+    Read the .gitignore files that apply to the entries of directory, except
+    the one in directory itself, when root is walked
+    """
+    ignores = _parent_gitignores(root)
+    parent = root
+    for name in filter(None, _relative(directory, root).split("/")):
+        ignore = GitIgnore.read(parent)
+        if ignore is not None:
+            ignores.append(ignore)
+        parent = os.path.join(parent, name)
+    return ignores
+
+
+def _first(real_path, seen):
+    if real_path in seen:
+        return False
+    seen.add(real_path)
+    return True
+
+
+def _walk(directory, relative, patterns, ignores, gitignore, seen):
+    # Yields (path, is_dir) for directory, its subdirectories and the source
+    # files in them
+    real_directory = os.path.realpath(directory)
+    if not _first(real_directory, seen):
+        return
+    yield directory, True
+    if gitignore:
+        ignore = GitIgnore.read(directory)
+        if ignore is not None:
+            ignores = [*ignores, ignore]
+    try:
+        with os.scandir(directory) as it:
+            entries = sorted(it, key=lambda entry: entry.name)
+    except OSError:
+        return
+    for entry in entries:
+        entry_relative = f"{relative}{entry.name}"
+        try:
+            is_dir = entry.is_dir()
+        except OSError:
+            continue
+        if _excluded(entry.name, entry.path, entry_relative, is_dir, patterns, ignores):
+            continue
+        if is_dir:
+            yield from _walk(entry.path, entry_relative + "/", patterns, ignores, gitignore, seen)
+        elif entry.name.endswith((".py", ".ipynb")):
+            if entry.is_symlink():
+                real_path = os.path.realpath(entry.path)
+            else:
+                real_path = os.path.join(real_directory, entry.name)
+            if _first(real_path, seen):
+                yield entry.path, False
+
+
+def _excluded(name, path, relative, is_dir, patterns, ignores):
+    if name.startswith("."):
+        return True
+    if any(
+        fnmatch.fnmatchcase(name, pattern) or fnmatch.fnmatchcase(relative, pattern)
+        for pattern in patterns
+    ):
+        return True
+    return any(ignore.ignored(path, is_dir) for ignore in ignores)
+
+
+def _parent_gitignores(directory):
+    """
+    Read the .gitignore files in the parents of directory, up to the root of
+    the git repository it is in
+    """
+    ignores = []
+    parent = os.path.abspath(directory)
+    while not os.path.exists(os.path.join(parent, ".git")):
+        parent, name = os.path.split(parent)
+        if not name:
+            # Not in a git repository
+            return []
+        ignore = GitIgnore.read(parent)
+        if ignore is not None:
+            ignores.append(ignore)
+    return ignores[::-1]
+
+
+class GitIgnore:
+    """
+    The patterns of a .gitignore file in the directory `directory`
+
+    This supports the gitignore pattern format: comments, negated patterns
+    ('!'), patterns that only match directories (a trailing '/'), patterns
+    anchored to the directory (with a '/' at the start or in the middle),
+    and the wildcards '*', '?', '[...]' and '**'.
+    """
+
+    def __init__(self, directory, lines):
+        self.directory = os.path.abspath(directory)
+        # (regex, negated, directories only, anchored)
+        self.patterns = []
+        for line in lines:
+            pattern = line.rstrip("\n")
+            if not pattern.endswith("\\ "):
+                pattern = pattern.rstrip()
+            if not pattern or pattern.startswith("#"):
+                continue
+            negated = pattern.startswith("!")
+            if negated:
+                pattern = pattern[1:]
+            directories_only = pattern.endswith("/")
+            pattern = pattern.rstrip("/")
+            anchored = "/" in pattern
+            pattern = pattern.lstrip("/")
+            if pattern:
+                regex = re.compile(_translate(pattern) + r"\Z", re.DOTALL)
+                self.patterns.append((regex, negated, directories_only, anchored))
+
+    @classmethod
+    def read(cls, directory):
+        """
+        Read the .gitignore file in directory, or return None if there is
+        none
+        """
+        try:
+            with open(os.path.join(directory, ".gitignore"), encoding="utf-8") as f:
+                return cls(directory, f.readlines())
+        except (OSError, UnicodeDecodeError):
+            return None
+
+    def ignored(self, path, is_dir):
+        """
+        Return True if the file or directory path is ignored
+        """
+        relative = os.path.relpath(os.path.abspath(path), self.directory).replace(os.sep, "/")
+        name = relative.rpartition("/")[2]
+        ignored = False
+        for regex, negated, directories_only, anchored in self.patterns:
+            if directories_only and not is_dir:
+                continue
+            if regex.match(relative if anchored else name):
+                ignored = not negated
+        return ignored
+
+
+def _translate(pattern):
+    """
+    Translate a gitignore pattern to a regular expression for paths with '/'
+    """
+    i, n = 0, len(pattern)
+    regex = []
+    while i < n:
+        if pattern.startswith("**/", i):
+            regex.append("(?:.*/)?")
+            i += 3
+        elif pattern.startswith("/**", i) and i + 3 == n:
+            regex.append("/.*")
+            i += 3
+        elif pattern.startswith("**", i):
+            regex.append(".*")
+            i += 2
+        elif pattern[i] == "*":
+            regex.append("[^/]*")
+            i += 1
+        elif pattern[i] == "?":
+            regex.append("[^/]")
+            i += 1
+        elif pattern[i] == "[" and "]" in pattern[i + 2 :]:
+            end = pattern.index("]", i + 2)
+            chars = pattern[i + 1 : end]
+            if chars[0] == "!":
+                chars = "^" + chars[1:]
+            regex.append(f"[{chars}]")
+            i = end + 1
+        elif pattern[i] == "\\" and i + 1 < n:
+            regex.append(re.escape(pattern[i + 1]))
+            i += 2
+        else:
+            regex.append(re.escape(pattern[i]))
+            i += 1
+    return "".join(regex)
@@ -0,0 +1,212 @@
+"""
+Watch files for changes, for --watch
+
+On Linux, inotify is used, through ctypes. Elsewhere, or if inotify is not
+available, the files are polled.
+"""
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+
+from .walk import excluded, iter_paths, iter_tree
+
+# From <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+
+_EVENT = struct.Struct("iIII")
+
+
+def make_watcher(paths, *, poll_interval=0.5, exclude=None, extend_exclude=(), gitignore=True):
+    """
+    Get a watcher for the Python files and notebooks in `paths`
+
+    The watcher has a wait() method that blocks until some of the files
+    change, and returns their paths, including the paths of files that were
+    created or deleted. Paths in a directory in `paths` are joined to the
+    directory as it was given. Inside the directories, what iter_paths()
+    (from removestar.walk) skips with exclude, extend_exclude and gitignore
+    is not watched.
+
+    An InotifyWatcher is used if possible, and otherwise a PollingWatcher
+    that checks for changes every `poll_interval` seconds.
+    """
+    options = {"exclude": exclude, "extend_exclude": extend_exclude, "gitignore": gitignore}
+    if sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(paths, **options)
+        except OSError:
+            pass
+    return PollingWatcher(paths, poll_interval, **options)
+
+
+def _is_source(path):
+    return path.endswith((".py", ".ipynb"))
+
+
+class PollingWatcher:
+    """
+    Watch files by checking their modification time and size regularly
+
+    exclude, extend_exclude and gitignore are the same as for make_watcher().
+    """
+
+    def __init__(self, paths, interval=0.5, *, exclude=None, extend_exclude=(), gitignore=True):
+        self.paths = paths
+        self.interval = interval
+        self._options = {
+            "exclude": exclude,
+            "extend_exclude": extend_exclude,
+            "gitignore": gitignore,
+        }
+        self._stamps = self._scan()
+
+    def _scan(self):
+        stamps = {}
+        for path in iter_paths(self.paths, **self._options):
+            _stamp(path, stamps)
+        return stamps
+
+    def wait(self):
+        while True:
+            time.sleep(self.interval)
+            stamps = self._scan()
+            changed = {
+                path
+                for path in stamps.keys() | self._stamps.keys()
+                if stamps.get(path) != self._stamps.get(path)
+            }
+            self._stamps = stamps
+            if changed:
+                return changed
+
+
+def _stamp(path, stamps):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return
+    stamps[path] = (st.st_mtime_ns, st.st_size)
+
+
+class InotifyWatcher:
+    """
+    Watch files with inotify (Linux only)
+
+    exclude, extend_exclude and gitignore are the same as for make_watcher().
+    Raises OSError if inotify is not available.
+    """
+
+    mask = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+    def __init__(self, paths, *, debounce=0.05, exclude=None, extend_exclude=(), gitignore=True):
+        self.debounce = debounce
+        self._options = {
+            "exclude": exclude,
+            "extend_exclude": extend_exclude,
+            "gitignore": gitignore,
+        }
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        try:
+            init = self._libc.inotify_init1
+        except AttributeError as e:
+            raise OSError("inotify is not available") from e
+        self._fd = init(os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        # Watch descriptor -> directory
+        self._directories = {}
+        # Watch descriptor -> directory in paths, for the directories in the
+        # trees in paths, where the source files that are not excluded are
+        # watched
+        self._trees = {}
+        # Other files to watch. Their directories are watched too.
+        self._files = set()
+        for path in paths:
+            if os.path.isdir(path):
+                self._watch_tree(path, path)
+            else:
+                self._files.add(os.path.normpath(path))
+                self._watch(os.path.dirname(path) or ".")
+
+    def _watch(self, directory):
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(directory), self.mask)
+        if wd >= 0:
+            self._directories[wd] = directory
+        return wd
+
+    def _watch_tree(self, directory, root):
+        """
+        Watch `directory` and its subdirectories, in the directory root in
+        paths, and return the source files in them
+        """
+        files = set()
+        for path, is_dir in iter_tree(directory, root=root, **self._options):
+            if not is_dir:
+                files.add(path)
+                continue
+            wd = self._watch(path)
+            if wd >= 0:
+                self._trees[wd] = root
+        return files
+
+    def _excluded(self, path, wd, is_dir):
+        return excluded(path, root=self._trees[wd], is_dir=is_dir, **self._options)
+
+    def close(self):
+        os.close(self._fd)
+
+    def wait(self):
+        while True:
+            changed = set()
+            select.select([self._fd], [], [])
+            # Editors often write a file in several steps, so wait for more
+            # events before returning
+            while select.select([self._fd], [], [], self.debounce)[0]:
+                changed |= self._read_events()
+            if changed:
+                return changed
+
+    def _read_events(self):
+        data = os.read(self._fd, 64 * 1024)
+        changed = set()
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            name = os.fsdecode(data[offset : offset + length].rstrip(b"\0"))
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                # Some events were lost, so anything could have changed
+                for root in set(self._trees.values()):
+                    changed |= self._watch_tree(root, root)
+                changed |= self._files
+                continue
+            directory = self._directories.get(wd)
+            if directory is None:
+                continue
+            path = os.path.join(directory, name)
+            if mask & IN_ISDIR:
+                if (
+                    mask & (IN_CREATE | IN_MOVED_TO)
+                    and wd in self._trees
+                    and not self._excluded(path, wd, is_dir=True)
+                ):
+                    changed |= self._watch_tree(path, self._trees[wd])
+            elif os.path.normpath(path) in self._files or (
+                _is_source(name)
+                and wd in self._trees
+                and not self._excluded(path, wd, is_dir=False)
+            ):
+                changed.add(path)
+        return changed
@@ -0,0 +1,155 @@
+"""
+Writing fixed files
+
+Files are written atomically: the new contents are written to a temporary
+file in the same directory, which then replaces the file with os.replace(),
+so a crash never leaves a file half written. Writer does this in a
+background thread, so that the next files can be fixed while the previous
+ones are written.
+"""
+
+import contextlib
+import os
+import queue
+import stat
+import tempfile
+import threading
+
+from . import timings
+from .timings import Timings
+
+
+def write_atomic(file, data, *, fsync=False):
+    """
+    Replace the contents of file with the bytes data
+
+    The mode and, where possible, the owner of file are kept. If file is a
+    symbolic link, the file it points to is replaced. If fsync=True, the data
+    is flushed to disk before file is replaced (but the directory isn't, see
+    Writer).
+    """
+    file = os.path.realpath(file)
+    try:
+        st = os.stat(file)
+    except FileNotFoundError:
+        # Nothing can be lost, and the file gets the default permissions
+        with open(file, "wb") as f:
+            f.write(data)
+        return
+
+    directory, name = os.path.split(file)
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix=f".{name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.chmod(tmp, stat.S_IMODE(st.st_mode))
+        if hasattr(os, "chown") and (st.st_uid, st.st_gid) != (os.getuid(), os.getgid()):
+            with contextlib.suppress(OSError):
+                os.chown(tmp, st.st_uid, st.st_gid)
+        os.replace(tmp, file)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def text_bytes(text):
+    """
+    Encode text the same way as open(file, "w", encoding="utf-8") writes it
+    """
+    if os.linesep != "\n":
+        text = text.replace("\n", os.linesep)
+    return text.encode("utf-8")
+
+
+class Writer:
+    """
+    Write files with write_atomic() in a background thread
+
+    write() queues a file to be written, and only blocks if max_pending
+    files are already waiting, so that the memory used by the queued
+    contents stays bounded. close() waits until every file is written, and
+    returns a list of (file, exception) for the files that could not be
+    written.
+
+    If fsync=True, every file is flushed to disk before it replaces the
+    original, and the directories of all the files are flushed once at the
+    end, in close(), instead of after every file.
+
+    The time spent writing the files in the background thread is recorded in
+    the Timings timings (from removestar.timings), and the time spent
+    waiting in write() for the queue is recorded as the phase "queue" of the
+    Timings active in the calling thread.
+    """
+
+    def __init__(self, *, max_pending=16, fsync=False):
+        self.fsync = fsync
+        self.errors = []
+        self.timings = Timings()
+        self._directories = set()
+        self._queue = queue.Queue(max_pending)
+        self._thread = threading.Thread(target=self._run, name="removestar-writer", daemon=True)
+        self._thread.start()
+
+    def write(self, file, data):
+        """
+        Queue the bytes data to be written to file
+        """
+        with timings.phase("queue"):
+            self._queue.put((file, data))
+
+    def close(self):
+        """
+        Wait for all the queued files to be written
+
+        Returns the list of (file, exception) for the files that could not
+        be written.
+        """
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        if self.fsync:
+            for directory in sorted(self._directories):
+                _fsync_directory(directory)
+            self._directories.clear()
+        return self.errors
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _run(self):
+        with self.timings.activate():
+            self._write_queued()
+
+    def _write_queued(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            file, data = item
+            try:
+                with timings.phase("write"):
+                    write_atomic(file, data, fsync=self.fsync)
+            except Exception as e:
+                self.errors.append((file, e))
+            else:
+                if self.fsync:
+                    self._directories.add(os.path.dirname(os.path.realpath(file)))
+
+
+def _fsync_directory(directory):
+    # Directories can't be opened (or fsynced) on Windows
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        with contextlib.suppress(OSError):
+            os.fsync(fd)
+    finally:
+        os.close(fd)
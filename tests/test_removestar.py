@@ -1,26 +1,39 @@
 import ast
+import json
 import os
+import shutil
 import subprocess
 import sys
 from filecmp import dircmp
 from pathlib import Path
 
+import pyflakes.checker
 import pytest
 from pyflakes.checker import Checker
 
+from removestar import index as index_module
+from removestar import removestar
+from removestar.cache import ExportCache
+from removestar.importer import ImportPool
+from removestar.index import ProjectIndex
 from removestar.output import get_colored_diff, green, red, yellow
 from removestar.removestar import (
     ExternalModuleError,
+    _module_names,
     fix_code,
     get_mod_filename,
+    get_module_names,
     get_names,
     get_names_dynamically,
     get_names_from_dir,
+    get_names_statically,
     is_noqa_comment_allowing_star_import,
+    may_contain_star_import,
     names_to_replace,
     replace_imports,
     star_imports,
 )
+from removestar.watch import InotifyWatcher, PollingWatcher
 
 code_mod1 = """\
 a = 1
@@ -204,6 +217,7 @@ submod_names = {"func"}
 submod_dynamic_names = {"submod1", "submod3", "func"}
 
 code_bad_syntax = """\
+from .mod1 import *
 from mod
 """
 
@@ -494,6 +508,79 @@ def test_get_names():
     assert names == {"..*", "func"}
 
 
+def _checker_names(code):
+    return _module_names(Checker(ast.parse(code)))
+
+
+def _py(version, code):
+    return pytest.param(
+        code,
+        marks=pytest.mark.skipif(
+            sys.version_info < version, reason=f"requires Python {version[0]}.{version[1]}"
+        ),
+    )
+
+
+@pytest.mark.parametrize(
+    "code",
+    [
+        code_mod1,
+        code_mod4,
+        code_mod5,
+        code_mod6,
+        code_mod8,
+        code_submod1,
+        code_submod4,
+        code_submod_recursive_submod2,
+        code_mod_unfixable,
+        code_mod_commented_star,
+        "from __future__ import annotations\nimport os.path\nimport a.b as c\n"
+        "from . import x as y\nfrom .. import *\nfrom .m import *\n",
+        "x: int\ny: int = 1\nx2 = 1\nx2: int\n",
+        "a, (b, *c) = 1, (2, 3, 4)\n[d, e] = 1, 2\nf.g = 1\nh[0] = 1\nk += 1\n",
+        "for i in range(3):\n    j = i\nelse:\n    k = 1\nwhile False:\n    w = 1\n",
+        "with open('f') as fo, open('g') as (g1, g2):\n    inner = 1\n",
+        "try:\n    import foo\nexcept ImportError as err:\n    foo = None\n"
+        "else:\n    bar = 1\nfinally:\n    baz = 1\n",
+        "err = 1\ntry:\n    pass\nexcept Exception as err:\n    pass\n"
+        "try:\n    pass\nexcept Exception as err2:\n    err3 = err2\n",
+        "x = 1\ndel x\ny = 1\nif True:\n    del y\nz = 1\nfor _ in []:\n    del z\n"
+        "(p, q) = 1, 2\ndel (p, q)\n",
+        "def f():\n    global g1, g2\n    g1 = 1\n"
+        "class C:\n    global g3\n    def m(self):\n        global g4\n"
+        "def outer():\n    v = 1\n    def inner():\n        nonlocal v\n",
+        "g = 1\ndel g\ndef f():\n    global g\nclass C:\n    global h\ndel h\n",
+        "def f():\n    local = 1\n    def g():\n        pass\nclass C:\n    attr = 1\n",
+        "__all__ = ['a'] + ['b']\n__all__ += ('c',)\na = b = c = d = 1\n",
+        "__all__: list = ['a']\na = b = 1\n",
+        "__all__ = ['a']\n__all__ = ['b']\na = b = 1\n",
+        "__all__ = [x for x in 'ab']\na = b = 1\n",
+        "__all__ = other.__all__ + ['a']\n__all__ += mod.__all__\n",
+        "__all__ = ['a']\n__all__.extend(['b'])\n",
+        "print = 1\n__file__ = 1\nquit = 1\nlist: int\n",
+        _py(
+            (3, 8),
+            "if (n := 10) > 5:\n    pass\nprint([(m := i) for i in range(3)])\n"
+            "f = lambda q=(r := 1): (s := q)\n"
+            "@dec(t := 1)\ndef fn(a=(u := 1)):\n    (v := 1)\n"
+            "class K(base := object):\n    w = (ww := 1)\n"
+            "x: int\n(x := 1)\n",
+        ),
+        _py(
+            (3, 10),
+            "match p:\n    case [a1, *rest]:\n        pass\n"
+            "    case {'k': v1, **kw}:\n        pass\n"
+            "    case Point(x=px) as pt if (g := 1):\n        pass\n"
+            "    case _:\n        del p\n",
+        ),
+        _py((3, 11), "try:\n    pass\nexcept* ValueError as eg:\n    q = 1\n"),
+        _py((3, 12), "type X = int\n"),
+    ],
+)
+def test_get_names_matches_checker(code):
+    assert get_names(code) == _checker_names(code)
+
+
 @pytest.mark.parametrize("relative", [True, False])
 def test_get_names_from_dir(tmpdir, relative):
     directory = tmpdir / "module"
@@ -804,6 +891,367 @@ def test_get_names_dynamically(tmpdir):
     pytest.raises(RuntimeError, lambda: get_names_dynamically("notarealmodule"))
 
 
+@pytest.mark.parametrize("mod", ["json", "string", "textwrap", "email.mime.text"])
+def test_get_names_statically_stdlib(mod):
+    assert get_names_statically(mod) == get_names_dynamically(mod)
+
+
+def test_get_names_statically(tmpdir, monkeypatch):
+    package = tmpdir / "static_package"
+    os.makedirs(package)
+    with open(package / "__init__.py", "w") as f:
+        f.write("__all__ = ['a'] + ['b']\n")
+    with open(package / "noall.py", "w") as f:
+        f.write("import os\nfrom . import *\nfrom .sub import *\nx = 1\n_y = 2\n")
+    with open(package / "sub.py", "w") as f:
+        f.write("z = 1\n")
+    with open(package / "ospath.py", "w") as f:
+        f.write("from os.path import *\nz = 1\n")
+    with open(package / "dynamic_all.py", "w") as f:
+        f.write("from .sub import *\n__all__ = ['z']\n__all__.extend(sub.__all__)\n")
+    with open(package / "dynamic_globals.py", "w") as f:
+        f.write("globals()['a'] = 1\n")
+    monkeypatch.syspath_prepend(str(tmpdir))
+
+    assert get_names_statically("static_package") == {"a", "b"}
+    assert get_names_statically("static_package.noall") == {
+        "os",
+        "x",
+        "static_package.*",
+        "static_package.sub.*",
+    }
+    assert get_names_statically("static_package.dynamic_all") is None
+    assert get_names_statically("static_package.dynamic_globals") is None
+    assert get_names_statically("static_package.notamodule") is None
+    assert get_names_statically("math") is None
+    assert get_names_statically("os.path") is None
+
+    assert get_module_names("static_package.noall", tmpdir, allow_dynamic=False) == {
+        "a",
+        "b",
+        "os",
+        "x",
+        "z",
+    }
+    pytest.raises(
+        NotImplementedError,
+        lambda: get_module_names("static_package.ospath", tmpdir, allow_dynamic=False),
+    )
+    index = ProjectIndex(allow_dynamic=False)
+    assert index.get_module_names("static_package.noall", tmpdir) == {"a", "b", "os", "x", "z"}
+    assert not [mod for mod in sys.modules if mod.startswith("static_package")]
+
+    # With dynamic importing, only modules with '__all__' are parsed, since
+    # the others can define names in ways that are not found statically
+    assert get_names_statically("static_package", require_all=True) == {"a", "b"}
+    assert get_names_statically("static_package.noall", require_all=True) is None
+    assert get_module_names("static_package.ospath", tmpdir) == {"z"} | get_names_dynamically(
+        "os.path"
+    )
+    assert "ALERT_DESCRIPTION_ACCESS_DENIED" in get_module_names("ssl", tmpdir)
+    assert "ALERT_DESCRIPTION_ACCESS_DENIED" in ProjectIndex().get_module_names("ssl", tmpdir)
+
+
+def test_export_cache(tmpdir, monkeypatch):
+    directory = tmpdir / "module"
+    create_module(directory)
+    os_path = get_names_dynamically("os.path")
+
+    cache = ExportCache(tmpdir / "cache")
+    assert cache.get_file_names(directory / "mod9.py") is None
+    assert get_names_from_dir(".mod9", directory, cache=cache) == mod9_names
+    assert cache.get_file_names(directory / "mod9.py") == {".mod8.*", "func"}
+    assert cache.get_file_names(directory / "mod8.py") == mod8_names
+    assert cache.get_file_names(directory / "mod1.py") is None
+    assert get_names_from_dir(".mod7", directory, cache=cache) == os_path
+    assert cache.get_file_names(directory / "mod7.py") == {".mod6.*"}
+    assert cache.get_file_names(directory / "mod6.py") == {"os.path.*"}
+    assert cache.get_dynamic_names("os.path") == os_path
+    assert (tmpdir / "cache" / ".gitignore").exists()
+
+    def fail(*args, **kwargs):
+        raise AssertionError("the cache was not used")
+
+    # A new cache object simulates a new run
+    monkeypatch.setattr(removestar, "get_names", fail)
+    monkeypatch.setattr(removestar, "get_names_dynamically", fail)
+    cache = ExportCache(tmpdir / "cache")
+    assert get_names_from_dir(".mod9", directory, cache=cache) == mod9_names
+    assert get_names_from_dir(".mod7", directory, cache=cache) == os_path
+    assert get_module_names(".mod7", directory, cache=cache) == os_path
+
+    # Changing a module invalidates its entry and the entries of modules
+    # that star import it
+    with open(directory / "mod8.py", "a") as f:
+        f.write("__all__ += ['c']\n")
+    cache = ExportCache(tmpdir / "cache")
+    with pytest.raises(AssertionError, match="the cache was not used"):
+        get_names_from_dir(".mod9", directory, cache=cache)
+    monkeypatch.undo()
+    assert get_names_from_dir(".mod9", directory, cache=cache) == {"a", "b", "c", "func"}
+
+    # So does a change in the version
+    cache = ExportCache(tmpdir / "cache")
+    cache.version = "other"
+    assert cache.get_file_names(directory / "mod8.py") is None
+    assert cache.get_dynamic_names("os.path") is None
+
+
+def test_export_cache_shared_analysis(tmpdir, monkeypatch):
+    directory = tmpdir / "module"
+    create_module(directory)
+
+    def fail(*args, **kwargs):
+        raise AssertionError("the analysis was repeated")
+
+    # Fixing a file, then resolving a star import of it
+    cache = ExportCache()
+    assert fix_code(code_mod9, file=directory / "mod9.py", cache=cache) == code_mod9_fixed
+    with monkeypatch.context() as m:
+        m.setattr(removestar, "analyze_code", fail)
+        m.setattr(removestar, "get_names", fail)
+        assert get_names_from_dir(".mod9", directory, cache=cache) == mod9_names
+        assert get_names_from_dir(".mod8", directory, cache=cache) == mod8_names
+    assert cache.get_analysis(directory / "mod9.py", code_mod9_fixed) is None
+
+    # Resolving a star import only collects the module-level names, without
+    # running pyflakes
+    cache = ExportCache()
+    with monkeypatch.context() as m:
+        m.setattr(pyflakes.checker, "Checker", fail)
+        assert get_names_from_dir(".mod4", directory, cache=cache) == mod4_names
+    assert fix_code(code_mod4, file=directory / "mod4.py", cache=cache) == code_mod4_fixed
+    assert not (tmpdir / "cache").exists()
+
+
+def test_export_cache_check_stamps(tmpdir):
+    directory = tmpdir / "module"
+    create_module(directory)
+
+    cache = ExportCache()
+    stamped_cache = ExportCache(check_stamps=True)
+    for c in [cache, stamped_cache]:
+        assert get_names_from_dir(".mod8", directory, cache=c) == mod8_names
+    os.utime(directory / "mod8.py", ns=(0, 0))
+    assert cache.get_file_names(directory / "mod8.py") == mod8_names
+    assert stamped_cache.get_file_names(directory / "mod8.py") is None
+
+
+def test_project_index(tmpdir, monkeypatch):
+    directory = tmpdir / "module"
+    create_module(directory)
+    files = sorted(str(file) for file in Path(directory).rglob("*.py"))
+
+    index = ProjectIndex(files)
+    mods = [
+        ".mod1",
+        ".mod4",
+        ".mod7",
+        ".mod9",
+        ".submod",
+        ".submod_recursive.submod2",
+        "module.mod5",
+        "module.submod.submod4",
+    ]
+    for mod in mods:
+        assert index.get_module_names(mod, directory) == get_names_from_dir(mod, directory)
+    pytest.raises(RuntimeError, lambda: index.get_module_names(".mod_bad", directory))
+    pytest.raises(RuntimeError, lambda: index.get_module_names(".notamod", directory))
+
+    # Everything star imported by the files was resolved when the index was
+    # created, and the names are shared between the directories a module is
+    # imported from.
+    def fail(*args, **kwargs):
+        raise AssertionError("the module was resolved again")
+
+    os_path = get_names_dynamically("os.path")
+    with monkeypatch.context() as m:
+        m.setattr(index_module, "get_names_and_stars", fail)
+        m.setattr(index_module, "get_names_dynamically", fail)
+        assert index.get_module_names("os.path", directory) == os_path
+        assert index.get_module_names(".mod8", directory) == mod8_names
+        assert index.get_module_names("..mod8", directory / "submod") == mod8_names
+        assert index.get_module_names("module.mod8", directory / "submod") == mod8_names
+        assert fix_code(code_mod9, file=directory / "mod9.py", index=index) == code_mod9_fixed
+
+    index = ProjectIndex(files, allow_dynamic=False)
+    pytest.raises(NotImplementedError, lambda: index.get_module_names(".mod7", directory))
+
+
+def test_project_index_analysis(tmpdir, monkeypatch):
+    directory = tmpdir / "module"
+    create_module(directory)
+    analyze_code = removestar.analyze_code
+    analyzed = []
+
+    def record(code, filename):
+        analyzed.append(Path(filename).name)
+        return analyze_code(code, filename)
+
+    monkeypatch.setattr(removestar, "analyze_code", record)
+    # Building the index only parses the files, and pyflakes is only run on
+    # them when they are fixed
+    index = ProjectIndex([directory / "mod4.py", directory / "mod9.py"])
+    assert analyzed == []
+    assert fix_code(code_mod4, file=directory / "mod4.py", cache=index.cache, index=index) == (
+        code_mod4_fixed
+    )
+    assert fix_code(code_mod9, file=directory / "mod9.py", cache=index.cache, index=index) == (
+        code_mod9_fixed
+    )
+    assert analyzed == ["mod4.py", "mod9.py"]
+
+
+def test_project_index_cycle(tmpdir):
+    directory = tmpdir / "cycle"
+    os.makedirs(directory)
+    with open(directory / "a.py", "w") as f:
+        f.write("from .b import *\nA = 1\n")
+    with open(directory / "b.py", "w") as f:
+        f.write("from .a import *\nfrom .c import *\nB = 1\n")
+    with open(directory / "c.py", "w") as f:
+        f.write("from .b import *\nC = 1\n")
+    code = "from .{} import *\nprint(A, B, C)\n"
+    for first in "abc":
+        files = [directory / f"{mod}.py" for mod in first + "abc".replace(first, "")]
+        index = ProjectIndex(files)
+        for mod in "abc":
+            assert index.get_module_names(f".{mod}", directory) == {"A", "B", "C"}
+            assert fix_code(code.format(mod), file=directory / "u.py", index=index) == (
+                f"from .{mod} import A, B, C\nprint(A, B, C)\n"
+            )
+
+
+def test_project_index_affected(tmpdir):
+    directory = tmpdir / "module"
+    create_module(directory)
+    files = sorted(str(file) for file in Path(directory).rglob("*.py"))
+    index = ProjectIndex(files)
+
+    def affected(changed, unchanged_exports=()):
+        return {
+            str(file.relative_to(directory))
+            for file in index.affected(changed, unchanged_exports) - index.unresolved
+        }
+
+    assert affected([]) == set()
+    assert affected([directory / "mod8.py"]) == {"mod8.py", "mod9.py"}
+    assert affected([directory / "mod8.py"], [directory / "mod8.py"]) == {"mod8.py"}
+    assert affected([directory / "mod6.py"]) == {"mod6.py", "mod7.py"}
+    assert {"mod1.py", "mod4.py", "submod/submod1.py", "submod/submod2.py"} <= affected(
+        [directory / "mod1.py"]
+    )
+
+
+def test_project_index_invalidate(tmpdir):
+    directory = tmpdir / "module"
+    create_module(directory)
+    files = sorted(str(file) for file in Path(directory).rglob("*.py"))
+    index = ProjectIndex(files)
+    assert index.get_module_names(".mod8", directory) == mod8_names
+
+    with open(directory / "mod8.py", "a") as f:
+        f.write("__all__ += ['c']\n")
+    affected = index.invalidate([directory / "mod8.py"]) - index.unresolved
+    assert affected == {Path(directory / "mod8.py"), Path(directory / "mod9.py")}
+    assert index.get_module_names(".mod8", directory) == {"a", "b", "c"}
+    assert index.get_module_names(".mod9", directory) == {"a", "b", "c", "func"}
+
+    os.remove(directory / "mod8.py")
+    index.invalidate([directory / "mod8.py"])
+    pytest.raises(RuntimeError, lambda: index.get_module_names(".mod9", directory))
+    assert Path(directory / "mod9.py") in index.unresolved
+
+
+@pytest.mark.parametrize("watcher", ["polling", "inotify"])
+def test_watcher(tmpdir, watcher):
+    directory = tmpdir / "module"
+    create_module(directory)
+    os.mkdir(directory / "build")
+    os.mkdir(directory / "generated")
+    with open(directory / ".gitignore", "w") as f:
+        f.write("ignored.py\n")
+    options = {"extend_exclude": ["generated"]}
+    if watcher == "polling":
+        watcher = PollingWatcher([str(directory)], interval=0.01, **options)
+    elif sys.platform.startswith("linux"):
+        watcher = InotifyWatcher([str(directory)], **options)
+    else:
+        pytest.skip("inotify is only available on Linux")
+
+    with open(directory / "mod8.py", "a") as f:
+        f.write("d = 4\n")
+    with open(directory / "submod" / "new.py", "w") as f:
+        f.write("e = 5\n")
+    os.remove(directory / "mod1.py")
+    with open(directory / "notes.txt", "w") as f:
+        f.write("Not Python\n")
+    # Excluded files are not watched, like when walking the directory
+    for excluded in ["build/gen.py", "generated/gen.py", "ignored.py", "submod/ignored.py"]:
+        with open(directory / excluded, "w") as f:
+            f.write("f = 6\n")
+    os.makedirs(directory / "dist" / "sub")
+    with open(directory / "dist" / "sub" / "gen.py", "w") as f:
+        f.write("f = 6\n")
+    os.mkdir(directory / "newpkg")
+    with open(directory / "newpkg" / "new.py", "w") as f:
+        f.write("g = 7\n")
+    assert watcher.wait() == {
+        str(directory / "mod8.py"),
+        str(directory / "submod" / "new.py"),
+        str(directory / "mod1.py"),
+        str(directory / "newpkg" / "new.py"),
+    }
+
+
+def test_import_pool(tmpdir, monkeypatch):
+    with open(tmpdir / "pid_a.py", "w") as f:
+        f.write("import os\nglobals()[f'pid_{os.getpid()}'] = 1\nprint('output')\n")
+    with open(tmpdir / "pid_b.py", "w") as f:
+        f.write("from pid_a import *\n")
+    with open(tmpdir / "slow.py", "w") as f:
+        f.write("import time\ntime.sleep(30)\n")
+    with open(tmpdir / "big.py", "w") as f:
+        f.write("data = bytearray(2**31)\n")
+    monkeypatch.syspath_prepend(str(tmpdir))
+
+    def pids(names):
+        return {name for name in names if name.startswith("pid_")}
+
+    with ImportPool(2, timeout=1) as pool:
+        pool.prefetch(["os.path", "notarealmodule"])
+        assert pool.get_names("os.path") == get_names_dynamically("os.path")
+        with pytest.raises(RuntimeError, match="Could not import notarealmodule"):
+            pool.get_names("notarealmodule")
+        with pytest.raises(RuntimeError, match="Timed out importing slow"):
+            pool.get_names("slow")
+        # The modules are not imported in this process
+        assert "pid_a" not in sys.modules
+        assert pids(pool.get_names("pid_a")) == pids(pool.get_names("pid_b"))
+        assert len(pids(pool.get_names("pid_a"))) == 1
+
+    # Every call imports the module again, in a worker that hasn't imported
+    # an older version of it or of the modules it imports
+    with open(tmpdir / "changing.py", "w") as f:
+        f.write("x = 1\n")
+    with open(tmpdir / "uses_changing.py", "w") as f:
+        f.write("from changing import *\n")
+    with ImportPool(1) as pool:
+        assert "y" not in pool.get_names("uses_changing")
+        with open(tmpdir / "changing.py", "w") as f:
+            f.write("x = 1\ny = 2\n")
+        assert "y" in pool.get_names("uses_changing")
+        assert "y" in pool.get_names("changing")
+
+    # Workers are replaced after max_imports imports
+    with ImportPool(1, max_imports=1) as pool:
+        assert pids(pool.get_names("pid_a")) != pids(pool.get_names("pid_b"))
+
+    if sys.platform == "linux":
+        with ImportPool(1, memory_limit=2**30) as pool, pytest.raises(RuntimeError, match="big"):
+            pool.get_names("big")
+
+
 def test_fix_code(tmpdir, capsys):
     # TODO: Test the verbose and quiet flags
     directory = tmpdir / "module"
@@ -1346,6 +1794,46 @@ def test_replace_imports_warnings(capsys):
     assert err == ""
 
 
+def test_replace_imports_single_pass(capsys):
+    code = """\
+from a.b import *
+from a import *  # noqa
+from c import *
+from a import *  # about a
+x = 'from a.b import *'
+from a.b import *
+"""
+    repls = {"a": [], "a.b": ["y", "x"], "d": ["z"]}
+    assert (
+        replace_imports(code, repls, file="f.py", verbose=True)
+        == """\
+from a.b import x, y
+from a import *  # noqa
+from c import *
+# about a
+x = 'from a.b import *'
+from a.b import x, y
+"""
+    )
+    out, err = capsys.readouterr()
+    # Messages are grouped by module in the order of repls
+    assert err.splitlines() == [
+        green("f.py: Retaining 'from a import *' due to noqa comment"),
+        green("f.py: Replacing 'from a import *' with ''"),
+        yellow(
+            "Warning: f.py: The removed star import statement for 'a' had an inline comment which may not make sense without the import"  # noqa: E501
+        ),
+        green("f.py: Replacing 'from a.b import *' with 'from a.b import x, y'"),
+        green("f.py: Replacing 'from a.b import *' with 'from a.b import x, y'"),
+        yellow("Warning: f.py: Could not find the star imports for 'd'"),
+    ]
+
+    assert replace_imports(code, repls, return_replacements=True, quiet=True) == {
+        "from a import *": "from a import *  # noqa",
+        "from a.b import *": "from a.b import x, y",
+    }
+
+
 def test_replace_imports_line_wrapping():
     code = """\
 from reallyreallylongmodulename import *
@@ -1502,6 +1990,26 @@ def test_is_noqa_comment_allowing_star_import(case_permutation, allows_star, com
     assert is_noqa_comment_allowing_star_import(case_permutation(comment)) is allows_star
 
 
+@pytest.mark.parametrize(
+    ("code", "expected"),
+    [
+        ("from os.path import *\n", True),
+        ("from os.path import*\n", True),
+        ("from os.path import \\\n    *\n", True),
+        ("from os.path import \t*\n", True),
+        ("from os.path import join\nx = 2 * 3\n", False),
+        ("import os\n", False),
+        ("", False),
+        # Notebook JSON
+        ('{"source": "from os.path import *"}', True),
+        ('{"source": ["from os.path import \\\\\\n", " *"]}', True),
+        ('{"source": ["import os\\n", "2 * 3"]}', False),
+    ],
+)
+def test_may_contain_star_import(code, expected):
+    assert may_contain_star_import(code.encode("utf-8")) is expected
+
+
 def _dirs_equal(cmp):
     if cmp.diff_files:
         return False
@@ -1556,7 +2064,7 @@ Warning: {directory}/mod_commented_unused_star.py: The removed star import state
     colored_warnings = {yellow(warning) for warning in warnings}
 
     error = red(
-        f"Error with {directory}/mod_bad.py: SyntaxError: invalid syntax (mod_bad.py, line 1)"
+        f"Error with {directory}/mod_bad.py: SyntaxError: invalid syntax (mod_bad.py, line 2)"
     )
     assert set(p.stderr.splitlines()) == colored_warnings.union({error})
 
@@ -1729,6 +2237,7 @@ Warning: {directory}/mod_commented_unused_star.py: The removed star import state
 """.splitlines()  # noqa: E501
     )
     colored_changes = {green(change) for change in changes}
+    colored_changes.add(green("Skipped 6 files without star imports"))
 
     assert set(p.stderr.splitlines()) == colored_changes.union({error}).union(colored_warnings)
     for d in diffs:
@@ -1843,3 +2352,756 @@ Error with {directory}/mod7.py: Static determination of external module imports
     )
     assert p.stderr == red(f"Error: {directory}/notarealfile.py: no such file or directory") + "\n"
     assert p.stdout == ""
+
+
+@pytest.mark.parametrize("jobs", ["2", "auto"])
+def test_cli_jobs(tmpdir, jobs):
+    directory = tmpdir / "module"
+    create_module(directory)
+
+    serial = subprocess.run(
+        [sys.executable, "-m", "removestar", "--verbose", directory],
+        capture_output=True,
+        encoding="utf-8",
+        check=False,
+    )
+    parallel = subprocess.run(
+        [sys.executable, "-m", "removestar", "--verbose", "-j", jobs, directory],
+        capture_output=True,
+        encoding="utf-8",
+        check=False,
+    )
+    assert parallel.returncode == serial.returncode == 1
+    assert parallel.stdout == serial.stdout
+    assert parallel.stderr == serial.stderr
+
+    p = subprocess.run(
+        [sys.executable, "-m", "removestar", "-j", "0", directory],
+        capture_output=True,
+        encoding="utf-8",
+        check=False,
+    )
+    assert p.returncode == 2  # noqa: PLR2004
+    assert "invalid number of jobs: '0'" in p.stderr
+
+
+@pytest.mark.skipif(shutil.which("git") is None, reason="git is not installed")
+def test_cli_changed_since(tmpdir):
+    directory = tmpdir / "module"
+    create_module(directory)
+    git = ["git", "-c", "user.name=removestar", "-c", "user.email=removestar@example.com"]
+    for args in [["init", "-q"], ["add", "."], ["commit", "-q", "-m", "Initial commit"]]:
+        subprocess.run([*git, *args], cwd=tmpdir, check=True, capture_output=True)
+
+    def run(*args):
+        return subprocess.run(
+            [sys.executable, "-m", "removestar", *args, "module"],
+            cwd=tmpdir,
+            capture_output=True,
+            encoding="utf-8",
+            check=False,
+        )
+
+    p = run("--changed-since", "HEAD")
+    assert p.returncode == 0
+    assert p.stdout == p.stderr == ""
+
+    # Adding a name that is not exported doesn't affect the modules that
+    # star import mod8
+    with open(directory / "mod8.py", "a") as f:
+        f.write("d = 4\n")
+    p = run("--changed-since", "HEAD")
+    assert p.returncode == 0
+    assert p.stdout == p.stderr == ""
+
+    with open(directory / "mod8.py", "a") as f:
+        f.write("__all__ += ['d']\n")
+    p = run("--changed-since", "HEAD")
+    assert p.returncode == 1
+    assert "module/mod9.py" in p.stdout
+    assert "module/mod4.py" not in p.stdout
+    assert run("--changed", "module/mod8.py").stdout == p.stdout
+
+    p = run("--changed-since", "notarevision")
+    assert p.returncode == 2  # noqa: PLR2004
+    assert "bad revision 'notarevision'" in p.stderr
+
+
+def test_cli_changed_cache(tmpdir):
+    # The names of a module with __all__ don't show its star imports, but it
+    # is still checked again when a module it star imports changes, also
+    # when its names come from the cache
+    os.makedirs(tmpdir / "pkg")
+    with open(tmpdir / "pkg" / "a.py", "w") as f:
+        f.write("from .b import *\n__all__ = ['z']\nz = x()\n")
+    with open(tmpdir / "pkg" / "b.py", "w") as f:
+        f.write("def x():\n    pass\n")
+
+    for _ in range(2):
+        p = subprocess.run(
+            [sys.executable, "-m", "removestar", "--cache", "--changed", "pkg/b.py", "pkg"],
+            cwd=tmpdir,
+            capture_output=True,
+            encoding="utf-8",
+            check=False,
+        )
+        assert p.returncode == 1
+        assert "+from .b import x\x1b" in p.stdout
+
+
+def test_cli_stdin(tmpdir):
+    directory = tmpdir / "module"
+    create_module(directory)
+
+    def run(*args, stdin):
+        return subprocess.run(
+            [sys.executable, "-m", "removestar", *args],
+            input=stdin,
+            cwd=tmpdir,
+            capture_output=True,
+            encoding="utf-8",
+            check=False,
+        )
+
+    # Relative imports are resolved from the given path, which doesn't need
+    # to exist
+    for filename in ["module/mod9.py", "module/new.py"]:
+        p = run("--stdin-filename", filename, "-", stdin=code_mod9)
+        assert p.returncode == 0
+        assert p.stdout == code_mod9_fixed
+        assert p.stderr == ""
+    with open(directory / "mod9.py") as f:
+        assert f.read() == code_mod9
+
+    p = run("--stdin-filename", "module/mod4.py", "-", stdin=code_mod4)
+    assert p.returncode == 0
+    assert p.stdout == code_mod4_fixed
+    assert "could not find import for 'd'" in p.stderr
+
+    p = run("-", stdin=code_mod9)
+    assert p.returncode == 1
+    assert p.stdout == ""
+    assert "Could not find the file for the module '.mod8'" in p.stderr
+
+    assert run("-", stdin="x = 1\r\n").stdout == "x = 1\n"
+
+    # Code that is not valid UTF-8 is an error, not a crash
+    p = subprocess.run(
+        [sys.executable, "-m", "removestar", "--stdin-filename", "module/bad.py", "-"],
+        input=b"from .mod8 import *\nx = '\xff'\n",
+        cwd=tmpdir,
+        capture_output=True,
+        check=False,
+    )
+    assert p.returncode == 1
+    assert p.stdout == b""
+    assert b"Error with module/bad.py: 'utf-8' codec can't decode" in p.stderr
+    assert b"Traceback" not in p.stderr
+
+    assert run("-i", "-", stdin=code_mod9).returncode == 2  # noqa: PLR2004
+    assert run("-", "module", stdin=code_mod9).returncode == 2  # noqa: PLR2004
+    assert run("--stdin-filename", "a.py", "module", stdin="").returncode == 2  # noqa: PLR2004
+
+
+def test_fix_paths(tmpdir):
+    import removestar as package
+
+    directory = tmpdir / "module"
+    create_module(directory)
+
+    results = package.fix_paths([directory, tmpdir / "missing.py"])
+    assert iter(results) is results
+    results = {os.path.relpath(result.path, directory): result for result in results}
+    assert "__init__.py" not in results
+
+    result = results["mod4.py"]
+    assert result.status == "changed"
+    assert result.changed
+    assert (result.original, result.fixed) == (code_mod4, code_mod4_fixed)
+    assert result.replacements == {".mod1": ["a"], ".mod2": ["b", "c"]}
+    assert result.warnings == [
+        f"Warning: {directory}/mod4.py: 'b' comes from multiple modules: '.mod1', '.mod2'. Using '.mod2'.",  # noqa: E501
+        f"Warning: {directory}/mod4.py: could not find import for 'd'",
+    ]
+    assert result.error is None
+    assert set(result.timings) == {"read", "fix", "write"}
+    assert result.timings["write"] == 0
+    with open(directory / "mod4.py") as f:
+        assert f.read() == code_mod4
+
+    assert results["mod1.py"].status == "skipped"
+    assert results["mod1.py"].fixed is None
+    assert results["mod_unfixable.py"].status == "unchanged"
+    assert results["mod_unfixable.py"].warnings
+    assert results["mod_bad.py"].status == "error"
+    assert results["mod_bad.py"].error.startswith("SyntaxError: invalid syntax")
+    assert results["../missing.py"].status == "error"
+    assert results["../missing.py"].error.endswith("no such file or directory")
+    assert results["../missing.py"].original is None
+
+    # Errors from writing the file are in the result
+    def write(file, data):
+        raise PermissionError(13, "Permission denied")
+
+    result = package.batch.fix_path(
+        str(directory / "mod4.py"), index=ProjectIndex(), in_place=True, write=write
+    )
+    assert result.status == "changed"
+    assert result.error == "Could not write the file: Permission denied"
+    assert result.fixed == code_mod4_fixed
+
+    # One index is used for all the files
+    index = ProjectIndex()
+    results = list(package.fix_paths([directory], in_place=True, skip_init=False, index=index))
+    assert os.path.join(directory, "__init__.py") in [result.path for result in results]
+    with open(directory / "mod4.py") as f:
+        assert f.read() == code_mod4_fixed
+    assert index.cache.get_file_names(directory / "mod8.py") == mod8_names
+    assert not any(result.changed for result in package.fix_paths([directory]))
+
+
+def test_fix_paths_memory(tmpdir):
+    from removestar import fix_paths
+
+    directory = tmpdir / "many"
+    os.makedirs(directory)
+    with open(directory / "base.py", "w") as f:
+        f.write("a = 1\n")
+    for i in range(500):
+        with open(directory / f"mod{i}.py", "w") as f:
+            f.write("from .base import *\nprint(a)\n")
+
+    # Only the names of the star imported module are kept in memory
+    cache = ExportCache()
+    results = fix_paths([directory], cache=cache)
+    assert sum(result.changed for result in results) == 500  # noqa: PLR2004
+    assert not cache._analyses
+    assert list(cache._file_names) == [Path(directory / "base.py").resolve()]
+
+
+def test_cli_cache(tmpdir):
+    directory = tmpdir / "module"
+    create_module(directory)
+    cache_dir = tmpdir / "cache"
+
+    p = subprocess.run(
+        [sys.executable, "-m", "removestar", directory],
+        capture_output=True,
+        encoding="utf-8",
+        check=False,
+    )
+    for _ in range(2):
+        p_cache = subprocess.run(
+            [sys.executable, "-m", "removestar", "--cache", "--cache-dir", cache_dir, directory],
+            capture_output=True,
+            encoding="utf-8",
+            check=False,
+        )
+        assert p_cache.returncode == p.returncode == 1
+        assert p_cache.stdout == p.stdout
+        assert p_cache.stderr == p.stderr
+        assert len(cache_dir.listdir("*.json")) > 1
+
+
+def test_cli_cache_external(tmpdir):
+    # Changes to external modules, and to the modules they star import,
+    # invalidate the cache
+    ext = tmpdir / "ext"
+    os.makedirs(ext / "pkg")
+    with open(ext / "pkg" / "__init__.py", "w") as f:
+        f.write("")
+    with open(ext / "pkg" / "sub.py", "w") as f:
+        f.write("__all__ = ['foo']\n__all__.extend([])\nfoo = 1\n")
+    with open(ext / "front.py", "w") as f:
+        f.write("from other import *\n")
+    with open(ext / "other.py", "w") as f:
+        f.write("x = 1\n")
+    with open(tmpdir / "uses_ext.py", "w") as f:
+        f.write("from pkg.sub import *\nfrom front import *\nprint(foo, bar, x, y)\n")
+
+    def run():
+        return subprocess.run(
+            [sys.executable, "-m", "removestar", "--cache", "--cache-dir", "cache", "uses_ext.py"],
+            cwd=tmpdir,
+            env={**os.environ, "PYTHONPATH": str(ext)},
+            capture_output=True,
+            encoding="utf-8",
+            check=False,
+        )
+
+    p = run()
+    assert "+from pkg.sub import foo\x1b" in p.stdout
+    assert "+from front import x\x1b" in p.stdout
+    assert "could not find import for 'bar'" in p.stderr
+    assert "could not find import for 'y'" in p.stderr
+
+    with open(ext / "pkg" / "sub.py", "w") as f:
+        f.write("__all__ = ['foo']\n__all__.extend(['bar'])\nfoo = bar = 1\n")
+    with open(ext / "other.py", "w") as f:
+        f.write("x = 1\ny = 2\n")
+    p = run()
+    assert "+from pkg.sub import bar, foo\x1b" in p.stdout
+    assert "+from front import x, y\x1b" in p.stdout
+    assert p.stderr == ""
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="requires Unix sockets")
+def test_daemon(tmpdir, monkeypatch):
+    import threading
+
+    from removestar import client, daemon
+
+    directory = tmpdir / "module"
+    create_module(directory)
+    path = str(tmpdir / "daemon" / "removestar.sock")
+    os.makedirs(tmpdir / "ext")
+    monkeypatch.syspath_prepend(str(tmpdir / "ext"))
+
+    p = subprocess.run(
+        [sys.executable, "-m", "removestar", "module"],
+        cwd=tmpdir,
+        capture_output=True,
+        encoding="utf-8",
+        check=False,
+    )
+
+    thread = threading.Thread(target=daemon.serve, args=(path,))
+    thread.start()
+    try:
+        for _ in range(100):
+            if client.is_running(path):
+                break
+            thread.join(0.05)
+        # A second daemon on the same socket exits immediately
+        assert not daemon.serve(path)
+
+        with tmpdir.as_cwd():
+            results = []
+            clients = [
+                threading.Thread(target=lambda: results.append(client.run(["module"], path)))
+                for _ in range(4)
+            ]
+            for t in clients:
+                t.start()
+            for t in clients:
+                t.join()
+            assert results == [(p.stdout, p.stderr, p.returncode)] * 4
+
+            # Changes to the files are seen by later runs
+            with open(directory / "mod9.py", "w") as f:
+                f.write(code_mod9_fixed)
+            stdout, _, _ = client.run(["module"], path)
+            assert "mod9.py" in p.stdout
+            assert "mod9.py" not in stdout
+
+            assert client.run(["--no-such-option"], path)[2] == 2  # noqa: PLR2004
+
+            argv = ["--stdin-filename", "module/mod9.py", "-"]
+            assert client.run(argv, path, stdin=code_mod9.encode()) == (code_mod9_fixed, "", 0)
+
+            # So are changes to modules that are imported to find their names
+            with open(tmpdir / "ext" / "dyn.py", "w") as f:
+                f.write("__all__ = ['foo']\n__all__.extend([])\nfoo = 1\n")
+            with open(tmpdir / "uses_dyn.py", "w") as f:
+                f.write("from dyn import *\nprint(foo, bar)\n")
+            _, stderr, _ = client.run(["uses_dyn.py"], path)
+            assert "could not find import for 'bar'" in stderr
+            with open(tmpdir / "ext" / "dyn.py", "w") as f:
+                f.write("__all__ = ['foo']\n__all__.extend(['bar'])\nfoo = bar = 1\n")
+            stdout, stderr, _ = client.run(["uses_dyn.py"], path)
+            assert "could not find import" not in stderr
+            assert "from dyn import bar, foo" in stdout
+
+        # Modules are found on the sys.path of each client, so projects with
+        # modules of the same name don't see each other's modules
+        for project, name in [("project_a", "aaa"), ("project_b", "bbb")]:
+            os.makedirs(tmpdir / project)
+            with open(tmpdir / project / "helpers.py", "w") as f:
+                f.write(f"{name} = 1\n")
+            with open(tmpdir / project / "uses_helpers.py", "w") as f:
+                f.write(f"from helpers import *\nprint({name})\n")
+        for project, name in [("project_a", "aaa"), ("project_b", "bbb")]:
+            with monkeypatch.context() as m, (tmpdir / project).as_cwd():
+                m.setattr(sys, "path", [str(tmpdir / project), *sys.path])
+                stdout, stderr, _ = client.run(["uses_helpers.py"], path)
+            assert "could not find import" not in stderr
+            assert f"+from helpers import {name}" in stdout
+    finally:
+        client.request({"command": "stop"}, path)
+        thread.join()
+    assert not os.path.exists(path)
+
+
+def test_benchmarks(monkeypatch):
+    # Run every benchmark once with the smallest parameters, so that they
+    # keep working
+    monkeypatch.syspath_prepend(Path(__file__).parent.parent / "benchmarks")
+    import run
+
+    seen = set()
+    for _, cls, method, params in run.iter_benchmarks():
+        if (cls, method) in seen:
+            continue
+        seen.add((cls, method))
+        benchmark = cls()
+        benchmark.setup(*params)
+        try:
+            getattr(benchmark, method)(*params)
+        finally:
+            if hasattr(benchmark, "teardown"):
+                benchmark.teardown(*params)
+    assert len(seen) > 5  # noqa: PLR2004
+
+
+def test_timings(tmpdir):
+    import pickle
+
+    from removestar import fix_paths
+    from removestar.timings import Timings, phase
+
+    timings = Timings()
+    with phase("read"):
+        pass
+    assert timings.phases == {}
+
+    with timings.activate():
+        with phase("parse"), phase("read"):
+            pass
+        with phase("parse"):
+            pass
+    assert timings.phases["parse"][2] == 2  # noqa: PLR2004
+    assert timings.phases["read"][2] == 1
+
+    other = pickle.loads(pickle.dumps(timings))
+    other.merge(timings)
+    assert other.phases["parse"][2] == 4  # noqa: PLR2004
+    assert other.phases["parse"][0] == pytest.approx(2 * timings.phases["parse"][0])
+
+    directory = tmpdir / "module"
+    create_module(directory)
+    timings = Timings()
+    with timings.activate():
+        results = list(fix_paths([directory], allow_dynamic=False))
+    assert {"read", "parse", "pyflakes", "resolve", "replace"} <= timings.phases.keys()
+    assert set(timings.files) == {result.path for result in results}
+    assert str(directory / "mod8.py") in timings.modules
+
+    summary = timings.summary(top=2)
+    assert summary.splitlines()[0].split() == ["Phase", "Wall", "(s)", "CPU", "(s)", "Calls"]
+    assert "Slowest files" in summary
+    assert "Slowest modules" in summary
+    assert len(summary.split("Slowest files")[1].split("\n\n")[0].splitlines()) == 3  # noqa: PLR2004
+
+
+@pytest.mark.parametrize("jobs", ["1", "2"])
+def test_cli_timings(tmpdir, jobs):
+    directory = tmpdir / "module"
+    create_module(directory)
+    p = subprocess.run(
+        [sys.executable, "-m", "removestar", "-j", jobs, "--timings", directory],
+        capture_output=True,
+        encoding="utf-8",
+        check=False,
+    )
+    assert p.returncode == 1
+    assert "Running pyflakes" in p.stderr
+    assert f"{directory}/mod4.py" in p.stderr.split("Slowest files")[1]
+
+
+@pytest.mark.parametrize("jobs", ["1", "2"])
+def test_cli_ndjson(tmpdir, jobs):
+    directory = tmpdir / "module"
+    create_module(directory)
+    p = subprocess.run(
+        [
+            sys.executable,
+            "-m",
+            "removestar",
+            "-j",
+            jobs,
+            "--format",
+            "ndjson",
+            "--ndjson-diff",
+            directory,
+            tmpdir / "missing.py",
+        ],
+        capture_output=True,
+        encoding="utf-8",
+        check=False,
+    )
+    assert p.returncode == 1
+    assert p.stderr == ""
+    records = {
+        Path(record["path"]).name: record for record in map(json.loads, p.stdout.splitlines())
+    }
+    assert "\033" not in p.stdout
+
+    mod4 = records["mod4.py"]
+    assert mod4["status"] == "changed"
+    assert mod4["changed"] is True
+    assert mod4["replacements"] == {
+        "from .mod1 import *": "from .mod1 import a",
+        "from .mod2 import *": "from .mod2 import b, c",
+    }
+    assert mod4["names"][".mod1"] == ["a"]
+    assert mod4["warnings"] == [
+        f"Warning: {directory}/mod4.py: 'b' comes from multiple modules: '.mod1', '.mod2'. "
+        "Using '.mod2'.",
+        f"Warning: {directory}/mod4.py: could not find import for 'd'",
+    ]
+    assert mod4["diff"].startswith(f"--- original/{directory}/mod4.py")
+    assert set(mod4["timings"]) == {"read", "fix", "write"}
+
+    assert records["mod2.py"]["status"] == "skipped"
+    assert "diff" not in records["mod2.py"]
+    assert records["missing.py"]["status"] == "error"
+    assert "no such file" in records["missing.py"]["error"]
+
+    # Without --ndjson-diff there are no diffs
+    p = subprocess.run(
+        [sys.executable, "-m", "removestar", "--format", "ndjson", directory / "mod4.py"],
+        capture_output=True,
+        encoding="utf-8",
+        check=False,
+    )
+    (record,) = map(json.loads, p.stdout.splitlines())
+    assert "diff" not in record
+
+
+# The maximum time to import the command line, in microseconds as reported by
+# python -X importtime. It is currently well under this on most machines.
+IMPORT_TIME_BUDGET = 300_000
+
+
+def test_import_time(tmpdir):
+    p = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import removestar.__main__"],
+        capture_output=True,
+        encoding="utf-8",
+        check=True,
+    )
+    cumulative = {}
+    for line in p.stderr.splitlines():
+        if line.startswith("import time:") and "cumulative" not in line:
+            _, total, name = line.split("|")
+            cumulative[name.strip()] = int(total)
+    # Only needed for some files or command line options
+    for module in [
+        "pyflakes.checker",
+        "nbformat",
+        "nbconvert",
+        "multiprocessing",
+        "concurrent.futures.process",
+        "subprocess",
+        "ctypes",
+    ]:
+        assert module not in cumulative
+    assert cumulative["removestar.__main__"] < IMPORT_TIME_BUDGET
+
+    # pyflakes isn't imported for files without star imports
+    file = tmpdir / "file.py"
+    file.write("import os\n")
+    p = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import sys; from removestar.__main__ import main; main(sys.argv[1:]); "
+            "print('pyflakes.checker' in sys.modules)",
+            file,
+        ],
+        capture_output=True,
+        encoding="utf-8",
+        check=True,
+    )
+    assert p.stdout == "False\n"
+
+
+def test_iter_paths(tmpdir):
+    from removestar.walk import iter_paths
+
+    root = tmpdir / "repo"
+    files = [
+        "a.py",
+        "b.ipynb",
+        "c.txt",
+        ".hidden.py",
+        "anchored.py",
+        "x_pb2.py",
+        "keep_pb2.py",
+        "pkg/anchored.py",
+        "pkg/mod.py",
+        "pkg/generated/gen.py",
+        "pkg/sub/deep/deep.py",
+        "pkg/sub/local.py",
+        "pkg/sub/ignored_locally.py",
+        "build/b.py",
+        "node_modules/n.py",
+        "__pycache__/p.py",
+        ".git/g.py",
+        "other/o.py",
+    ]
+    for file in files:
+        os.makedirs(os.path.dirname(root / file), exist_ok=True)
+        (root / file).write("")
+    (root / ".gitignore").write(
+        "# comment\n/anchored.py\ngenerated/\n*_pb2.py\n!keep_pb2.py\npkg/**/deep.py\n"
+    )
+    (root / "pkg" / "sub" / ".gitignore").write("ignored_locally.py\n")
+    os.symlink(root / "pkg", root / "zlink")
+
+    def walk(paths, **kwargs):
+        return [os.path.relpath(file, root) for file in iter_paths(paths, **kwargs)]
+
+    assert walk([root]) == [
+        "a.py",
+        "b.ipynb",
+        "keep_pb2.py",
+        "other/o.py",
+        "pkg/anchored.py",
+        "pkg/mod.py",
+        "pkg/sub/local.py",
+    ]
+    # The .gitignore files of the parent directories are used, and every
+    # file is only yielded once
+    assert walk([root / "pkg", root / "zlink", root / "other", root / "x_pb2.py"]) == [
+        "pkg/anchored.py",
+        "pkg/mod.py",
+        "pkg/sub/local.py",
+        "other/o.py",
+        "x_pb2.py",
+    ]
+    assert walk([root / "pkg"], gitignore=False) == [
+        "pkg/anchored.py",
+        "pkg/generated/gen.py",
+        "pkg/mod.py",
+        "pkg/sub/deep/deep.py",
+        "pkg/sub/ignored_locally.py",
+        "pkg/sub/local.py",
+    ]
+    assert walk([root], exclude=["pkg", "other", "zlink"]) == [
+        "__pycache__/p.py",
+        "a.py",
+        "b.ipynb",
+        "build/b.py",
+        "keep_pb2.py",
+        "node_modules/n.py",
+    ]
+    assert walk([root], extend_exclude=["*.ipynb", "pkg/sub", "other"]) == [
+        "a.py",
+        "keep_pb2.py",
+        "pkg/anchored.py",
+        "pkg/mod.py",
+    ]
+
+    p = subprocess.run(
+        [
+            sys.executable,
+            "-m",
+            "removestar",
+            "-v",
+            "--extend-exclude",
+            "pkg",
+            "--extend-exclude",
+            "zlink",
+            root,
+        ],
+        capture_output=True,
+        encoding="utf-8",
+        check=False,
+    )
+    assert p.returncode == 0
+    assert "Skipped 4 files without star imports" in p.stderr
+
+
+def test_write_atomic(tmpdir):
+    from removestar.writer import write_atomic
+
+    file = tmpdir / "file.py"
+    file.write("old\n")
+    mode = 0o751
+    os.chmod(file, mode)
+    link = tmpdir / "link.py"
+    os.symlink(file, link)
+
+    write_atomic(link, b"new\n", fsync=True)
+    assert file.read() == "new\n"
+    assert os.path.islink(link)
+    assert os.stat(file).st_mode & 0o777 == mode
+    assert sorted(os.listdir(tmpdir)) == ["file.py", "link.py"]
+
+    # A failed write leaves the file as it was, without a temporary file
+    with pytest.raises(TypeError):
+        write_atomic(file, "not bytes")
+    assert file.read() == "new\n"
+    assert sorted(os.listdir(tmpdir)) == ["file.py", "link.py"]
+
+    write_atomic(tmpdir / "new.py", b"x\n")
+    assert (tmpdir / "new.py").read() == "x\n"
+
+
+def test_writer(tmpdir):
+    from removestar.writer import Writer
+
+    files = [tmpdir / f"file{i}.py" for i in range(50)]
+    for file in files:
+        file.write("")
+    with Writer(max_pending=2, fsync=True) as writer:
+        for i, file in enumerate(files):
+            writer.write(file, f"x = {i}\n".encode())
+        writer.write(tmpdir / "missing" / "file.py", b"")
+    assert [file.read() for file in files] == [f"x = {i}\n" for i in range(50)]
+    ((file, error),) = writer.errors
+    assert file == tmpdir / "missing" / "file.py"
+    assert isinstance(error, FileNotFoundError)
+    assert writer.close() == writer.errors
+    # The writes are timed in the thread that does them
+    assert writer.timings.phases["write"][2] == 51  # noqa: PLR2004
+
+
+@pytest.mark.parametrize("args", [["-j", "1"], ["-j", "2"], ["--format", "ndjson"]])
+def test_cli_in_place_write_error(tmpdir, args):
+    directory = tmpdir / "module"
+    create_module(directory)
+    # Every process, including the --jobs workers, fails to replace files
+    os.makedirs(tmpdir / "site")
+    with open(tmpdir / "site" / "sitecustomize.py", "w") as f:
+        f.write(
+            "import os\n"
+            "def replace(src, dst):\n"
+            "    raise PermissionError(13, 'Permission denied')\n"
+            "os.replace = replace\n"
+        )
+    p = subprocess.run(
+        [sys.executable, "-m", "removestar", "-i", *args, "module/mod4.py"],
+        cwd=tmpdir,
+        env={**os.environ, "PYTHONPATH": str(tmpdir / "site")},
+        capture_output=True,
+        encoding="utf-8",
+        check=False,
+    )
+    # The file still needs fixing, so the exit status is the same as for a
+    # file that is fixed
+    assert p.returncode == 1
+    assert (directory / "mod4.py").read() == code_mod4
+    error = "Could not write the file: Permission denied"
+    if "ndjson" in args:
+        assert json.loads(p.stdout)["error"] == error
+    else:
+        assert red(f"Error with module/mod4.py: {error}") in p.stderr
+
+
+def test_cli_in_place_mode(tmpdir):
+    directory = tmpdir / "module"
+    create_module(directory)
+    mode = 0o640
+    os.chmod(directory / "mod4.py", mode)
+    p = subprocess.run(
+        [sys.executable, "-m", "removestar", "-i", "--fsync", directory],
+        capture_output=True,
+        encoding="utf-8",
+        check=False,
+    )
+    assert p.returncode == 1
+    assert (directory / "mod4.py").read() == code_mod4_fixed
+    assert os.stat(directory / "mod4.py").st_mode & 0o777 == mode
+    assert not [name for name in os.listdir(directory) if name.endswith(".tmp")]
@@ -1,4 +1,7 @@
+import json
 import os
+import subprocess
+import sys
 import tempfile
 
 import pytest
@@ -86,3 +89,192 @@ def test_replace_nb():
     assert code == fixed_code
 
     os.remove("_test.ipynb")
+
+
+def test_fix_paths_nb(tmpdir):
+    from removestar import fix_paths
+
+    path = str(tmpdir / "_test.ipynb")
+    code, _ = prepare_nb(output_path=path)
+
+    (result,) = fix_paths([path])
+    assert result.status == "changed"
+    assert result.original == code
+    assert result.replacements == {"os.path": ["exists"]}
+    assert "from os.path import exists" in result.fixed
+
+    (result,) = fix_paths([tmpdir], in_place=True)
+    assert result.status == "changed"
+    with open(path) as f:
+        nb = nbf.reads(f.read(), nbf.NO_CONVERT)
+    assert nb["cells"][1]["source"] == "## import\nfrom os.path import exists"
+    assert [result.status for result in fix_paths([path])] == ["skipped"]
+
+
+def test_fix_notebook_code(tmpdir):
+    from removestar.notebook import fix_notebook_code, read_notebook
+
+    path = str(tmpdir / "_test.ipynb")
+    prepare_nb(output_path=path)
+    with open(path, "rb") as f:
+        nb, code = read_notebook(f.read())
+
+    new_code, repls, replacements, _ = fix_notebook_code(code, file=path)
+    assert repls == {"os.path": ["exists"]}
+    assert replacements == {"from os.path import *": "from os.path import exists"}
+    assert new_code == code.replace("from os.path import *", "from os.path import exists")
+
+
+def test_cli_nb(tmpdir):
+    path = str(tmpdir / "_test.ipynb")
+    prepare_nb(output_path=path)
+
+    p = subprocess.run(
+        [sys.executable, "-m", "removestar", "-v", "-i", path],
+        capture_output=True,
+        encoding="utf-8",
+        check=False,
+    )
+    assert p.returncode == 1
+    # The code is only fixed once, and the messages are about the notebook
+    assert p.stderr.count("Replacing 'from os.path import *'") == 1
+    assert f"{path}: Replacing" in p.stderr
+    assert p.stdout.count("+from os.path import exists") == 1
+    with open(path) as f:
+        nb = nbf.reads(f.read(), nbf.NO_CONVERT)
+    assert nb["cells"][1]["source"] == "## import\nfrom os.path import exists"
+
+
+def test_replace_nb_cells():
+    from removestar.removestar import star_import_lines
+
+    nb = nbf.v4.new_notebook()
+    nb["cells"] = [
+        nbf.v4.new_markdown_cell("from os.path import *"),
+        nbf.v4.new_code_cell("from os.path import *\nfrom os import *  # comment\nexists"),
+        nbf.v4.new_code_cell("x = 1"),
+        nbf.v4.new_code_cell("if True:\n    from os.path import *\n"),
+    ]
+    nb["cells"][2]["outputs"] = [nbf.v4.new_output("stream", text="from os.path import *\n" * 1000)]
+    assert star_import_lines(nb["cells"]) == {
+        "from os.path import *": [(1, 0), (3, 1)],
+        "from os import *": [(1, 1)],
+    }
+
+    source = replace_in_nb(
+        nb,
+        {"from os.path import *": "from os.path import exists", "from os import *": ""},
+    )
+    new_nb = nbf.reads(source, nbf.NO_CONVERT)
+    assert [cell["source"] for cell in new_nb["cells"]] == [
+        "from os.path import *",
+        "from os.path import exists\n  # comment\nexists",
+        "x = 1",
+        "if True:\n    from os.path import exists\n",
+    ]
+    assert new_nb["cells"][2]["outputs"][0]["text"] == "from os.path import *\n" * 1000
+
+
+@pytest.mark.parametrize(
+    "sources",
+    [
+        ["from os.path import *", "exists"],
+        ["x = 1\n", "", "a\n\n", "  indented\n  block"],
+        ["%matplotlib inline\n!ls -l\nif x:\n    %time y\n", "%%time\nx = 1"],
+        # Only the lines that start a logical line can be magics
+        ["x = (join('a')\n     != 'b')\n!ls", "y = 1 \\\n    % 2\n%time y"],
+        ['s = """\n%not a magic\n"""\n%time s', "t = 'a\\\n!b'  # (\n!ls"],
+    ],
+)
+def test_read_notebook(sources):
+    from removestar.notebook import Notebook, read_notebook
+
+    nb = nbf.v4.new_notebook()
+    nb["cells"] = [nbf.v4.new_markdown_cell("# Title\n\ntext")]
+    nb["cells"] += [nbf.v4.new_code_cell(source, execution_count=1) for source in sources]
+    notebook, code = read_notebook(nbf.writes(nb).encode("utf-8"))
+    assert isinstance(notebook, Notebook)
+    assert code == nbc.PythonExporter().from_notebook_node(nb)[0]
+    compile(code, "<notebook>", "exec")
+
+
+def test_cli_nb_native(tmpdir):
+    path = str(tmpdir / "_test.ipynb")
+    prepare_nb(output_path=path)
+    with open(path) as f:
+        original = f.read()
+
+    # Notebooks in the current format are read and written without nbformat
+    # and nbconvert
+    p = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import sys; sys.modules['nbformat'] = sys.modules['nbconvert'] = None; "
+            "from removestar.__main__ import main; main()",
+            "-i",
+            path,
+        ],
+        capture_output=True,
+        encoding="utf-8",
+        check=False,
+    )
+    assert p.returncode == 1, p.stderr
+    assert "+from os.path import exists" in p.stdout
+    with open(path) as f:
+        fixed = f.read()
+    assert fixed == original.replace("from os.path import *", "from os.path import exists")
+
+
+def test_notebook_replace():
+    from removestar.notebook import read_notebook
+
+    nb = nbf.v4.new_notebook()
+    nb["cells"] = [
+        nbf.v4.new_code_cell("%matplotlib inline\nfrom os.path import *\n"),
+        nbf.v4.new_raw_cell("from os.path import *"),
+        nbf.v4.new_code_cell("from os import *\nfrom os.path import *  # comment"),
+    ]
+    notebook, code = read_notebook(nbf.writes(nb).encode("utf-8"))
+    changed = notebook.replace(
+        code, {"from os.path import *": "from os.path import exists", "from os import *": ""}
+    )
+    assert changed == [0, 2]
+    cells = notebook.nb["cells"]
+    assert cells[0]["source"] == ["%matplotlib inline\n", "from os.path import exists\n"]
+    assert cells[1]["source"] == ["from os.path import *"]
+    assert cells[2]["source"] == ["\n", "from os.path import exists  # comment"]
+
+
+def test_write_notebook_patch(tmpdir):
+    from removestar.notebook import fix_notebook_code, read_notebook, write_notebook
+
+    nb = nbf.v4.new_notebook()
+    nb["cells"] = [
+        nbf.v4.new_code_cell(["from os.path import *\n", "exists"]),
+        nbf.v4.new_code_cell("print('é')", execution_count=1),
+        nbf.v4.new_code_cell("from os import *\nsep"),
+    ]
+    nb["cells"][1]["outputs"] = [nbf.v4.new_output("stream", text="é\n" * 100)]
+    # Formatted differently than by nbformat
+    text = json.dumps(nb, indent=2, ensure_ascii=True).replace("[\n        ", "[  ", 1)
+    path = str(tmpdir / "nb.ipynb")
+    with open(path, "wb") as f:
+        f.write(text.encode("utf-8"))
+
+    notebook, code = read_notebook(text.encode("utf-8"))
+    _, _, replacements, _ = fix_notebook_code(code, file=path)
+    write_notebook(path, notebook, code, replacements)
+    with open(path, "rb") as f:
+        patched = f.read().decode("utf-8")
+    assert patched == text.replace(
+        '[  "from os.path import *\\n",\n        "exists"\n      ]',
+        '[  "from os.path import exists\\n",  "exists"\n      ]',
+    ).replace('"from os import *\\nsep"', '"from os import sep\\nsep"')
+
+    # Nothing is written if nothing changes
+    os.utime(path, ns=(0, 0))
+    notebook, code = read_notebook(patched.encode("utf-8"))
+    _, _, replacements, _ = fix_notebook_code(code, file=path)
+    write_notebook(path, notebook, code, replacements)
+    assert os.stat(path).st_mtime_ns == 0